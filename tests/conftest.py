@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests: generated input files, an empty DB, and a
+helper running the pipeline on them
+"""
+
+# Libraries
+from collections import Counter
+
+import pytest
+
+from xml_parser_db import connect
+from xml_parser_gen import generate_files
+from xml_parser_pipeline import run_pipeline
+
+
+@pytest.fixture
+def xml_files(tmp_path):
+    return generate_files(120, tmp_path / 'input', seed=1, malformed_ratio=0.2)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = connect(str(tmp_path / 'meter_data.sqlite'))
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def run(conn):
+    # run(xml_files, **kwargs): whole pipeline (serial backend) into conn.
+    # Returns its totals
+    def run(xml_files, batch_size=25, **kwargs):
+        totals = Counter()
+        for _ in run_pipeline(conn, xml_files, backend='serial', batch_size=batch_size,
+                              totals=totals, **kwargs):
+            pass
+        return totals
+    return run
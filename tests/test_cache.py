@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the parse cache (xml_parser_cache.py)
+"""
+
+# Libraries
+import shutil
+
+from pathlib import Path
+
+import pytest
+
+from xml_parser_cache import MB, ParseCache, encode, parse_cached
+from xml_parser_func import xml_parser
+from xml_parser_gen import generate_files
+
+
+SAMPLE_FILE = Path(__file__).parent.parent / 'input_data' / 'final-volumes.xml'
+
+
+@pytest.fixture
+def valid_files(tmp_path):
+    return generate_files(4, tmp_path / 'input', seed=7, malformed_ratio=0)
+
+
+def counting_parser(calls):
+    # xml_parser, appending the files it parses to calls
+    def parse(file_key, **kwargs):
+        calls.append(file_key)
+        return xml_parser(file_key, **kwargs)
+    return parse
+
+
+def blob_size(file_key):
+    return len(encode(xml_parser(file_key, layout='long', scaled_values=True)))
+
+
+def test_same_content_is_parsed_once(tmp_path):
+    # Same bytes under another name: read from the cache
+    a_file = str(shutil.copy(SAMPLE_FILE, tmp_path / 'a.xml'))
+    b_file = str(shutil.copy(SAMPLE_FILE, tmp_path / 'b.xml'))
+    calls = []
+    cache = ParseCache()
+
+    result, cached = parse_cached(cache, a_file, counting_parser(calls))
+    assert not cached
+    assert parse_cached(cache, b_file, counting_parser(calls)) == (result, True)
+    assert result == xml_parser(a_file, layout='long', scaled_values=True)
+    assert calls == [a_file] and (cache.hits, cache.misses) == (1, 1)
+
+    # Another content is parsed
+    Path(b_file).write_text(SAMPLE_FILE.read_text().replace('KWH', 'MWH'))
+    assert parse_cached(cache, b_file, counting_parser(calls))[1] is False
+    assert calls == [a_file, b_file]
+
+    # Files that fail are not cached
+    Path(b_file).write_text('<MeterData>')
+    for _ in range(2):
+        assert parse_cached(cache, b_file, counting_parser(calls)) == (None, False)
+    assert calls == [a_file, b_file, b_file, b_file]
+
+
+def test_memory_eviction(valid_files):
+    # Room for 2 results: the least recently used one goes
+    calls = []
+    cache = ParseCache(memory_mb=2.5 * max(map(blob_size, valid_files[:3])) / MB)
+
+    for file_key in valid_files[:2]:
+        parse_cached(cache, file_key, counting_parser(calls))
+    parse_cached(cache, valid_files[0], counting_parser(calls))
+    parse_cached(cache, valid_files[2], counting_parser(calls))
+    assert len(cache._memory) == 2 and cache._memory_size <= cache.memory_bytes
+
+    parse_cached(cache, valid_files[0], counting_parser(calls))
+    parse_cached(cache, valid_files[1], counting_parser(calls))
+    assert calls == valid_files[:3] + [valid_files[1]]
+
+
+def test_disk_cache(valid_files, tmp_path):
+    # Shared by the caches opened on the same file, and kept under disk_mb by
+    # evicting the least recently used entries
+    path = str(tmp_path / 'cache' / 'parse_cache.sqlite')
+    disk_mb = 2.5 * max(map(blob_size, valid_files)) / MB
+    calls = []
+
+    writer = ParseCache(path, disk_mb=disk_mb)
+    for file_key in valid_files[:2]:
+        parse_cached(writer, file_key, counting_parser(calls))
+        writer.flush()
+
+    reader = ParseCache(path, disk_mb=disk_mb)
+    assert parse_cached(reader, valid_files[0], counting_parser(calls))[1] is True
+    reader.flush()
+
+    # valid_files[1] is now the least recently used one
+    for file_key in valid_files[2:]:
+        parse_cached(writer, file_key, counting_parser(calls))
+        writer.flush()
+    writer.close()
+    reader.close()
+
+    reader = ParseCache(path, disk_mb=disk_mb)
+    total = reader.conn.execute("SELECT SUM(Size) FROM ParseCache").fetchone()[0]
+    assert total <= reader.disk_bytes
+    calls.clear()
+    for file_key in valid_files:
+        parse_cached(reader, file_key, counting_parser(calls))
+    assert valid_files[1] in calls and valid_files[3] not in calls
+    reader.close()
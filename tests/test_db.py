@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the SQLite load (xml_parser_db.py)
+"""
+
+# Libraries
+import shutil
+import sqlite3
+
+from pathlib import Path
+
+import pytest
+
+from xml_parser_db import connect, migrate_wide_table, table_exists
+from xml_parser_func import xml_parser
+from xml_parser_pipeline import run_pipeline
+
+
+ROOT = Path(__file__).parent.parent
+
+
+def test_migrate_wide_table(tmp_path):
+    # The DB shipped with the repo was loaded by the first version (wide
+    # MeterData table, one row per file)
+    file_db = tmp_path / 'meter_data.sqlite'
+    shutil.copy(ROOT / 'sqlite_db' / 'meter_data.sqlite', file_db)
+    conn = sqlite3.connect(file_db)
+
+    legacy = conn.execute("SELECT COUNT(*) FROM MeterData").fetchone()[0]
+    assert migrate_wide_table(conn) == legacy
+    conn.commit()
+
+    assert not table_exists(conn, 'MeterData')
+    assert table_exists(conn, 'MeterData_legacy')
+    assert migrate_wide_table(conn) == 0
+
+    # Same values as the input file, exactly (hundredths)
+    header, readings = xml_parser(str(ROOT / 'input_data' / 'final-volumes.xml'),
+                                  layout='long', scaled_values=True)
+    rows = conn.execute("""
+        SELECT r.Sequence, r.ValueCenti, r.Quality
+        FROM MeterHeader h JOIN MeterReadings r ON r.FileId = h.FileId
+        WHERE h.DataType = 'Final' ORDER BY r.Sequence""").fetchall()
+    assert rows == [(int(sequence), value, quality) for sequence, value, quality
+                    in zip(readings['Sequence'], readings['Value'], readings['Quality'])]
+
+    assert conn.execute("SELECT FromTimestamp FROM MeterHeader WHERE DataType = 'Final'"
+                        ).fetchone()[0] == '2025-05-06 22:00:00+00:00'
+    conn.close()
+
+
+def legacy_db_with_a_nan(tmp_path):
+    # Shipped DB where a value of the Final file could not be read by the
+    # first version, which stored it as NaN (NULL). Returns its path and the
+    # FileKeys of the Final and Provisional files
+    file_db = tmp_path / 'meter_data.sqlite'
+    shutil.copy(ROOT / 'sqlite_db' / 'meter_data.sqlite', file_db)
+    conn = sqlite3.connect(file_db)
+    conn.execute("UPDATE MeterData SET Readings_3_Value = NULL WHERE DataType = 'Final'")
+    conn.commit()
+    keys = dict((data_type, f'MeterData:{row_id}') for row_id, data_type
+                in conn.execute("SELECT rowid, DataType FROM MeterData"))
+    conn.close()
+    return file_db, keys
+
+
+def test_migrate_values_that_are_not_numbers(tmp_path):
+    # That file is left in MeterData_legacy, the other one is moved
+    file_db, keys = legacy_db_with_a_nan(tmp_path)
+    conn = sqlite3.connect(file_db)
+
+    skipped = []
+    assert migrate_wide_table(conn, skipped) == 1
+    assert skipped == [keys['Final']]
+    assert conn.execute("SELECT FileKey, DataType FROM MeterHeader").fetchall() == [
+        (keys['Provisional'], 'Provisional')]
+    assert conn.execute("SELECT COUNT(*) FROM MeterData_legacy").fetchone()[0] == 2
+    conn.close()
+
+
+def test_run_on_a_legacy_db_with_a_nan(tmp_path):
+    # The migration runs at the start of the run, which must not fail
+    file_db, keys = legacy_db_with_a_nan(tmp_path)
+    conn = connect(str(file_db))
+    for _ in run_pipeline(conn, [], backend='serial'):
+        pass
+    assert conn.execute("SELECT FileKey FROM MeterHeader").fetchall() == [(keys['Provisional'],)]
+    assert conn.execute("SELECT Status FROM IngestRuns").fetchall() == [('completed',)]
+    conn.close()
+
+
+def test_rerun_skips_the_files_loaded(run, xml_files):
+    totals = run(xml_files)
+    assert totals['new'] == totals['files'] == len(xml_files)
+
+    # Nothing new: nothing is parsed
+    totals = run(xml_files)
+    assert totals['listed'] == len(xml_files)
+    assert totals['new'] == totals['files'] == 0
+
+    # A file that changed is loaded again
+    path = Path(xml_files[0])
+    path.write_text(path.read_text() + '\n')
+    totals = run(xml_files)
+    assert totals['new'] == totals['files'] == 1
+
+
+def version(tmp_path, name, data_type, created):
+    # Copy of the sample file (one day of one meter) with another DataType
+    # and CreationTimestamp
+    content = (ROOT / 'input_data' / 'final-volumes.xml').read_text()
+    content = content.replace('<DataType>Final</DataType>', f'<DataType>{data_type}</DataType>')
+    content = content.replace('2025-06-09T13:12:17+02:00', created)
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+
+@pytest.mark.parametrize('same_batch', [False, True], ids=['one_run_each', 'same_batch'])
+@pytest.mark.parametrize('reverse', [False, True], ids=['in_order', 'reversed'])
+def test_upsert_precedence(conn, run, tmp_path, same_batch, reverse):
+    # Final wins over Provisional whatever their CreationTimestamp, then the
+    # newest CreationTimestamp wins
+    xml_files = [
+        version(tmp_path, 'provisional.xml', 'Provisional', '2025-05-08T13:00:00+02:00'),
+        version(tmp_path, 'final.xml', 'Final', '2025-06-09T13:00:00+02:00'),
+        version(tmp_path, 'provisional_later.xml', 'Provisional', '2025-07-01T13:00:00+02:00'),
+        version(tmp_path, 'final_later.xml', 'Final', '2025-07-09T13:00:00+02:00'),
+        version(tmp_path, 'final_earlier.xml', 'Final', '2025-06-01T13:00:00+02:00'),
+        ]
+    if reverse:
+        xml_files.reverse()
+
+    if same_batch:
+        run(xml_files)
+    else:
+        for xml_file in xml_files:
+            run([xml_file])
+
+    assert conn.execute("SELECT FileKey, DataType, CreationTimestamp FROM MeterHeader"
+                        ).fetchall() == [(str(tmp_path / 'final_later.xml'), 'Final',
+                                          '2025-07-09 11:00:00+00:00')]
+    assert conn.execute("SELECT COUNT(*) FROM MeterReadings").fetchone()[0] == 24
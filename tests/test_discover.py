@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the discovery of the input files (xml_parser_discover.py)
+"""
+
+# Libraries
+import datetime as dt
+import os
+
+import pytest
+
+from xml_parser_discover import discover_files, filter_keys, parse_shard
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    # Day folders (a nested one too), dated names in a folder without a date,
+    # and names without a date
+    names = [
+        '2025-05-06/a_Final.xml', '2025-05-06/a_Provisional.xml',
+        '2025-05-07/b_Final.xml', '2025-05-07/sub/c_Final.xml', '2025-05-07/notes.txt',
+        '2025-05-08/d_Provisional.xml',
+        'backlog/e_2025-05-06_Final.xml', 'backlog/f_2025-05-09_Final.xml',
+        'g_Final.xml', 'h_2025-05-07_Provisional.xml',
+        ]
+    for name in names:
+        path = tmp_path / 'input' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('<x/>')
+    return tmp_path / 'input'
+
+
+def relative(paths, input_path):
+    return sorted(os.path.relpath(path, input_path).replace(os.sep, '/') for path in paths)
+
+
+def test_top_folder_only(input_path):
+    assert relative(discover_files(input_path), input_path) == \
+        ['g_Final.xml', 'h_2025-05-07_Provisional.xml']
+
+
+def test_date_range(input_path):
+    # Dates from the day folders, else from the names; no date: always kept
+    files = discover_files(input_path, recursive=True,
+                           start_date=dt.date(2025, 5, 7), end_date=dt.date(2025, 5, 8))
+    assert relative(files, input_path) == [
+        '2025-05-07/b_Final.xml', '2025-05-07/sub/c_Final.xml',
+        '2025-05-08/d_Provisional.xml', 'g_Final.xml', 'h_2025-05-07_Provisional.xml',
+        ]
+
+    files = discover_files(input_path, recursive=True, end_date=dt.date(2025, 5, 6))
+    assert relative(files, input_path) == [
+        '2025-05-06/a_Final.xml', '2025-05-06/a_Provisional.xml',
+        'backlog/e_2025-05-06_Final.xml', 'g_Final.xml',
+        ]
+
+
+def test_pattern(input_path):
+    files = discover_files(input_path, recursive=True, pattern='*_Provisional.xml')
+    assert relative(files, input_path) == [
+        '2025-05-06/a_Provisional.xml', '2025-05-08/d_Provisional.xml',
+        'h_2025-05-07_Provisional.xml',
+        ]
+
+
+def test_shards_split_the_files(input_path):
+    every = relative(discover_files(input_path, recursive=True), input_path)
+    assert len(every) == 9
+
+    n = 3
+    shards = [relative(discover_files(input_path, recursive=True, shard=(i, n)), input_path)
+              for i in range(1, n + 1)]
+    assert sum(len(files) for files in shards) == len(every)
+    assert sorted(file for files in shards for file in files) == every
+
+    # filter_keys puts the listed keys in the same shards
+    keys = [f's3://bucket/input/{file}' for file in every]
+    for i, files in enumerate(shards, start=1):
+        assert [key[len('s3://bucket/input/'):]
+                for key in filter_keys(keys, prefix='s3://bucket/input/', shard=(i, n))] == files
+
+
+def test_filter_keys(input_path):
+    keys = [('input/2025-05-06/a_Final.xml', 1), ('input/2025-05-08/d_Provisional.xml', 2),
+            ('input/g_Final.xml', 3)]
+    assert list(filter_keys(keys, prefix='input/', start_date=dt.date(2025, 5, 7),
+                            pattern='*_Final.xml')) == [('input/g_Final.xml', 3)]
+
+
+@pytest.mark.parametrize('text', ['1', '0/4', '5/4', 'a/b'])
+def test_invalid_shard(text):
+    with pytest.raises(ValueError, match='Invalid shard'):
+        parse_shard(text)
+    assert parse_shard('2/4') == (2, 4)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the parse backends (xml_parser_exec.py)
+"""
+
+# Libraries
+import multiprocessing
+import os
+
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import xml_parser_exec
+
+from xml_parser_exec import parse_files
+from xml_parser_func import xml_parser
+from xml_parser_gen import generate_files
+
+
+@pytest.fixture
+def valid_files(tmp_path):
+    # No malformed file: the only errors are the ones of the tests
+    return generate_files(20, tmp_path / 'input', seed=5, malformed_ratio=0)
+
+
+def failing_parser(fail_on, crash=False):
+    # xml_parser, except for the file fail_on: raises, or kills the process
+    def parse(file_key, **kwargs):
+        if file_key == fail_on:
+            if crash:
+                os._exit(1)
+            raise RuntimeError('parser bug')
+        return xml_parser(file_key, **kwargs)
+    return parse
+
+
+@pytest.mark.parametrize('backend', ['serial', 'threads'])
+def test_error_of_one_file(valid_files, monkeypatch, backend):
+    # Only that file fails, the rest of its batch is parsed
+    monkeypatch.setitem(xml_parser_exec.PARSERS, 'generic', failing_parser(valid_files[3]))
+
+    batches = list(parse_files(valid_files, backend=backend, max_workers=2, batch_size=5))
+    errors = {key: error for _, _, stats in batches for key, error in stats['errors'].items()}
+    assert errors == {valid_files[3]: 'RuntimeError: parser bug'}
+    assert sum(len(df_header) for _, (df_header, _), _ in batches) == len(valid_files) - 1
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='the workers must inherit the patched parser')
+def test_broken_pool_is_raised(valid_files, monkeypatch):
+    # A dead worker is not an error of the files of its batch
+    monkeypatch.setitem(xml_parser_exec.PARSERS, 'generic',
+                        failing_parser(valid_files[3], crash=True))
+
+    with pytest.raises(BrokenProcessPool):
+        for _ in parse_files(valid_files, backend='processes', max_workers=2, batch_size=5):
+            pass
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the xml parsers (xml_parser_func.py and xml_parser_fast.py)
+"""
+
+# Libraries
+import re
+
+from pathlib import Path
+
+import pytest
+
+import xml_parser_fast
+
+from xml_parser_fast import check_equivalence, fast_parser
+from xml_parser_func import xml_parser, xml_parser_xmltodict
+from xml_parser_gen import generate_files
+
+
+SAMPLE_FILE = Path(__file__).parent.parent / 'input_data' / 'final-volumes.xml'
+
+
+@pytest.fixture
+def namespaced_file(tmp_path):
+    # Same file, with a default namespace on the root
+    content = SAMPLE_FILE.read_text(encoding='utf-8')
+    content = content.replace('<MeterData ', '<MeterData xmlns="urn:example:meterdata" ', 1)
+    path = tmp_path / 'namespaced.xml'
+    path.write_text(content, encoding='utf-8')
+    return path
+
+
+def test_same_result_as_xmltodict():
+    assert xml_parser(str(SAMPLE_FILE)) == xml_parser_xmltodict(str(SAMPLE_FILE))
+
+
+def test_default_namespace(namespaced_file):
+    # The tags are '{uri}MeterData'...: read by their local names, as xmltodict does
+    expected = xml_parser_xmltodict(str(namespaced_file))
+    assert len(expected) == 80
+
+    assert xml_parser(str(namespaced_file)) == expected
+    assert fast_parser(str(namespaced_file)) == expected
+    assert (xml_parser(str(namespaced_file), layout='long')
+            == xml_parser(str(SAMPLE_FILE), layout='long'))
+
+
+# Changes of the sample file that the fast parser must leave to xml_parser
+# (or read the same way)
+VARIANTS = {
+    'truncated':      lambda text: text[:len(text) // 3],
+    'comment':        lambda text: text.replace('<Unit>', '<!-- kWh --><Unit>', 1),
+    'entity':         lambda text: text.replace('KWH', 'K&#87;H', 1),
+    'cdata':          lambda text: text.replace('KWH', '<![CDATA[KWH]]>', 1),
+    'empty_element':  lambda text: text.replace('<Quality>Measured</Quality>', '<Quality/>', 1),
+    'blank_value':    lambda text: re.sub(r'<Value>[^<]*</Value>', '<Value> </Value>', text, 1),
+    'bad_value':      lambda text: re.sub(r'<Value>[^<]*</Value>', '<Value>1.234</Value>', text, 1),
+    'field_order':    lambda text: re.sub(r'(<Resolution>.*?</Resolution>)(\s*)(<Unit>.*?</Unit>)',
+                                          r'\3\2\1', text, 1, re.S),
+    'extra_element':  lambda text: text.replace('<Unit>', '<Extra>1</Extra><Unit>', 1),
+    'duplicate_attr': lambda text: text.replace('<MeterData ', '<MeterData a="1" a="2" ', 1),
+    'latin1':         lambda text: '<?xml version="1.0" encoding="ISO-8859-1"?>\n' + text,
+    'not_meter_data': lambda text: text.replace('MeterData', 'MeterDatum'),
+    }
+
+
+@pytest.mark.parametrize('scaled_values', [True, False])
+def test_equivalence_on_malformed_files(tmp_path, scaled_values):
+    # Generated files, every one of them with an error
+    xml_files = generate_files(60, tmp_path / 'generated', seed=3, malformed_ratio=1)
+    assert check_equivalence(xml_files, scaled_values=scaled_values) == []
+
+    content = SAMPLE_FILE.read_text(encoding='utf-8')
+    for name, change in VARIANTS.items():
+        path = tmp_path / f'{name}.xml'
+        path.write_text(change(content), encoding='utf-8')
+        assert path.read_text(encoding='utf-8') != content, name
+        assert check_equivalence([str(path)], scaled_values=scaled_values) == [], name
+
+
+def test_equivalence_finds_differences(monkeypatch):
+    # A fast path reading something else is reported
+    parse = xml_parser_fast.SCHEMA.parse
+
+    def wrong_parse(data, scaled_values=False):
+        header, readings = parse(data, scaled_values)
+        return dict(header, Unit='MWH'), readings
+
+    monkeypatch.setattr(xml_parser_fast.SCHEMA, 'parse', wrong_parse)
+    assert check_equivalence([str(SAMPLE_FILE)]) == [str(SAMPLE_FILE)]
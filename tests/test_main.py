@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the settings and entry point (xml_parser_main.py)
+"""
+
+# Libraries
+import pytest
+
+from xml_parser_main import load_settings, main, parse_args, read_config
+
+
+def test_paths_relative_to_the_config_file(tmp_path, monkeypatch):
+    config_file = tmp_path / 'conf' / 'params.cfg'
+    config_file.parent.mkdir()
+    config_file.write_text('[Paths]\ninput_path: input_data\noutput_path: sqlite_db\n'
+                           '[Cache]\npath: cache/parse_cache.sqlite\n')
+    monkeypatch.chdir(tmp_path)
+
+    settings = load_settings(read_config(parse_args(['--config', str(config_file)])))
+    assert settings['input_path'] == str(config_file.parent / 'input_data')
+    assert settings['output_path'] == str(config_file.parent / 'sqlite_db')
+    assert settings['cache']['path'] == str(config_file.parent / 'cache' / 'parse_cache.sqlite')
+
+    # The command line ones are relative to the current folder
+    settings = load_settings(read_config(parse_args(['--config', str(config_file),
+                                                     '--input', 'other'])))
+    assert settings['input_path'] == 'other'
+
+
+@pytest.mark.parametrize('mode', [['--list'], ['--dry-run'], []])
+def test_missing_input_folder(tmp_path, mode):
+    with pytest.raises(SystemExit, match='not found'):
+        main(['--config', str(tmp_path / 'params.cfg'), '--input', str(tmp_path / 'missing'),
+              '--output', str(tmp_path / 'sqlite_db'), '--no-progress'] + mode)
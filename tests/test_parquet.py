@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Parquet output (xml_parser_parquet.py) written by the pipeline
+"""
+
+# Libraries
+import re
+
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import xml_parser_pipeline
+
+from xml_parser_parquet import read_parquet
+
+
+def assert_same_as_sqlite(conn, parquet_path):
+    # One row per reading of the versions stored in SQLite, nothing else
+    df = read_parquet(str(parquet_path))
+    stored = conn.execute("""
+        SELECT h.FileKey, h.DataType, r.Sequence, r.ValueCenti
+        FROM MeterHeader h JOIN MeterReadings r ON r.FileId = h.FileId""").fetchall()
+
+    parquet = list(zip(df['FileKey'].astype(str), df['DataType'].astype(str), df['Sequence'],
+                       (df['Value'] * 100).astype(int)))
+    assert len(parquet) == len(set(parquet))
+    assert sorted(parquet) == sorted(stored)
+
+
+def test_parquet_mirrors_sqlite(conn, run, xml_files, tmp_path):
+    parquet_path = tmp_path / 'parquet'
+    totals = run(xml_files, batch_size=10, parquet_path=str(parquet_path))
+    assert totals['parquet_rows'] > 0
+    assert_same_as_sqlite(conn, parquet_path)
+
+    # One file per batch and partition, not one per input file
+    names = [path.name for path in parquet_path.glob('*/*/*.parquet')]
+    assert all(re.fullmatch(r'part-\d+-\d+\.parquet', name) for name in names)
+    n_partitions = len(list(parquet_path.glob('*/*')))
+    assert len(names) < totals['files_written']
+    assert len(names) <= n_partitions * -(-len(xml_files) // 10)
+
+    # Loading the same files again replaces their rows
+    run(xml_files, batch_size=10, parquet_path=str(parquet_path), reprocess=True)
+    assert_same_as_sqlite(conn, parquet_path)
+
+    # A stored file that is now rejected is removed from the dataset too
+    file_key = conn.execute("SELECT FileKey FROM MeterHeader LIMIT 1").fetchone()[0]
+    path = Path(file_key)
+    path.write_text(path.read_text().replace('<Sequence>2</Sequence>',
+                                             '<Sequence>99</Sequence>'))
+    totals = run(xml_files, batch_size=10, parquet_path=str(parquet_path), reprocess=True)
+    assert totals['rejected_sequence'] >= 1
+    assert_same_as_sqlite(conn, parquet_path)
+    assert file_key not in set(read_parquet(str(parquet_path))['FileKey'].astype(str))
+
+
+def test_rolled_back_files_are_not_written(conn, run, xml_files, tmp_path, monkeypatch):
+    # A file that can't be loaded is rolled back with the first attempt of
+    # its batch: the dataset only gets what was committed
+    parquet_path = tmp_path / 'parquet'
+    upsert_tables = xml_parser_pipeline.upsert_tables
+    broken = xml_files[0]
+
+    def failing_upsert(conn, df_header, *args, **kwargs):
+        counts = upsert_tables(conn, df_header, *args, **kwargs)
+        if broken in set(df_header['FileKey']):
+            raise ValueError('cannot load this file')
+        return counts
+
+    monkeypatch.setattr(xml_parser_pipeline, 'upsert_tables', failing_upsert)
+    totals = run(xml_files, batch_size=10, parquet_path=str(parquet_path))
+
+    assert conn.execute("SELECT Stage FROM FailedFiles WHERE FileKey = ?",
+                        (broken,)).fetchall() == [('load',)]
+    assert totals['parquet_rows'] == totals['readings_written']
+    assert_same_as_sqlite(conn, parquet_path)
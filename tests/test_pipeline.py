@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the streaming pipeline (xml_parser_pipeline.py) on generated files
+"""
+
+# Libraries
+import multiprocessing
+import os
+import shutil
+
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+import xml_parser_exec
+
+from xml_parser_func import xml_parser
+from xml_parser_pipeline import run_pipeline
+
+
+INPUT_DATA = Path(__file__).parent.parent / 'input_data'
+
+
+def test_rejections_are_recorded(conn, run, xml_files):
+    totals = run(xml_files)
+    assert totals['rejected'] > 0
+
+    # One row per file and rule broken, in the run
+    rows = conn.execute("SELECT RunId, FileKey, Rule FROM RejectedFiles").fetchall()
+    assert {run_id for run_id, _, _ in rows} == {totals['run_id']}
+    assert len({file_key for _, file_key, _ in rows}) == totals['rejected']
+
+    per_rule = Counter(rule for _, _, rule in rows)
+    assert per_rule == Counter({key[len('rejected_'):]: count for key, count in totals.items()
+                                if key.startswith('rejected_')})
+
+
+@pytest.mark.parametrize('order', ['provisional_first', 'final_first'])
+def test_reprocess_falls_back_to_a_valid_version(conn, run, tmp_path, order):
+    # Provisional and Final versions of the same day: the Final one is stored,
+    # then it is rejected (here, a changed Sequence) and the files are
+    # reprocessed one per batch. The Provisional one must be stored again,
+    # whichever batch comes first
+    a_file = str(shutil.copy(INPUT_DATA / 'provisional-volumes.xml', tmp_path / 'a.xml'))
+    b_file = str(shutil.copy(INPUT_DATA / 'final-volumes.xml', tmp_path / 'b.xml'))
+    xml_files = [a_file, b_file] if order == 'provisional_first' else [b_file, a_file]
+
+    run(xml_files, batch_size=1, rollups=True)
+    assert conn.execute("SELECT FileKey, DataType FROM MeterHeader").fetchall() == [
+        (b_file, 'Final')]
+
+    path = Path(b_file)
+    path.write_text(path.read_text().replace('<Sequence>2</Sequence>',
+                                             '<Sequence>99</Sequence>'))
+    totals = run(xml_files, batch_size=1, reprocess=True, rollups=True)
+
+    assert totals['rejected_sequence'] == 1 and totals['files_deleted'] == 1
+    assert conn.execute("SELECT FileKey, DataType FROM MeterHeader").fetchall() == [
+        (a_file, 'Provisional')]
+    assert conn.execute("SELECT DataType FROM MeterDaily").fetchall() == [('Provisional',)]
+
+
+def test_quarantine(conn, run, xml_files):
+    totals = run(xml_files)
+    failed = dict(conn.execute("SELECT FileKey, Stage FROM FailedFiles").fetchall())
+    assert len(failed) == totals['failed'] > 0
+    assert set(failed.values()) == {'parse'}
+
+    # In the manifest: not parsed again while they don't change
+    assert run(xml_files)['new'] == 0
+
+    # Fixed: loaded, and out of the quarantine. Still broken: one more attempt
+    fixed, broken = sorted(failed)[:2]
+    shutil.copy(INPUT_DATA / 'final-volumes.xml', fixed)
+    Path(broken).write_text('<MeterData>')
+    totals = run(xml_files)
+
+    assert totals['new'] == 2 and totals['failed'] == 1
+    assert conn.execute("SELECT FileKey, Attempts FROM FailedFiles WHERE FileKey IN (?, ?)",
+                        (fixed, broken)).fetchall() == [(broken, 2)]
+    assert conn.execute("SELECT COUNT(*) FROM MeterHeader WHERE FileKey = ?",
+                        (fixed,)).fetchone()[0] == 1
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='the workers must inherit the patched parser')
+def test_killed_worker_then_resume(conn, run, xml_files, monkeypatch):
+    # A worker killed in the middle of the run stops it: the files of the
+    # batches in flight are neither checkpointed nor quarantined
+    crash_on = xml_files[60]
+
+    def parse(file_key, **kwargs):
+        if file_key == crash_on:
+            os._exit(1)
+        return xml_parser(file_key, **kwargs)
+
+    monkeypatch.setitem(xml_parser_exec.PARSERS, 'generic', parse)
+    totals = Counter()
+    with pytest.raises(BrokenProcessPool):
+        for _ in run_pipeline(conn, xml_files, backend='processes', max_workers=2,
+                              batch_size=10, totals=totals):
+            pass
+
+    assert conn.execute("SELECT Status FROM IngestRuns WHERE RunId = ?",
+                        (totals['run_id'],)).fetchone() == ('failed',)
+    processed = {file_key for file_key, in conn.execute("SELECT FileKey FROM ProcessedFiles")}
+    assert crash_on not in processed
+    assert len(processed) == conn.execute("SELECT SUM(Files) FROM IngestBatches").fetchone()[0]
+    assert len(processed) < len(xml_files)
+    assert not conn.execute("SELECT FileKey FROM FailedFiles WHERE Error LIKE '%Pool%' "
+                            "OR FileKey = ?", (crash_on,)).fetchall()
+
+    # Fixed and resumed: the same run loads the rest
+    monkeypatch.undo()
+    resumed = run(xml_files, resume=True)
+
+    assert resumed['run_id'] == totals['run_id']
+    assert resumed['new'] == len(xml_files) - len(processed)
+    assert conn.execute("SELECT COUNT(*) FROM ProcessedFiles").fetchone()[0] == len(xml_files)
+    assert conn.execute("SELECT Status, Files FROM IngestRuns WHERE RunId = ?",
+                        (totals['run_id'],)).fetchone() == ('completed', len(xml_files))
+
+
+@pytest.mark.parametrize('order', ['provisional_first', 'final_first'])
+def test_interrupted_reprocess_keeps_the_day(conn, run, tmp_path, order):
+    # Same files as above, the run stopped after its first batch: the day
+    # still has a version, and running again finishes the job
+    a_file = str(shutil.copy(INPUT_DATA / 'provisional-volumes.xml', tmp_path / 'a.xml'))
+    b_file = str(shutil.copy(INPUT_DATA / 'final-volumes.xml', tmp_path / 'b.xml'))
+    xml_files = [a_file, b_file] if order == 'provisional_first' else [b_file, a_file]
+    run(xml_files, batch_size=1, rollups=True)
+
+    path = Path(b_file)
+    path.write_text(path.read_text().replace('<Sequence>2</Sequence>',
+                                             '<Sequence>99</Sequence>'))
+    batches = run_pipeline(conn, xml_files, backend='serial', batch_size=1, reprocess=True,
+                           rollups=True)
+    next(batches)
+    batches.close()
+
+    assert conn.execute("SELECT FileKey, DataType FROM MeterHeader").fetchall() == [
+        (a_file, 'Provisional')]
+    assert conn.execute("SELECT DataType FROM MeterDaily").fetchall() == [('Provisional',)]
+
+    for reprocess in (False, True):
+        run(xml_files, batch_size=1, reprocess=reprocess, rollups=True)
+        assert conn.execute("SELECT FileKey, DataType FROM MeterHeader").fetchall() == [
+            (a_file, 'Provisional')]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the PySpark job (xml_parser_pyspark.py), in local mode. Skipped
+without pyspark or a Java runtime (JAVA_HOME or java in the PATH)
+"""
+
+# Libraries
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip('pyspark')
+if not (os.getenv('JAVA_HOME') or shutil.which('java')):
+    pytest.skip('no Java runtime', allow_module_level=True)
+
+from pyspark.sql import SparkSession
+
+import xml_parser_pyspark as job
+
+from xml_parser_exec import parse_files
+from xml_parser_gen import generate_files
+from xml_parser_tables import convert_timestamps
+from xml_parser_validation import validate
+
+
+@pytest.fixture(scope='module', params=['false', 'true'], ids=['default', 'ansi'])
+def spark(request):
+    spark = (SparkSession.builder.master('local[2]')
+             .config('spark.sql.session.timeZone', 'UTC')
+             .config('spark.sql.ansi.enabled', request.param)
+             .getOrCreate())
+    yield spark
+    spark.stop()
+
+
+def test_same_validation_as_the_pipeline(spark, tmp_path):
+    xml_files = generate_files(60, tmp_path, seed=3, malformed_ratio=0.2)
+
+    rdd = spark.sparkContext.parallelize(xml_files, 2).mapPartitions(job.process_partition)
+    df_files = job.validate(spark.createDataFrame(rdd, schema=job.FILE_SCHEMA), 'Europe/Zurich')
+    rows = df_files.select('FileKey', 'RejectedRules').collect()
+
+    # Same files and rules as xml_parser_validation.py
+    [(_, (df_header, df_readings), _)] = parse_files(xml_files, backend='serial',
+                                                     batch_size=len(xml_files))
+    _, df_valid_readings, df_rejected = validate(convert_timestamps(df_header), df_readings)
+
+    expected = {file_key: set() for file_key in df_header['FileKey']}
+    for file_key, rule in zip(df_rejected['FileKey'], df_rejected['Rule']):
+        expected[file_key].add(rule)
+
+    assert {row['FileKey']: set(row['RejectedRules']) for row in rows} == expected
+    assert df_rejected['FileKey'].nunique() > 0
+
+    df_readings = job.to_readings(df_files.filter('IsValid'), 'Europe/Zurich')
+    assert df_readings.count() == len(df_valid_readings)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the read-side queries (xml_parser_query.py) and their cache
+"""
+
+# Libraries
+import datetime as dt
+
+import pytest
+
+from xml_parser_query import MeterQueries
+
+
+START, END = dt.date(2000, 1, 1), dt.date(2100, 1, 1)
+
+
+@pytest.fixture
+def queries(conn, tmp_path):
+    queries = MeterQueries(str(tmp_path / 'meter_data.sqlite'), cache_size=2)
+    yield queries
+    queries.close()
+
+
+def test_cache_hits_and_eviction(run, xml_files, queries):
+    run(xml_files, rollups=True)
+
+    first = queries.daily_totals(START, END)
+    assert len(first) > 0
+    assert queries.daily_totals(START, END).equals(first)
+    assert (queries.hits, queries.misses) == (1, 1)
+
+    # A copy: changing a result does not change the cached one
+    first['ValueCenti'] = 0
+    assert not queries.daily_totals(START, END).equals(first)
+    assert queries.hits == 2
+
+    # Least recently used first: daily_totals was used last, latest_versions goes
+    queries.latest_versions(START, END)
+    queries.daily_totals(START, END)
+    queries.daily_rollup(START, END)
+    assert list(queries._cache) == [('daily_totals', START, END, None),
+                                    ('daily_rollup', START, END, None)]
+    queries.latest_versions(START, END)
+    assert queries.misses == 4
+
+
+def test_cache_emptied_after_a_write(run, xml_files, queries):
+    # Another connection (the ingestion) commits: data_version changes and the
+    # next query reads the DB again
+    run(xml_files[:60])
+    before = queries.latest_versions(START, END)
+    queries.latest_versions(START, END)
+    assert (queries.hits, queries.misses) == (1, 1)
+
+    run(xml_files[60:])
+    after = queries.latest_versions(START, END)
+    assert queries.misses == 2
+    assert len(after) > len(before)
+    assert set(before['FileKey']) < set(after['FileKey'])
+
+    # No commit since: served from the cache
+    queries.latest_versions(START, END)
+    assert queries.hits == 2
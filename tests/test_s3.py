@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the S3 source (xml_parser_s3.py) against moto's in-memory S3
+"""
+
+# Libraries
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from botocore.exceptions import ClientError
+
+from xml_parser_db import connect
+from xml_parser_gen import generate_files
+from xml_parser_pipeline import run_pipeline
+from xml_parser_s3 import S3Source
+
+
+BUCKET = 'sample-bucket-name'
+PREFIX = 'root_folder/2025-05-07/'
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def uploaded(s3_client, tmp_path):
+    # Generated files (some malformed), plus an object that is not an .xml
+    keys = []
+    for path in generate_files(40, tmp_path / 'generated', seed=2, malformed_ratio=0.1):
+        key = PREFIX + Path(path).name
+        s3_client.put_object(Bucket=BUCKET, Key=key, Body=Path(path).read_bytes())
+        keys.append(key)
+    s3_client.put_object(Bucket=BUCKET, Key=PREFIX + 'notes.txt', Body=b'not a meter file')
+    return keys
+
+
+class FlakyClient:
+    # Client whose first GETs of each key fail with a server error, and whose
+    # GETs of the denied keys always fail with 403
+
+    def __init__(self, client, failures=2, denied=()):
+        self._client = client
+        self.failures = failures
+        self.denied = set(denied)
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def get_object(self, Bucket, Key):
+        self.calls[Key] += 1
+        if Key in self.denied:
+            raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'denied'},
+                               'ResponseMetadata': {'HTTPStatusCode': 403}}, 'GetObject')
+        if self.calls[Key] <= self.failures:
+            raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'try again'},
+                               'ResponseMetadata': {'HTTPStatusCode': 500}}, 'GetObject')
+        return self._client.get_object(Bucket=Bucket, Key=Key)
+
+
+def run(conn, source, **kwargs):
+    totals = Counter()
+    for _ in run_pipeline(conn, source.list_objects(PREFIX), fetch=source.fetch,
+                          batch_size=10, totals=totals, **kwargs):
+        pass
+    return totals
+
+
+def test_list_objects(s3_client, uploaded):
+    listed = dict(S3Source(BUCKET, client=s3_client).list_objects(PREFIX))
+    assert sorted(listed) == sorted(uploaded)
+    assert all(size > 0 and mtime_ns > 0 for size, mtime_ns in listed.values())
+
+
+def test_get_retries_server_errors(s3_client, uploaded):
+    client = FlakyClient(s3_client, failures=2)
+    source = S3Source(BUCKET, client=client, max_attempts=3, backoff_base=0)
+
+    assert source.get(uploaded[0]) == s3_client.get_object(Bucket=BUCKET,
+                                                           Key=uploaded[0])['Body'].read()
+    assert client.calls[uploaded[0]] == 3
+
+    # Beyond max_attempts, the error is raised
+    source = S3Source(BUCKET, client=FlakyClient(s3_client, failures=3), max_attempts=3,
+                      backoff_base=0)
+    with pytest.raises(ClientError):
+        source.get(uploaded[0])
+
+
+def test_missing_object_is_not_retried(s3_client):
+    client = FlakyClient(s3_client, failures=0)
+    source = S3Source(BUCKET, client=client, backoff_base=0)
+    with pytest.raises(ClientError):
+        source.get(PREFIX + 'missing.xml')
+    assert client.calls[PREFIX + 'missing.xml'] == 1
+
+
+@pytest.mark.parametrize('backend', ['threads', 'processes'])
+def test_pipeline_from_s3(s3_client, uploaded, tmp_path, backend):
+    conn = connect(str(tmp_path / 'meter_data.sqlite'))
+    try:
+        source = S3Source(BUCKET, client=s3_client, max_in_flight=4)
+        totals = run(conn, source, backend=backend, max_workers=2)
+
+        assert totals['listed'] == totals['new'] == len(uploaded)
+        assert totals['files'] == len(uploaded)
+        assert totals['valid'] + totals['rejected'] + totals['failed'] == len(uploaded)
+        assert source.files_read == len(uploaded)
+        stored = conn.execute("SELECT COUNT(*) FROM ProcessedFiles").fetchone()[0]
+        assert stored == len(uploaded)
+
+        # Second run: every object is in the manifest, nothing is downloaded
+        source = S3Source(BUCKET, client=s3_client)
+        totals = run(conn, source, backend=backend, max_workers=2)
+        assert totals['listed'] == len(uploaded) and totals['new'] == 0
+        assert source.files_read == 0
+    finally:
+        conn.close()
+
+
+def test_failed_downloads_are_skipped(s3_client, uploaded, tmp_path):
+    # An object that can't be downloaded is not recorded in the manifest, so
+    # the next run tries it again
+    conn = connect(str(tmp_path / 'meter_data.sqlite'))
+    try:
+        broken = uploaded[0]
+        client = FlakyClient(s3_client, failures=0, denied=[broken])
+
+        totals = run(conn, S3Source(BUCKET, client=client, backoff_base=0), backend='serial')
+        assert client.calls[broken] == 1
+        assert totals['files'] == len(uploaded) - 1
+        assert conn.execute("SELECT COUNT(*) FROM ProcessedFiles WHERE FileKey = ?",
+                            (broken,)).fetchone()[0] == 0
+
+        totals = run(conn, S3Source(BUCKET, client=s3_client), backend='serial')
+        assert totals['new'] == 1 and totals['files'] == 1
+    finally:
+        conn.close()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the timestamp normalizer (xml_parser_timestamps.py)
+"""
+
+# Libraries
+import pandas as pd
+import pytest
+
+import xml_parser_timestamps
+
+from xml_parser_timestamps import clear_cache, parse_timestamps
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+    yield
+    clear_cache()
+
+
+def expected(values):
+    # Same values parsed one by one by pandas (NaT for the invalid ones)
+    return pd.DatetimeIndex([pd.to_datetime(value, utc=True, format='ISO8601', errors='coerce')
+                             if value is not None else pd.NaT for value in values]
+                            ).as_unit('ns')
+
+
+def test_fixed_layout():
+    # Most common offset (fast path), plus the other offsets of a DST change
+    # week and a negative one
+    values = ['2025-05-07T00:00:00+02:00', '2025-05-08T00:00:00+02:00',
+              '2025-05-07T00:00:00+02:00', '2025-10-26T00:00:00+02:00',
+              '2025-10-27T00:00:00+01:00', '2025-03-30T00:00:00+01:00',
+              '2025-05-07T00:00:00-05:30']
+    assert parse_timestamps(values).equals(expected(values))
+    assert str(parse_timestamps(values)[4]) == '2025-10-26 23:00:00+00:00'
+
+
+def test_other_layouts():
+    # Other ISO 8601 values with an offset go through pd.to_datetime
+    values = ['2025-05-07T00:00:00Z', '2025-05-07T00:00:00+0200',
+              '2025-05-07T00:00:00.250+02:00', '2025-05-07 00:00:00+02:00']
+    assert parse_timestamps(values).equals(expected(values))
+
+
+def test_invalid_values_are_nat():
+    # Naive, not a timestamp, impossible date, missing
+    values = ['2025-05-07T00:00:00', 'ab', '2025-02-30T00:00:00+01:00', None, '']
+    assert parse_timestamps(values).isna().all()
+    assert str(parse_timestamps(['2025-05-07T00:00:00+02:00', None])[0]) == \
+        '2025-05-06 22:00:00+00:00'
+
+
+def test_cache(monkeypatch):
+    values = ['2025-05-07T00:00:00+02:00', '2025-05-08T00:00:00+02:00']
+    first = parse_timestamps(values)
+    assert set(xml_parser_timestamps._cache) == set(values)
+
+    # Seen values are not parsed again
+    def fail(values):
+        raise AssertionError(f'parsed again: {list(values)}')
+    monkeypatch.setattr(xml_parser_timestamps, '_parse_unique', fail)
+    assert parse_timestamps(values[::-1]).equals(first[::-1])
+
+    # Emptied when full, and by clear_cache
+    monkeypatch.undo()
+    monkeypatch.setattr(xml_parser_timestamps, 'CACHE_SIZE', 3)
+    parse_timestamps(['2025-05-09T00:00:00+02:00', '2025-05-10T00:00:00+02:00'])
+    assert set(xml_parser_timestamps._cache) == {'2025-05-09T00:00:00+02:00',
+                                                  '2025-05-10T00:00:00+02:00'}
+    clear_cache()
+    assert not xml_parser_timestamps._cache
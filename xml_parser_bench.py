@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the ingestion, stage by stage, on synthetic files (see
+xml_parser_gen.py).
+
+Timed stages (serial, one after the other, on the same files):
+    - listing:    discover_files on the input folder
+    - parsing:    xml_parser (long layout, scaled values) on every file
+    - dataframe:  build_tables on the parsed files
+    - timestamps: convert_timestamps
+    - validation: validate
+    - sqlite:     upsert_tables + commit into an empty DB
+Then, for each backend of xml_parser_exec.py, parse_files alone and the whole
+pipeline (run_pipeline into an empty DB). The original xmltodict parser and
+the fast parser of xml_parser_fast.py are timed too, and the fast parser is
+checked to return the same results as xml_parser on every generated file
+(malformed ones included).
+
+The results are printed and written as JSON (--json), to compare them between
+releases.
+
+Usage:
+    python xml_parser_bench.py --files 5000
+    python xml_parser_bench.py --files 5000 --backends threads,processes --batch-size 100 --json bench.json
+"""
+
+# Libraries
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from pathlib import Path
+
+from xml_parser_db import connect, create_schema, upsert_tables
+from xml_parser_discover import discover_files
+from xml_parser_exec import BACKENDS, PARSERS, parse_files
+from xml_parser_fast import check_equivalence, fast_parser
+from xml_parser_func import xml_parser, xml_parser_xmltodict
+from xml_parser_gen import generate_files
+from xml_parser_pipeline import run_pipeline
+from xml_parser_tables import build_tables, concat_tables, convert_timestamps
+from xml_parser_timestamps import clear_cache
+from xml_parser_validation import DEFAULT_TIMEZONE, validate
+
+
+ACT_PATH = Path(__file__).parent.resolve()
+
+# Reference volume of a day (the results are also given per 5.000 files)
+FILES_PER_DAY = 5000
+
+
+#%%
+# Timing
+
+def best_of(function, repeat=3, setup=None):
+    # Best time of several runs (to reduce the noise from other processes),
+    # and the result of the last one. The errors printed by the parsers for
+    # the malformed files are not shown. setup is called (untimed) before
+    # each run, e.g. to empty a cache
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def time_stages(input_dir, timezone, repeat=3):
+    # Each stage is timed on the output of the previous one. Returns a dict
+    # {stage: seconds} and the number of files and readings loaded
+    times = {}
+
+    times['listing'], xml_files = best_of(lambda: sorted(discover_files(input_dir)), repeat)
+
+    def parse():
+        # Same as parse_batch: the files that can't be parsed are skipped
+        parsed = []
+        for file_key in xml_files:
+            result = xml_parser(file_key, layout='long', scaled_values=True)
+            if result and result[0]:
+                parsed.append((file_key, result))
+        return parsed
+
+    times['parsing'], parsed = best_of(parse, repeat)
+
+    times['dataframe'], (df_header, df_readings) = best_of(lambda: build_tables(parsed), repeat)
+
+    # Empty timestamp cache for each run, otherwise only the first one
+    # parses the strings
+    times['timestamps'], df_header = best_of(lambda: convert_timestamps(df_header), repeat,
+                                             setup=clear_cache)
+
+    times['validation'], (df_valid, df_valid_readings, df_rejected) = best_of(
+        lambda: validate(df_header, df_readings, timezone), repeat
+        )
+
+    def load():
+        # Into a new DB each time, so that every run does the same work
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = connect(os.path.join(tmp_dir, 'bench.sqlite'))
+            try:
+                create_schema(conn)
+                counts = upsert_tables(conn, df_valid, df_valid_readings)
+                conn.commit()
+            finally:
+                conn.close()
+        return counts
+
+    times['sqlite'], (n_files, n_readings) = best_of(load, repeat)
+
+    counts = {
+        'files':            len(xml_files),
+        'parsed':           len(df_header),
+        'valid':            len(df_valid),
+        'rejected':         int(df_rejected['FileId'].nunique()),
+        'files_written':    n_files,
+        'readings_written': n_readings,
+        }
+    return times, counts
+
+
+def time_backend(backend, xml_files, max_workers=None, batch_size=250, repeat=3,
+                 parser='generic'):
+    # parse_files alone (including the join of the chunks into a single pair
+    # of tables)
+    seconds, _ = best_of(
+        lambda: concat_tables(chunk for _, chunk, _ in parse_files(xml_files,
+                                                                   backend=backend,
+                                                                   max_workers=max_workers,
+                                                                   batch_size=batch_size,
+                                                                   parser=parser)),
+        repeat
+        )
+    return seconds
+
+
+def time_pipeline(backend, input_dir, max_workers=None, batch_size=250,
+                  timezone=DEFAULT_TIMEZONE, repeat=3, parser='generic'):
+    # The whole pipeline, from the listing to the last commit, into a new DB
+    def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = connect(os.path.join(tmp_dir, 'bench.sqlite'))
+            try:
+                for _ in run_pipeline(conn, discover_files(input_dir),
+                                      backend=backend,
+                                      max_workers=max_workers,
+                                      batch_size=batch_size,
+                                      timezone=timezone,
+                                      parser=parser):
+                    pass
+            finally:
+                conn.close()
+
+    # Each run starts with an empty timestamp cache, like a new process
+    seconds, _ = best_of(run, repeat, setup=clear_cache)
+    return seconds
+
+
+def _rates(seconds, n_files):
+    seconds = max(seconds, 1e-9)
+    return {
+        'seconds':        round(seconds, 6),
+        'files_per_s':    round(n_files / seconds, 1),
+        'seconds_per_day': round(seconds * FILES_PER_DAY / max(n_files, 1), 6),
+        }
+
+
+def _git_revision():
+    # Commit of the benchmarked code (None outside a git checkout)
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ACT_PATH,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#%%
+# Main
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--files', type=int, default=5000,
+                        help='number of files to generate (default: 5000)')
+    parser.add_argument('--malformed', type=float, default=0.02,
+                        help='share of malformed files (default: 0.02)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per stage, the best one is kept (default: 3)')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help='comma-separated backends of xml_parser_exec.py to time '
+                             f'(default: {",".join(BACKENDS)})')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='workers per backend (default: number of CPU cores)')
+    parser.add_argument('--batch-size', type=int, default=250,
+                        help='files per batch sent to each worker (default: 250)')
+    parser.add_argument('--parser', default='generic', choices=PARSERS,
+                        help='parser used by the backends (default: generic)')
+    parser.add_argument('--timezone', default=DEFAULT_TIMEZONE)
+    parser.add_argument('--dir', default=None,
+                        help='folder for the generated files (default: a temporary folder)')
+    parser.add_argument('--json', default=None,
+                        help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    backends = [b for b in args.backends.split(',') if b]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_dir = args.dir or tmp_dir
+        xml_files = generate_files(args.files, input_dir, malformed_ratio=args.malformed,
+                                   timezone=args.timezone)
+        n_files = len(xml_files)
+
+        # Both parsers must return exactly the same dicts
+        for file_key in xml_files[:100]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if xml_parser(file_key) != xml_parser_xmltodict(file_key):
+                    raise AssertionError(f'Parsers disagree on file {file_key}')
+
+        # And the fast parser must return the same as xml_parser on all of them
+        with contextlib.redirect_stdout(io.StringIO()):
+            mismatches = check_equivalence(xml_files)
+        if mismatches:
+            raise AssertionError(f'Fast parser disagrees on {len(mismatches)} files, '
+                                 f'e.g. {mismatches[0]}')
+
+        parsers = {
+            name: best_of(lambda: [parser(file_key) for file_key in xml_files], args.repeat)[0]
+            for name, parser in (('xmltodict', xml_parser_xmltodict), ('iterparse', xml_parser),
+                                 ('fast', fast_parser))
+            }
+
+        stages, counts = time_stages(input_dir, args.timezone, args.repeat)
+
+        backend_results = {}
+        for backend in backends:
+            backend_results[backend] = {
+                'parse_files': _rates(time_backend(backend, xml_files, args.workers,
+                                                   args.batch_size, args.repeat,
+                                                   args.parser), n_files),
+                'pipeline':    _rates(time_pipeline(backend, input_dir, args.workers,
+                                                    args.batch_size, args.timezone,
+                                                    args.repeat, args.parser), n_files),
+                }
+
+    results = {
+        'run': {
+            'date':        dt.datetime.now(dt.timezone.utc).isoformat(timespec='seconds'),
+            'revision':    _git_revision(),
+            'python':      platform.python_version(),
+            'platform':    platform.platform(),
+            'cpu_count':   os.cpu_count(),
+            'sqlite':      sqlite3.sqlite_version,
+            },
+        'params': {
+            'files':       n_files,
+            'malformed':   args.malformed,
+            'repeat':      args.repeat,
+            'workers':     args.workers or os.cpu_count(),
+            'batch_size':  args.batch_size,
+            'parser':      args.parser,
+            'timezone':    args.timezone,
+            },
+        'counts':   counts,
+        'parsers':  {name: _rates(seconds, n_files) for name, seconds in parsers.items()},
+        'stages':   {stage: _rates(seconds, n_files) for stage, seconds in stages.items()},
+        'backends': backend_results,
+        }
+
+    # Report
+    print(f'{n_files} files ({counts["valid"]} valid, {counts["rejected"]} rejected, '
+          f'{n_files - counts["parsed"]} unparseable), times per {FILES_PER_DAY} files:')
+
+    for name, result in results['parsers'].items():
+        print(f'  parser {name:>10}: {result["seconds_per_day"]:8.3f} s  '
+              f'({result["files_per_s"]:10.1f} files/s)')
+    print(f'  speedup: {parsers["xmltodict"] / parsers["iterparse"]:.2f}x (iterparse), '
+          f'{parsers["xmltodict"] / parsers["fast"]:.2f}x (fast)')
+
+    for stage, result in results['stages'].items():
+        print(f'  stage  {stage:>10}: {result["seconds_per_day"]:8.3f} s  '
+              f'({result["files_per_s"]:10.1f} files/s)')
+
+    # Throughput per backend, to choose the best one for each host
+    for backend, result in backend_results.items():
+        print(f'  {backend:>10}: parse_files {result["parse_files"]["seconds_per_day"]:8.3f} s, '
+              f'pipeline {result["pipeline"]["seconds_per_day"]:8.3f} s  '
+              f'[workers={args.workers or os.cpu_count()}, batch_size={args.batch_size}, '
+              f'parser={args.parser}]')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results written to {args.json}')
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
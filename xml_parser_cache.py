@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the parsed files, keyed by the hash of their content, so that the
+same bytes are never parsed twice:
+    - providers often send the same 'Provisional' file again (another name,
+      same content)
+    - after a change of the validation rules, a day is loaded again
+      (--reprocess) without parsing any XML
+
+Two levels, both bounded and evicting the least recently used entries:
+    - in memory (per process): an OrderedDict of up to memory_mb
+    - on disk (optional, shared by the processes and the runs): a SQLite file
+      of up to disk_mb. The new entries of a batch are written at once (flush)
+
+The key is the BLAKE2b hash of the content and of PARSER_VERSION (see
+xml_parser_func.py), so a new version of the parser never reads the results
+of an older one. The results (header, readings) are stored in a compact
+columnar form: each column of strings as its distinct values and one code
+per reading, the values in hundredths as an int64 array, all compressed.
+Files that fail to parse are not cached (their error is needed every time).
+
+Usage (see parse_batch in xml_parser_exec.py):
+    cache = open_cache(path='cache/parse_cache.sqlite', memory_mb=64, disk_mb=1024)
+    result = parse_cached(cache, file_key, xml_parser)
+    cache.flush()
+"""
+
+# Libraries
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+from array import array
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from xml_parser_func import PARSER_VERSION, read_bytes
+
+
+MB = 1 << 20
+
+
+#%%
+# Compact form of a parsed file
+
+def _encode_column(values):
+    # Column of readings --> compact tuple
+    if all(type(value) is int for value in values):
+        # Values in hundredths without None
+        return ('int', array('q', values).tobytes())
+
+    if all(value is None or type(value) is int for value in values):
+        # Same, with the positions of the None values
+        nulls = [i for i, value in enumerate(values) if value is None]
+        return ('int_null', array('q', [value or 0 for value in values]).tobytes(), nulls)
+
+    if all(value is None or type(value) is str for value in values):
+        # Strings (and None): distinct values + one code per reading
+        codes = {}
+        indexes = array('I', [codes.setdefault(value, len(codes)) for value in values])
+        return ('dict', list(codes), indexes.tobytes())
+
+    return ('list', list(values))
+
+
+def _decode_column(column):
+    kind = column[0]
+
+    if kind == 'int':
+        return array('q', column[1]).tolist()
+
+    if kind == 'int_null':
+        values = array('q', column[1]).tolist()
+        for i in column[2]:
+            values[i] = None
+        return values
+
+    if kind == 'dict':
+        uniques = column[1]
+        return [uniques[i] for i in array('I', column[2])]
+
+    return list(column[1])
+
+
+def encode(result):
+    # (header, readings) --> compressed bytes
+    header, readings = result
+    columns = {field: _encode_column(values) for field, values in readings.items()}
+    return zlib.compress(pickle.dumps((header, columns), protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def decode(blob):
+    # Compressed bytes --> (header, readings), as new objects every time (the
+    # caller can modify them)
+    header, columns = pickle.loads(zlib.decompress(blob))
+    return dict(header), {field: _decode_column(column) for field, column in columns.items()}
+
+
+#%%
+# Cache
+
+class ParseCache:
+
+    def __init__(self, path=None, memory_mb=64, disk_mb=1024):
+        self.path         = path
+        self.memory_bytes = int(memory_mb * MB)
+        self.disk_bytes   = int(disk_mb * MB)
+
+        self._memory = OrderedDict()  # {key: blob}, least recently used first
+        self._memory_size = 0
+
+        # Entries to write to disk, and keys read from it, at the next flush
+        self._new  = {}
+        self._used = set()
+
+        self.hits = self.misses = 0
+
+        # The threads of the 'threads' backend share the cache
+        self._lock = threading.Lock()
+
+        self.conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Several processes share the file: WAL, and they wait for each
+            # other's writes instead of failing
+            self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS ParseCache (
+                    Key      BLOB PRIMARY KEY,
+                    Data     BLOB NOT NULL,
+                    Size     INTEGER NOT NULL,
+                    LastUsed INTEGER NOT NULL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ParseCache_used "
+                              "ON ParseCache (LastUsed)")
+            self.conn.commit()
+
+    @staticmethod
+    def key(content, scaled_values=True):
+        # Hash of the content of a file (any bytes-like object)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f'{PARSER_VERSION}:{int(scaled_values)}:'.encode())
+        digest.update(content)
+        return digest.digest()
+
+    def get(self, key):
+        # Parsed result, or None if it is not cached
+        with self._lock:
+            blob = self._get_blob(key)
+            if blob is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return decode(blob)
+
+    def _get_blob(self, key):
+        blob = self._memory.get(key)
+        if blob is not None:
+            self._memory.move_to_end(key)
+        else:
+            blob = self._new.get(key)
+            if blob is None and self.conn is not None:
+                row = self.conn.execute("SELECT Data FROM ParseCache WHERE Key = ?",
+                                        (key,)).fetchone()
+                if row is not None:
+                    blob = row[0]
+                    self._used.add(key)
+            if blob is not None:
+                self._remember(key, blob)
+        return blob
+
+    def put(self, key, result):
+        blob = encode(result)
+        with self._lock:
+            self._remember(key, blob)
+            if self.conn is not None:
+                self._new[key] = blob
+
+    def _remember(self, key, blob):
+        # In memory, evicting the least recently used entries
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = blob
+        self._memory_size += len(blob)
+
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def flush(self):
+        # Write the new entries to disk and evict the least recently used ones
+        # beyond disk_bytes. Called once per batch
+        with self._lock:
+            if self.conn is None or not (self._new or self._used):
+                return
+            self._write()
+
+    def _write(self):
+        now = time.time_ns()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ParseCache (Key, Data, Size, LastUsed) "
+                "VALUES (?, ?, ?, ?)",
+                ((key, blob, len(blob), now) for key, blob in self._new.items())
+                )
+            self.conn.executemany("UPDATE ParseCache SET LastUsed = ? WHERE Key = ?",
+                                  ((now, key) for key in self._used))
+
+            # Beyond disk_bytes, the oldest entries are deleted until the
+            # cache is back to 90% of its size (so not at every flush)
+            size = self.conn.execute("SELECT COALESCE(SUM(Size), 0) FROM ParseCache").fetchone()[0]
+            if size > self.disk_bytes:
+                excess = size - 0.9 * self.disk_bytes
+                oldest = []
+                for key, entry_size in self.conn.execute("SELECT Key, Size FROM ParseCache "
+                                                         "ORDER BY LastUsed"):
+                    if excess <= 0:
+                        break
+                    oldest.append((key,))
+                    excess -= entry_size
+                self.conn.executemany("DELETE FROM ParseCache WHERE Key = ?", oldest)
+
+        self._new.clear()
+        self._used.clear()
+
+    def close(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# One cache per process and settings (the workers of the 'processes' backend
+# open their own, on the same file)
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(path=None, memory_mb=64, disk_mb=1024):
+    settings = (path, memory_mb, disk_mb)
+    with _caches_lock:
+        if settings not in _caches:
+            _caches[settings] = ParseCache(path, memory_mb, disk_mb)
+        return _caches[settings]
+
+
+#%%
+# Parsing through the cache
+
+def parse_cached(cache, file_key, parser, data=None, errors=None):
+    # Same as parser(file_key, layout='long', data=data, scaled_values=True),
+    # from the cache if the same content was already parsed. Returns the
+    # result and whether it came from the cache
+    try:
+        with read_bytes(file_key) if data is None else nullcontext(data) as content:
+            key = cache.key(content)
+
+            result = cache.get(key)
+            if result is not None:
+                return result, True
+
+            result = parser(file_key, layout='long', data=content, scaled_values=True,
+                            errors=errors)
+    except OSError:
+        # The file can't be read: the parser reports it
+        return parser(file_key, layout='long', scaled_values=True, errors=errors), False
+
+    if result is not None:
+        cache.put(key, result)
+    return result, False
@@ -0,0 +1,574 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite helpers for an incremental load of meter_data.sqlite:
+    - ProcessedFiles: manifest of the files already loaded, with their size
+      and modification time, so that a rerun only parses new or changed files
+    - IngestRuns / IngestBatches: checkpoints of the runs, one row per
+      committed micro-batch (written in the same transaction as its data), so
+      that an interrupted run can be resumed (--resume)
+    - FailedFiles: quarantine of the files that could not be parsed or
+      loaded, with their error
+    - RejectedFiles: the validation rules broken by each rejected file, per
+      run (written with its batch)
+    - MeterHeader / MeterReadings: one version per meter, day and flow
+      direction. A 'Final' file supersedes the 'Provisional' one of the same
+      day, and a newer file (CreationTimestamp) of the same DataType
+      supersedes the older one
+    - MeterData: wide table (one row per file, 'Readings_{i}_*' columns) of
+      the DBs loaded before MeterHeader / MeterReadings. Its rows are moved
+      to them by migrate_wide_table, and it is kept as MeterData_legacy
+
+The tables are created up front with a typed schema, and the rows are written
+with executemany inside the caller's transaction (a single commit per load).
+
+The values are stored exactly, as INTEGER hundredths of the unit (ValueCenti,
+e.g. 999577 for 9995.77 kWh): divide by 100 when reading them.
+"""
+
+# Libraries
+import datetime as dt
+import os
+import sqlite3
+
+
+MANIFEST_TABLE = 'ProcessedFiles'
+LEGACY_TABLE = 'MeterData'
+QUARANTINE_TABLE = 'FailedFiles'
+REJECTIONS_TABLE = 'RejectedFiles'
+
+# Columns identifying one meter/day: only one version of it is kept
+DAY_KEY = ('MeterPointId', 'FromTimestamp', 'FlowDirection')
+
+# Which DataType wins when both versions of a day are loaded
+DATA_TYPE_RANK = {'Provisional': 0, 'Final': 1}
+
+HEADER_COLUMNS = ('FileId', 'FileKey', 'MeterPointId', 'FromTimestamp',
+                  'ToTimestamp', 'FlowDirection', 'Resolution', 'Unit',
+                  'CreationTimestamp', 'DataType')
+READINGS_COLUMNS = ('FileId', 'Sequence', 'ValueCenti', 'Quality')
+
+# Timestamps are stored as ISO 8601 text in UTC ('YYYY-MM-DD HH:MM:SS+00:00'),
+# which sorts and compares correctly as text
+SCHEMA = ("""
+    CREATE TABLE IF NOT EXISTS MeterHeader (
+        FileId            INTEGER PRIMARY KEY,
+        FileKey           TEXT NOT NULL,
+        MeterPointId      TEXT,
+        FromTimestamp     TEXT NOT NULL,
+        ToTimestamp       TEXT NOT NULL,
+        FlowDirection     TEXT,
+        Resolution        TEXT,
+        Unit              TEXT,
+        CreationTimestamp TEXT,
+        DataType          TEXT
+    )""", """
+    CREATE TABLE IF NOT EXISTS MeterReadings (
+        FileId     INTEGER NOT NULL,
+        Sequence   INTEGER NOT NULL,
+        ValueCenti INTEGER,
+        Quality    TEXT,
+        PRIMARY KEY (FileId, Sequence)
+    ) WITHOUT ROWID""",
+    )
+
+# Created with the tables, before any insert: the upsert of each batch looks
+# up the stored versions of its days through idx_MeterHeader_day, so the
+# indexes are maintained row by row as the batches are written
+INDEXES = (
+    """CREATE INDEX IF NOT EXISTS idx_MeterHeader_day
+       ON MeterHeader (MeterPointId, FromTimestamp, DataType)""",
+    # Queries over every meter for a range of days (see xml_parser_query.py)
+    """CREATE INDEX IF NOT EXISTS idx_MeterHeader_from
+       ON MeterHeader (FromTimestamp, FlowDirection)""",
+    # Files loaded again (--reprocess) and rejected by the current rules
+    """CREATE INDEX IF NOT EXISTS idx_MeterHeader_file
+       ON MeterHeader (FileKey)""",
+    )
+
+
+def connect(file_db):
+    # Connection tuned for bulk loads:
+    #   - WAL journal: readers are not blocked while we write, and each
+    #     commit appends to the log instead of rewriting pages twice
+    #   - synchronous=NORMAL: with WAL, the DB can't be corrupted by a crash,
+    #     at most the last commit is lost (it is simply loaded again next run,
+    #     as the manifest is committed in the same transaction)
+    conn = sqlite3.connect(file_db)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # 64 MB
+    return conn
+
+
+# Note: executescript() would commit the ongoing transaction, so the
+# statements are run one by one
+
+def create_schema(conn):
+    # Tables and indexes. Called once per run (see run_pipeline), before the
+    # first batch is written
+    for statement in SCHEMA + INDEXES:
+        conn.execute(statement)
+
+
+def table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+        ).fetchone() is not None
+
+
+#%%
+# Manifest of processed files
+
+def init_manifest(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            FileKey     TEXT PRIMARY KEY,
+            Size        INTEGER NOT NULL,
+            MTimeNs     INTEGER NOT NULL,
+            ProcessedAt TEXT NOT NULL
+        )""")
+
+
+def iter_new_files(conn, xml_files, chunk_size=500, include_processed=False):
+    # Generator of (file_key, (size, mtime_ns)) for the files that are not in
+    # the manifest yet, or whose size/mtime changed since they were loaded.
+    # Items are local paths (their stats are read with os.stat), or
+    # (file_key, (size, mtime_ns)) pairs already listed with their stats
+    # (e.g. S3 objects, see xml_parser_s3.py).
+    # The manifest is looked up chunk_size files at a time, so it is never
+    # loaded whole in memory (it can hold millions of files after a backfill)
+    # include_processed=True yields every file, loaded or not (to load them again)
+    init_manifest(conn)
+
+    chunk = []
+    for item in xml_files:
+        chunk.append(item if isinstance(item, tuple) else (item, None))
+        if len(chunk) == chunk_size:
+            yield from _new_in_chunk(conn, chunk, include_processed)
+            chunk = []
+    if chunk:
+        yield from _new_in_chunk(conn, chunk, include_processed)
+
+
+def _new_in_chunk(conn, chunk, include_processed=False):
+    processed = {} if include_processed else {
+        file_key: (size, mtime_ns)
+        for file_key, size, mtime_ns in conn.execute(
+            f"SELECT FileKey, Size, MTimeNs FROM {MANIFEST_TABLE} "
+            f"WHERE FileKey IN ({', '.join('?' * len(chunk))})",
+            [file_key for file_key, _ in chunk]
+            ).fetchall()
+        }
+
+    for file_key, stat in chunk:
+        if stat is None:
+            try:
+                st = os.stat(file_key)
+            except FileNotFoundError:
+                # Deleted since it was listed
+                continue
+            stat = (st.st_size, st.st_mtime_ns)
+
+        if processed.get(file_key) != stat:
+            yield file_key, stat
+
+
+def record_files(conn, stats):
+    # Store (or update) the files in the manifest. Rejected files are
+    # recorded too: unless they change, they would be rejected again
+    init_manifest(conn)
+
+    processed_at = dt.datetime.now(dt.timezone.utc).isoformat(timespec='seconds')
+    conn.executemany(
+        f"""
+        INSERT INTO {MANIFEST_TABLE} (FileKey, Size, MTimeNs, ProcessedAt)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(FileKey) DO UPDATE SET
+            Size        = excluded.Size,
+            MTimeNs     = excluded.MTimeNs,
+            ProcessedAt = excluded.ProcessedAt
+        """,
+        ((file_key, size, mtime_ns, processed_at)
+         for file_key, (size, mtime_ns) in stats.items())
+        )
+
+
+#%%
+# Checkpoints and quarantine
+
+def init_checkpoints(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS IngestRuns (
+            RunId      INTEGER PRIMARY KEY,
+            StartedAt  TEXT NOT NULL,
+            UpdatedAt  TEXT NOT NULL,
+            FinishedAt TEXT,
+            Status     TEXT NOT NULL,
+            Batches    INTEGER NOT NULL DEFAULT 0,
+            Files      INTEGER NOT NULL DEFAULT 0,
+            Failed     INTEGER NOT NULL DEFAULT 0
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS IngestBatches (
+            RunId        INTEGER NOT NULL,
+            BatchNo      INTEGER NOT NULL,
+            Files        INTEGER NOT NULL,
+            Valid        INTEGER NOT NULL,
+            Rejected     INTEGER NOT NULL,
+            Failed       INTEGER NOT NULL,
+            FirstFileKey TEXT,
+            LastFileKey  TEXT,
+            CommittedAt  TEXT NOT NULL,
+            PRIMARY KEY (RunId, BatchNo)
+        )""")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} (
+            FileKey  TEXT PRIMARY KEY,
+            RunId    INTEGER,
+            Stage    TEXT NOT NULL,
+            Error    TEXT,
+            Attempts INTEGER NOT NULL DEFAULT 1,
+            FailedAt TEXT NOT NULL
+        )""")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {REJECTIONS_TABLE} (
+            RunId      INTEGER NOT NULL,
+            FileKey    TEXT NOT NULL,
+            Rule       TEXT NOT NULL,
+            Readings   INTEGER NOT NULL,
+            RejectedAt TEXT NOT NULL,
+            PRIMARY KEY (RunId, FileKey, Rule)
+        )""")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{REJECTIONS_TABLE}_file "
+                 f"ON {REJECTIONS_TABLE} (FileKey)")
+
+
+def _now():
+    return dt.datetime.now(dt.timezone.utc).isoformat(timespec='seconds')
+
+
+def start_run(conn, resume=False):
+    # Returns (run_id, batches already committed by the run). With resume, the
+    # last run that did not complete is continued (same RunId, its batches go
+    # on from the last checkpoint), otherwise a new run is started. Committed
+    init_checkpoints(conn)
+
+    last = conn.execute("""
+        SELECT RunId, Batches, Files, Status FROM IngestRuns
+        ORDER BY RunId DESC LIMIT 1""").fetchone()
+
+    if resume and last is not None and last[3] != 'completed':
+        run_id, batches, files, _ = last
+        conn.execute("UPDATE IngestRuns SET Status = 'running', UpdatedAt = ?, "
+                     "FinishedAt = NULL WHERE RunId = ?", (_now(), run_id))
+        conn.commit()
+        print(f'Resuming run {run_id} after batch {batches} ({files} files committed)')
+        return run_id, batches
+
+    if resume:
+        print('No interrupted run to resume, starting a new one')
+    elif last is not None and last[3] in ('running', 'interrupted', 'failed'):
+        print(f'Run {last[0]} did not complete ({last[1]} batches committed), '
+              f'use --resume to continue it')
+
+    # A run still 'running' was killed without being able to say so
+    conn.execute("UPDATE IngestRuns SET Status = 'interrupted' WHERE Status = 'running'")
+    now = _now()
+    run_id = conn.execute("INSERT INTO IngestRuns (StartedAt, UpdatedAt, Status) "
+                          "VALUES (?, ?, 'running')", (now, now)).lastrowid
+    conn.commit()
+    return run_id, 0
+
+
+def record_batch(conn, run_id, batch_no, file_keys, report):
+    # Checkpoint of a micro-batch. Not committed: the caller commits it with
+    # the data of the batch, so both are saved (or lost) together
+    now = _now()
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO IngestBatches
+            (RunId, BatchNo, Files, Valid, Rejected, Failed, FirstFileKey,
+             LastFileKey, CommittedAt)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (run_id, batch_no, len(file_keys), report['valid'], report['rejected'],
+         report['failed'], file_keys[0] if file_keys else None,
+         file_keys[-1] if file_keys else None, now)
+        )
+    conn.execute(
+        """
+        UPDATE IngestRuns
+        SET Batches = ?, Files = Files + ?, Failed = Failed + ?, UpdatedAt = ?
+        WHERE RunId = ?
+        """,
+        (batch_no, len(file_keys), report['failed'], now, run_id)
+        )
+
+
+def finish_run(conn, run_id, status):
+    # 'completed', 'failed' or 'interrupted'. Committed
+    now = _now()
+    conn.execute("UPDATE IngestRuns SET Status = ?, UpdatedAt = ?, FinishedAt = ? "
+                 "WHERE RunId = ?", (status, now, now, run_id))
+    conn.commit()
+
+
+def record_failures(conn, run_id, stage, errors):
+    # Quarantine {file_key: error} (a file already there gets the new error
+    # and one more attempt). Not committed. The files are recorded in the
+    # manifest too, so they are not parsed again unless they change
+    init_checkpoints(conn)
+
+    failed_at = _now()
+    conn.executemany(
+        f"""
+        INSERT INTO {QUARANTINE_TABLE} (FileKey, RunId, Stage, Error, FailedAt)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(FileKey) DO UPDATE SET
+            RunId    = excluded.RunId,
+            Stage    = excluded.Stage,
+            Error    = excluded.Error,
+            Attempts = Attempts + 1,
+            FailedAt = excluded.FailedAt
+        """,
+        ((file_key, run_id, stage, error, failed_at) for file_key, error in errors.items())
+        )
+
+
+def record_rejections(conn, run_id, rejections):
+    # Validation rules broken by the rejected files: (file_key, rule,
+    # readings of the file). Not committed: written with the batch
+    init_checkpoints(conn)
+
+    rejected_at = _now()
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {REJECTIONS_TABLE} "
+        f"(RunId, FileKey, Rule, Readings, RejectedAt) VALUES (?, ?, ?, ?, ?)",
+        ((run_id, file_key, rule, readings, rejected_at)
+         for file_key, rule, readings in rejections)
+        )
+
+
+def clear_failures(conn, file_keys):
+    # Files loaded after having failed before leave the quarantine. Not committed
+    init_checkpoints(conn)
+    conn.executemany(f"DELETE FROM {QUARANTINE_TABLE} WHERE FileKey = ?",
+                     ((file_key,) for file_key in file_keys))
+
+
+#%%
+# Upsert of the meter data
+
+def sql_timestamp(series):
+    # Same text format pandas.to_sql used for the datetimes of the legacy
+    # MeterData table ('2025-05-06 22:00:00+00:00'), so that the rows moved
+    # from it (see migrate_wide_table) compare with the new ones
+    # (pandas is imported here, so that the manifest helpers do not need it)
+    import pandas as pd
+    return [None if pd.isnull(ts) else ts.isoformat(sep=' ') for ts in series]
+
+
+def latest_versions(df_header):
+    # If the same meter/day appears more than once in the batch, keep only
+    # the version that would win in the DB
+    rank = df_header['DataType'].map(DATA_TYPE_RANK).fillna(-1)
+
+    return (df_header.assign(_Rank=rank)
+                     .sort_values(['_Rank', 'CreationTimestamp'],
+                                  kind='stable', na_position='first')
+                     .drop_duplicates(list(DAY_KEY), keep='last')
+                     .sort_index()
+                     .drop(columns='_Rank'))
+
+
+def upsert_tables(conn, df_header, df_readings, written=None, deleted=None,
+                  replaceable=None):
+    # Load the valid files into MeterHeader and MeterReadings, replacing the
+    # stored versions they supersede. Returns the number of files and readings
+    # written. Nothing is committed here: the caller commits once per load.
+    # The tables must exist (create_schema)
+
+    # written / deleted: optional lists, the FileKeys of the files inserted,
+    # and the (FileKey, FromTimestamp, DataType) of the stored versions
+    # deleted, are appended to them (e.g. to keep the Parquet copy in sync)
+    # replaceable: optional set of FileKeys whose stored versions lose against
+    # any incoming version of their day (with reprocess, the ones that the
+    # current rules reject)
+    df_header = latest_versions(df_header)
+
+    # FileId is only unique within this run, so to keep the link between both
+    # tables in the DB it is shifted after the last FileId stored
+    last_id = conn.execute("SELECT COALESCE(MAX(FileId), -1) FROM MeterHeader").fetchone()[0]
+    df_header   = df_header.assign(FileId=df_header['FileId'] + last_id + 1)
+    df_readings = df_readings.assign(FileId=df_readings['FileId'] + last_id + 1)
+
+    header_rows = list(zip(
+        df_header['FileId'].tolist(),
+        df_header['FileKey'],
+        df_header['MeterPointId'],
+        sql_timestamp(df_header['FromTimestamp']),
+        sql_timestamp(df_header['ToTimestamp']),
+        df_header['FlowDirection'],
+        df_header['Resolution'],
+        df_header['Unit'],
+        sql_timestamp(df_header['CreationTimestamp']),
+        df_header['DataType'],
+        ))
+
+    # Compare the incoming versions with the stored ones for the same days
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS IncomingHeader (
+            FileId INTEGER, MeterPointId TEXT, FromTimestamp TEXT,
+            FlowDirection TEXT, DataType TEXT, CreationTimestamp TEXT
+        )""")
+    conn.execute("DELETE FROM IncomingHeader")
+    conn.executemany(
+        "INSERT INTO IncomingHeader VALUES (?, ?, ?, ?, ?, ?)",
+        ((row[0], row[2], row[3], row[5], row[9], row[8]) for row in header_rows)
+        )
+
+    rank = " ".join(f"WHEN '{data_type}' THEN {value}"
+                    for data_type, value in DATA_TYPE_RANK.items())
+    matches = conn.execute(f"""
+        SELECT h.FileId, n.FileId,
+               h.FileKey, h.FromTimestamp, h.DataType,
+               (CASE h.DataType {rank} ELSE -1 END) >
+               (CASE n.DataType {rank} ELSE -1 END)
+               OR (h.DataType IS n.DataType
+                   AND h.CreationTimestamp > n.CreationTimestamp) AS StoredWins
+        FROM MeterHeader h
+        JOIN IncomingHeader n
+          ON  h.MeterPointId  = n.MeterPointId
+          AND h.FromTimestamp = n.FromTimestamp
+          AND h.FlowDirection IS n.FlowDirection
+        """).fetchall()
+
+    if replaceable:
+        matches = [(*match[:-1], match[-1] and match[2] not in replaceable)
+                   for match in matches]
+
+    # Incoming files older than what is stored are discarded...
+    stale_ids = {match[1] for match in matches if match[-1]}
+    header_rows = [row for row in header_rows if row[0] not in stale_ids]
+
+    # ... and stored versions superseded by an incoming file are deleted
+    superseded = [match for match in matches if not match[-1]]
+    superseded_ids = [(match[0],) for match in superseded]
+    conn.executemany("DELETE FROM MeterReadings WHERE FileId = ?", superseded_ids)
+    conn.executemany("DELETE FROM MeterHeader WHERE FileId = ?", superseded_ids)
+    if deleted is not None:
+        deleted.extend(match[2:5] for match in superseded)
+
+    if not header_rows:
+        return 0, 0
+
+    if written is not None:
+        written.extend(row[1] for row in header_rows)
+
+    written_ids = [row[0] for row in header_rows]
+    df_readings = df_readings[df_readings['FileId'].isin(written_ids)]
+
+    quality = df_readings['Quality'].astype(object)
+    readings_rows = zip(
+        df_readings['FileId'].tolist(),
+        df_readings['Sequence'].astype('int64').tolist(),
+        df_readings['ValueCenti'].astype('int64').tolist(),
+        quality.where(quality.notna(), None).tolist(),
+        )
+
+    # Insert the processed data in the sqlite DB
+    conn.executemany(
+        f"INSERT INTO MeterHeader ({', '.join(HEADER_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(HEADER_COLUMNS))})",
+        header_rows
+        )
+    conn.executemany(
+        f"INSERT INTO MeterReadings ({', '.join(READINGS_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(READINGS_COLUMNS))})",
+        readings_rows
+        )
+
+    return len(header_rows), len(df_readings)
+
+
+def delete_files(conn, file_keys, deleted=None):
+    # Remove the stored versions loaded from these files. Not committed.
+    # deleted: same as in upsert_tables
+    versions = [row for key in file_keys
+                for row in conn.execute("SELECT FileId, FileKey, FromTimestamp, DataType "
+                                        "FROM MeterHeader WHERE FileKey = ?", (key,))]
+    file_ids = [(row[0],) for row in versions]
+    conn.executemany("DELETE FROM MeterReadings WHERE FileId = ?", file_ids)
+    conn.executemany("DELETE FROM MeterHeader WHERE FileId = ?", file_ids)
+    if deleted is not None:
+        deleted.extend(row[1:] for row in versions)
+    return len(file_ids)
+
+
+def migrate_wide_table(conn, skipped=None):
+    # DBs loaded before the long layout have their files in the wide MeterData
+    # table (values as REAL). They are loaded into MeterHeader/MeterReadings
+    # with the same upsert rules (the names of the files were not stored: their
+    # FileKey is 'MeterData:<rowid>', and a file loaded again replaces its
+    # row), then the table is renamed MeterData_legacy so that this only runs
+    # once. Returns the rows migrated. Not committed
+
+    # The first version turned the values it could not read (e.g. 'ab.cd')
+    # into NaN: those rows are not migrated (the 'decimals' rule rejects such
+    # files now), they stay in MeterData_legacy. skipped: optional list, their
+    # FileKeys are appended to it
+    if not table_exists(conn, LEGACY_TABLE):
+        return 0
+
+    import pandas as pd
+
+    create_schema(conn)
+
+    df = pd.read_sql_query(f"SELECT rowid AS RowId, * FROM {LEGACY_TABLE}", conn)
+
+    df_header = pd.DataFrame({
+        'FileId':  range(len(df)),
+        'FileKey': [f'{LEGACY_TABLE}:{row_id}' for row_id in df['RowId']],
+        })
+    for col in HEADER_COLUMNS[2:]:
+        values = df[col] if col in df else pd.Series([None] * len(df))
+        if 'Timestamp' in col:
+            values = pd.to_datetime(values, utc=True, format='ISO8601')
+        df_header[col] = values.to_numpy()
+
+    # 'Readings_{i}_Sequence', 'Readings_{i}_Value'... --> one row per reading
+    # (the files with fewer readings have NULLs in the last columns)
+    n_readings = sum(1 for col in df.columns
+                     if col.startswith('Readings_') and col.endswith('_Sequence'))
+    df_readings = pd.concat([
+        pd.DataFrame({
+            'FileId':   df_header['FileId'],
+            'Sequence': df.get(f'Readings_{i}_Sequence'),
+            'Value':    df.get(f'Readings_{i}_Value'),
+            'Quality':  df.get(f'Readings_{i}_Quality'),
+            })
+        for i in range(1, n_readings + 1)
+        ], ignore_index=True)
+    df_readings = df_readings[df_readings['Sequence'].notna()]
+
+    sequence = pd.to_numeric(df_readings['Sequence'], errors='coerce')
+    value    = pd.to_numeric(df_readings['Value'], errors='coerce')
+    invalid_ids = df_readings['FileId'][sequence.isna() | value.isna()].unique()
+    valid = ~df_readings['FileId'].isin(invalid_ids)
+
+    df_readings = pd.DataFrame({
+        'FileId':     df_readings['FileId'][valid].to_numpy(),
+        'Sequence':   sequence[valid].astype('int64').to_numpy(),
+        # They all had exactly 2 decimals, so the rounding is exact
+        'ValueCenti': (value[valid] * 100).round().astype('int64').to_numpy(),
+        'Quality':    df_readings['Quality'][valid].to_numpy(),
+        }).sort_values(['FileId', 'Sequence'], kind='stable')
+
+    is_invalid = df_header['FileId'].isin(invalid_ids)
+    if skipped is not None:
+        skipped.extend(df_header.loc[is_invalid, 'FileKey'])
+
+    upsert_tables(conn, df_header[~is_invalid], df_readings)
+    conn.execute(f"ALTER TABLE {LEGACY_TABLE} RENAME TO {LEGACY_TABLE}_legacy")
+    return len(df) - int(is_invalid.sum())
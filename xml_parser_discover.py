@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Discovery of the input files. Kept apart from the pipeline (and free of heavy
+imports), so that listing the input folder does not need pandas.
+
+For the backfills over years of day folders (input_path/2025-05-07/...):
+    - recursive=True walks the subfolders, several folders at a time (one
+      thread per folder being listed)
+    - start_date/end_date (both included) skip the day folders out of range
+      without listing them. The date is taken from the folder name
+      (YYYY-MM-DD), or else from the file name; files without a date in their
+      path are always kept
+    - pattern filters the file names (glob, e.g. '*_Final.xml')
+    - shard=(i, n) keeps only the i-th of n deterministic parts of the files
+      (1 <= i <= n), so that n hosts can split a backfill without talking to
+      each other: a file goes to the shard given by a hash of its path
+      relative to input_path, the same on every host
+
+Everything is decided from the names and the entry types returned by
+os.scandir, so no file is stat'ed here.
+"""
+
+# Libraries
+import datetime as dt
+import fnmatch
+import os
+import re
+import zlib
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+DATE_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+
+
+def path_date(text):
+    # First YYYY-MM-DD date of a name or path, or None
+    for match in DATE_PATTERN.finditer(text):
+        try:
+            return dt.date(*map(int, match.groups()))
+        except ValueError:
+            continue
+    return None
+
+
+def parse_shard(text):
+    # 'i/n' --> (i, n)
+    try:
+        i, n = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f'Invalid shard "{text}", expected i/n (e.g. 1/4)') from None
+    if not 1 <= i <= n:
+        raise ValueError(f'Invalid shard "{text}", i must be between 1 and n')
+    return i, n
+
+
+def in_shard(relative_path, shard):
+    # Same result on every host and Python run (unlike hash())
+    i, n = shard
+    key = relative_path.replace(os.sep, '/').encode('utf-8')
+    return zlib.crc32(key) % n == i - 1
+
+
+def _in_range(date, start_date, end_date):
+    return (date is None
+            or ((start_date is None or date >= start_date)
+                and (end_date is None or date <= end_date)))
+
+
+def _scan(path, suffix, name_filter):
+    # Files and subfolders of one folder
+    files, folders = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                folders.append(entry)
+            elif entry.name.endswith(suffix) and entry.is_file():
+                if name_filter is None or name_filter(entry.name):
+                    files.append(entry)
+    return files, folders
+
+
+def discover_files(input_path, suffix='.xml', recursive=False, start_date=None,
+                   end_date=None, pattern=None, shard=None, max_workers=8):
+    # Generator of the .xml files of the input folder (and its subfolders if
+    # recursive). Files come folder by folder, in no particular order
+    name_filter = re.compile(fnmatch.translate(pattern)).match if pattern else None
+    root = os.fspath(input_path)
+
+    def keep(entry, folder_date):
+        date = folder_date or path_date(entry.name)
+        if not _in_range(date, start_date, end_date):
+            return False
+        return shard is None or in_shard(os.path.relpath(entry.path, root), shard)
+
+    def folder_date_of(entry, parent_date):
+        # A day folder sets the date of everything below it
+        return path_date(entry.name) if DATE_PATTERN.fullmatch(entry.name) else parent_date
+
+    if not recursive:
+        files, _ = _scan(root, suffix, name_filter)
+        for entry in files:
+            if keep(entry, None):
+                yield entry.path
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(_scan, root, suffix, name_filter): None}
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                folder_date = pending.pop(future)
+                files, folders = future.result()
+
+                # Subfolders are listed while the files of this one are yielded
+                for folder in folders:
+                    date = folder_date_of(folder, folder_date)
+                    if _in_range(date, start_date, end_date):
+                        pending[pool.submit(_scan, folder.path, suffix, name_filter)] = date
+
+                for entry in files:
+                    if keep(entry, folder_date):
+                        yield entry.path
+
+
+def filter_keys(items, prefix='', start_date=None, end_date=None, pattern=None, shard=None):
+    # Same filters for already listed files, e.g. the (key, stat) pairs of
+    # S3Source.list_objects. The shard is computed on the key relative to prefix
+    name_filter = re.compile(fnmatch.translate(pattern)).match if pattern else None
+
+    for item in items:
+        key = item[0] if isinstance(item, tuple) else item
+        name = key.rsplit('/', 1)[-1]
+
+        if name_filter is not None and not name_filter(name):
+            continue
+        if not _in_range(path_date(key[len(prefix):]), start_date, end_date):
+            continue
+        if shard is not None and not in_shard(key[len(prefix):], shard):
+            continue
+        yield item
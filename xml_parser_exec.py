@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel parsing of the .xml files with a selectable backend:
+    - 'threads':   ThreadPoolExecutor (the parsing is CPU-bound, so the GIL
+                   serializes most of it, but there is no startup cost)
+    - 'processes': ProcessPoolExecutor (one Python interpreter per core)
+    - 'serial':    plain loop in the current thread (debugging, tiny inputs)
+
+The files are sent to the workers in batches. Each worker parses its whole
+batch and returns it already as a (df_header, df_readings) chunk (see
+xml_parser_tables.py), so only a few typed arrays are pickled per batch instead
+of one dict per file.
+
+The files are read by xml_parser, or by the fast parser of xml_parser_fast.py
+(parser='fast'), which gives the same results. With a cache (see
+xml_parser_cache.py), a file whose content was already parsed is not parsed
+again.
+
+Along with the chunk, each batch returns its parse stats: the parse time and
+outcome of every file, the CPU time of the worker on the batch (see
+xml_parser_metrics.py), and the error of each file that could not be read (see
+the quarantine in xml_parser_db.py).
+"""
+
+# Libraries
+import os
+import time
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from xml_parser_fast import fast_parser
+from xml_parser_func import xml_parser
+from xml_parser_tables import build_tables
+
+
+BACKENDS = ('threads', 'processes', 'serial')
+
+# Parser of each file, by name (the name is what is sent to the workers)
+PARSERS = {
+    'generic': xml_parser,
+    'fast':    fast_parser,
+    }
+
+
+def parse_batch(file_keys, parser='generic', cache=None):
+    # Parse a batch of files and return it as a (df_header, df_readings) chunk,
+    # and its parse stats
+    # Each item is either a local path, or a (file_key, data) pair with the
+    # content of the file already downloaded as bytes (see xml_parser_s3.py)
+    # Files that fail (None) or have no 'MeterData' root ({}) are skipped,
+    # and their error is returned in the stats
+    # cache: None, or the arguments of open_cache (a dict, so that it can be
+    # sent to the worker processes, which open their own)
+    cpu_start = time.thread_time()
+    parse = PARSERS[parser]
+
+    parse_cache = None
+    if cache is not None:
+        # Imported here, so that the workers only load it when it is used
+        from xml_parser_cache import open_cache, parse_cached
+        parse_cache = open_cache(**cache)
+
+    parsed_files = []
+    file_stats = []
+    file_errors = {}
+    for item in file_keys:
+        file_key, data = item if isinstance(item, tuple) else (item, None)
+
+        errors = []
+        cached = False
+        start = time.perf_counter()
+        try:
+            if parse_cache is None:
+                result = parse(file_key, layout='long', data=data, scaled_values=True,
+                               errors=errors)
+            else:
+                result, cached = parse_cached(parse_cache, file_key, parse, data=data,
+                                              errors=errors)
+        except Exception as e:
+            # The parsers catch the errors of the files they read, this is
+            # for anything else raised while reading this one file
+            result = None
+            errors.append(f'{type(e).__name__}: {e}')
+        seconds = time.perf_counter() - start
+
+        if result and result[0]:
+            parsed_files.append((file_key, result))
+            status = 'cached' if cached else 'parsed'
+        elif result is None:
+            status = 'failed'
+            file_errors[file_key] = errors[-1] if errors else 'Unknown error'
+        else:
+            status = 'empty'
+            file_errors[file_key] = 'No MeterData element'
+        file_stats.append((file_key, seconds, status))
+
+    tables = build_tables(parsed_files)
+
+    if parse_cache is not None:
+        parse_cache.flush()
+
+    return tables, {'files': file_stats, 'cpu_s': time.thread_time() - cpu_start,
+                    'errors': file_errors}
+
+
+def batch_keys(batch):
+    # File keys of a batch, whatever the kind of items
+    return [item[0] if isinstance(item, tuple) else item for item in batch]
+
+
+def _batches(xml_files, batch_size):
+    # Split any iterable of file keys (or items) into lists of batch_size files
+    batch = []
+    for file_key in xml_files:
+        batch.append(file_key)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _make_executor(backend, max_workers):
+    if backend == 'threads':
+        return ThreadPoolExecutor(max_workers=max_workers)
+
+    # The workers are started with the default method of the platform ('spawn'
+    # on Windows and macOS): the entry point runs under a __main__ guard, so
+    # the workers only import the parsing modules
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def parse_files(xml_files, backend='processes', max_workers=None, batch_size=250,
+                parser='generic', cache=None):
+    # Generator of (batch, (df_header, df_readings), parse_stats) tuples, in
+    # the same order as xml_files. FileId is only unique within each chunk
+    # (see concat_tables)
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend "{backend}", expected one of {BACKENDS}')
+
+    if parser not in PARSERS:
+        raise ValueError(f'Unknown parser "{parser}", expected one of {tuple(PARSERS)}')
+
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1')
+
+    # max_workers is the maximum number of parallel tasks
+    # (should not exceed the number of CPU cores)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if backend == 'serial':
+        for batch in _batches(xml_files, batch_size):
+            yield (batch, *parse_batch(batch, parser, cache))
+        return
+
+    with _make_executor(backend, max_workers) as executor:
+        # Only a few batches per worker are submitted at a time, so the
+        # number of futures (and results) kept alive does not depend on the
+        # number of files
+        pending = deque()
+
+        for batch in _batches(xml_files, batch_size):
+            pending.append((batch, executor.submit(parse_batch, batch, parser, cache)))
+
+            if len(pending) >= 2 * max_workers:
+                yield _result(*pending.popleft())
+
+        while pending:
+            yield _result(*pending.popleft())
+
+
+def _result(batch, future):
+    # The errors of each file are in the parse stats: an exception here is not
+    # caused by one file (e.g. BrokenProcessPool when a worker dies,
+    # CancelledError, or building the tables of the batch failed), so it is
+    # raised to the caller instead of being blamed on the files of the batch
+    return (batch, *future.result())
+
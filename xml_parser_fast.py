@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Fast parser for the fixed layout of the MeterData files:
+    <MeterData ...>
+        <MeterPointId>...</MeterPointId>  ... (the 8 HEADER_FIELDS, in order)
+        <ReadingList>
+            <Reading><Sequence>1</Sequence><Value>12.34</Value><Quality>Measured</Quality></Reading>
+            ...
+        </ReadingList>
+    </MeterData>
+
+The layout is declared once (MeterDataSchema) and compiled into two regular
+expressions: one for the whole document, which checks that it has exactly
+that shape, and one for a 'Reading', which reads all of them at once
+(findall). A file is then parsed in two regex passes over its content,
+without building any element.
+
+Anything that does not have exactly that shape (another encoding, comments,
+entities or CDATA, empty elements, fields missing or in another order, extra
+elements or attributes, ...) is not read here: fast_parser falls back to
+xml_parser, which handles every case. Both always return the same result:
+check_equivalence compares them (xml_parser_bench.py runs it on the generated
+files, malformed ones included).
+
+Usage: fast_parser has the same arguments and results as xml_parser
+    header, readings = fast_parser(file_key, layout='long', scaled_values=True)
+"""
+
+# Libraries
+import re
+
+from xml_parser_func import (HEADER_FIELDS, READING_FIELDS, flatten, read_bytes,
+                             to_centi, xml_parser)
+
+
+# XML whitespace (between the elements)
+WS = r'[ \t\r\n]*'
+
+# Characters that are not allowed anywhere in an XML document
+NOT_CHAR = r'\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff'
+
+# Text of an element: no child elements, entities, CDATA, '\r' (expat turns
+# it into '\n') or characters that are not allowed
+TEXT = rf'[^<&\]\r{NOT_CHAR}]*'
+
+# Optional xml declaration, only for UTF-8 (any other encoding goes to
+# xml_parser)
+DECLARATION = (r'(?:<\?xml[ \t\r\n]+version[ \t\r\n]*=[ \t\r\n]*(?P<q1>["\'])1\.[0-9](?P=q1)'
+               r'(?:[ \t\r\n]+encoding[ \t\r\n]*=[ \t\r\n]*(?P<q2>["\'])(?i:utf-8)(?P=q2))?'
+               r'(?:[ \t\r\n]+standalone[ \t\r\n]*=[ \t\r\n]*(?P<q3>["\'])(?:yes|no)(?P=q3))?'
+               r'[ \t\r\n]*\?>)?')
+
+# Attributes of the root: namespace prefixes (xmlns:xsi="...") and plain
+# attributes. Files with a default namespace (xmlns="...") are left to
+# xml_parser (which compares the local names of the tags), and so are the
+# ones with a '}' in a namespace, the separator of ElementTree
+ATTRIBUTE = (rf'[ \t\r\n]+(?:xmlns:[A-Za-z_][\w.-]*[ \t\r\n]*=[ \t\r\n]*'
+             rf'(?:"[^"<&}}{NOT_CHAR}]+"|\'[^\'<&}}{NOT_CHAR}]+\')'
+             rf'|(?!xmlns[ \t\r\n=])[A-Za-z_][\w.-]*[ \t\r\n]*=[ \t\r\n]*'
+             rf'(?:"[^"<&{NOT_CHAR}]*"|\'[^\'<&{NOT_CHAR}]*\'))')
+ATTRIBUTE_NAME = re.compile(r'([\w:.-]+)[ \t\r\n]*=')
+
+
+def _element(tag, group=None):
+    # <tag>text</tag>, with the text captured (named group) or not
+    text = f'(?P<{group}>{TEXT})' if group else f'(?:{TEXT})'
+    return f'<{tag}>{text}</{tag}>'
+
+
+class MeterDataSchema:
+    # Declared layout of the files, compiled into the regular expressions that
+    # read it
+
+    def __init__(self, root='MeterData', header_fields=HEADER_FIELDS,
+                 list_tag='ReadingList', item_tag='Reading', item_fields=READING_FIELDS):
+        self.header_fields = tuple(header_fields)
+        self.item_fields   = tuple(item_fields)
+
+        def item(capture):
+            fields = WS.join(_element(field, f'i{i}' if capture else None)
+                             for i, field in enumerate(self.item_fields))
+            return f'{WS}<{item_tag}>{WS}{fields}{WS}</{item_tag}>'
+
+        header = WS.join(_element(field, f'h{i}') for i, field in enumerate(self.header_fields))
+
+        # Whole document. The items are only checked here (not captured)
+        self.document = re.compile(
+            f'\ufeff?{DECLARATION}{WS}'
+            f'<{root}(?P<attributes>(?:{ATTRIBUTE})*){WS}>{WS}'
+            f'{header}{WS}'
+            f'<{list_tag}>(?P<items>(?:{item(False)})*){WS}</{list_tag}>{WS}'
+            f'</{root}>{WS}'
+            )
+
+        # One item, with its fields captured (findall returns one tuple per item)
+        self.item = re.compile(item(True))
+
+    def parse(self, data, scaled_values=False):
+        # Bytes-like content --> (header, readings) as returned by
+        # xml_parser(layout='long'), or None if the document does not have
+        # the declared layout
+        try:
+            text = str(data, 'utf-8')
+        except UnicodeDecodeError:
+            return None
+
+        match = self.document.fullmatch(text)
+        if match is None:
+            return None
+
+        # Repeated attributes are an error for xml_parser
+        names = ATTRIBUTE_NAME.findall(match['attributes'])
+        if len(set(names)) != len(names):
+            return None
+
+        # Same convention as xml_parser: surrounding whitespace is stripped
+        # and an empty element is read as None
+        header = {field: match[f'h{i}'].strip() or None
+                  for i, field in enumerate(self.header_fields)}
+
+        items = self.item.findall(text, *match.span('items'))
+        if len(self.item_fields) == 1:
+            items = [(value,) for value in items]
+
+        columns = zip(*items) if items else ((),) * len(self.item_fields)
+        readings = {}
+        for field, column in zip(self.item_fields, columns):
+            values = [value.strip() or None for value in column]
+            if scaled_values and field == 'Value':
+                # Checked and converted here, same as xml_parser
+                values = [to_centi(value) for value in values]
+            readings[field] = values
+
+        return header, readings
+
+
+SCHEMA = MeterDataSchema()
+
+
+#%%
+# Parser
+
+def fast_parser(file_key, layout='wide', data=None, scaled_values=False, errors=None,
+                schema=SCHEMA):
+    # Same arguments and results as xml_parser (see xml_parser_func.py). Files
+    # that do not have the layout of the schema are parsed by xml_parser
+    if layout not in ('wide', 'long'):
+        raise ValueError(f'Unknown layout "{layout}", expected "wide" or "long"')
+
+    try:
+        if data is None:
+            with read_bytes(file_key) as content:
+                result = schema.parse(content, scaled_values)
+        else:
+            result = schema.parse(data, scaled_values)
+    except OSError:
+        # e.g. the file can't be read: xml_parser reports it
+        result = None
+
+    if result is None:
+        return xml_parser(file_key, layout=layout, data=data, scaled_values=scaled_values,
+                          errors=errors)
+
+    if layout == 'long':
+        return result
+
+    return flatten(*result)
+
+
+def check_equivalence(xml_files, scaled_values=True):
+    # Files for which fast_parser and xml_parser return different results
+    # (both layouts). Empty list if they agree on all of them
+    mismatches = []
+    for file_key in xml_files:
+        for layout in ('long', 'wide'):
+            if (fast_parser(file_key, layout=layout, scaled_values=scaled_values)
+                    != xml_parser(file_key, layout=layout, scaled_values=scaled_values)):
+                mismatches.append(file_key)
+                break
+    return mismatches
@@ -6,11 +6,250 @@ Created on Tue Jun 24 23:15:05 2025
 """
 
 # Libraries
-import xmltodict
+import mmap
+import os
+import re
+import threading
+
+from contextlib import contextmanager
+from xml.etree.ElementTree import XMLPullParser
+
+
+# Header elements of the 'MeterData' root, in the order they are stored
+HEADER_FIELDS = (
+    'MeterPointId',
+    'FromTimestamp',
+    'ToTimestamp',
+    'FlowDirection',
+    'Resolution',
+    'Unit',
+    'CreationTimestamp',
+    'DataType',
+    )
+
+# Child elements of each 'Reading'
+READING_FIELDS = ('Sequence', 'Value', 'Quality')
+
+# Values must have exactly 2 decimals (up to 16 digits before the point, so
+# that the value in hundredths always fits in an int64)
+VALUE_PATTERN = re.compile(r'[+-]?\d{1,16}\.\d{2}')
+
+# Version of the results of the parsers: to be increased whenever they change
+# (e.g. a new field), so that the results cached by older versions are not
+# used (see xml_parser_cache.py)
+PARSER_VERSION = 1
+
+# Local files are read as raw bytes (never decoded to str, the parser takes
+# the encoding from the xml declaration): files from MMAP_SIZE bytes are
+# memory-mapped, smaller ones are read into a buffer reused by every file
+# parsed in the same thread. The parser is fed FEED_SIZE bytes at a time
+MMAP_SIZE = 1 << 20
+FEED_SIZE = 1 << 16
+
+_buffers = threading.local()
+
+
+def _text(elem):
+    # Same convention as xmltodict: surrounding whitespace is stripped and an
+    # empty element is read as None
+    text = elem.text
+    if text is None:
+        return None
+    text = text.strip()
+    return text or None
+
+
+def to_centi(text):
+    # '9995.77' --> 999577 (hundredths, exact). Anything that does not have
+    # exactly 2 decimals --> None
+    if text is None or VALUE_PATTERN.fullmatch(text) is None:
+        return None
+    return int(text.replace('.', '', 1))
+
+
+@contextmanager
+def read_bytes(file_key):
+    # Content of a local file as a bytes-like object, valid inside the with
+    # block: an mmap for the big files, else a view on the thread's buffer
+    # (one open, one fstat and one read per file, no copy)
+    with open(file_key, 'rb', buffering=0) as file:
+        size = os.fstat(file.fileno()).st_size
+
+        if size >= MMAP_SIZE:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+            return
+
+        buffer = getattr(_buffers, 'buffer', None)
+        if buffer is None or len(buffer) < size:
+            buffer = _buffers.buffer = bytearray(max(size, FEED_SIZE))
+
+        view = memoryview(buffer)[:size]
+        try:
+            # readinto may return less than asked (e.g. file being written)
+            n_read = 0
+            while n_read < size:
+                n = file.readinto(view[n_read:])
+                if not n:
+                    break
+                n_read += n
+            yield view[:n_read]
+        finally:
+            view.release()
+
+
+def _local_name(tag):
+    # '{uri}MeterData' --> 'MeterData'
+    return tag.rpartition('}')[2]
+
+
+def _events(data):
+    # ('start'/'end', element) events of a bytes-like document, fed to the
+    # parser in slices of the same buffer (no copy)
+    parser = XMLPullParser(events=('start', 'end'))
+    with memoryview(data) as view:
+        for start in range(0, len(view), FEED_SIZE):
+            parser.feed(view[start:start + FEED_SIZE])
+            yield from parser.read_events()
+    # Raises on truncated or empty documents
+    parser.close()
+    yield from parser.read_events()
+
+
+def _parse_meter_data(data, scaled_values=False):
+    # Instead of reading the whole file and turning it into a nested dict
+    # first, we walk through the document as a stream of start/end events
+    # and copy each value as soon as its element is closed. Elements are
+    # cleared once they have been read, so the tree is never kept in memory
+    header = {}
+
+    # One list per 'Reading' field, in document order
+    readings = {field: [] for field in READING_FIELDS}
+
+    # Local names of the elements currently open (root first)
+    stack = []
+    reading = None
+
+    for event, elem in _events(data):
+        # ElementTree names the elements of a namespace '{uri}tag' (e.g. with
+        # a default xmlns="..." on the root): only the local name is compared,
+        # same as with the xmltodict version
+        tag = _local_name(elem.tag)
+
+        if event == 'start':
+            stack.append(tag)
+            depth = len(stack)
+
+            if depth == 1:
+                # Read root element (if it is not 'MeterData', there is
+                # nothing to store, same as with the xmltodict version)
+                if tag != 'MeterData':
+                    return header, readings
+
+            elif depth == 2 and not header:
+                # Header keys always come first and are always present
+                # (an empty 'MeterData' element returns an empty dict)
+                header.update(dict.fromkeys(HEADER_FIELDS))
+
+            elif depth == 3 and stack[1] == 'ReadingList' and tag == 'Reading':
+                reading = {}
+            continue
+
+        # event == 'end'
+        depth = len(stack)
+
+        if depth == 2:
+            # Main level atribute values
+            if tag in header:
+                header[tag] = _text(elem)
+            elem.clear()
+
+        elif depth == 3 and reading is not None:
+            # A 'Reading' element has been closed: store its values
+            for field in READING_FIELDS:
+                readings[field].append(reading.get(field))
+            reading = None
+            elem.clear()
+
+        elif depth == 4 and reading is not None and tag in READING_FIELDS:
+            reading[tag] = _text(elem)
+            if scaled_values and tag == 'Value':
+                # Checked and converted here, while the text is at hand
+                reading['Value'] = to_centi(reading['Value'])
+
+        stack.pop()
+
+    return header, readings
+
+
+def flatten(header, readings):
+    # (header, readings) of the 'long' layout --> flat dict of the 'wide' one,
+    # with the readings after the header fields
+    file_dict = header
+    columns = zip(*(readings[field] for field in READING_FIELDS))
+
+    for i, (sequence, value, quality) in enumerate(columns):
+        # We must differenciate between i and 'Sequence' value to
+        # be able to check if there are gaps in the sequence
+
+        # Python indexes start on 0, the 'Sequence' starts at 1, so they must be matched
+        i += 1
+
+        # Store values
+        file_dict[f'Readings_{i}_Sequence'] = sequence
+        file_dict[f'Readings_{i}_Value']    = value
+        file_dict[f'Readings_{i}_Quality']  = quality
+
+    # Return flattened dict
+    return file_dict
 
 
 # Function to parse each .xml file
-def xml_parser(file_key):
+def xml_parser(file_key, layout='wide', data=None, scaled_values=False, errors=None):
+    # data: the content of the file as bytes (e.g. the body of an S3 object),
+    # in which case file_key is only used to name the file. Otherwise the
+    # local file is read as bytes (see read_bytes). Either way the bytes are
+    # parsed as they are (the encoding is taken from the xml declaration)
+
+    # layout='wide' returns one flat dict per file, with the readings stored
+    # as 'Readings_{i}_Sequence', 'Readings_{i}_Value', 'Readings_{i}_Quality'
+    # layout='long' returns a tuple (header, readings): the header fields as
+    # a dict, and the readings as a dict of lists {'Sequence': [...],
+    # 'Value': [...], 'Quality': [...]} (see xml_parser_tables.py)
+
+    # scaled_values=True returns each 'Value' as an int in hundredths
+    # ('9995.77' --> 999577), or None if it does not have exactly 2 decimals
+
+    # errors: optional list, the error of a file that can't be parsed is
+    # appended to it as text (besides being printed)
+    if layout not in ('wide', 'long'):
+        raise ValueError(f'Unknown layout "{layout}", expected "wide" or "long"')
+
+    try:
+        if data is None:
+            with read_bytes(file_key) as content:
+                header, readings = _parse_meter_data(content, scaled_values)
+        else:
+            header, readings = _parse_meter_data(data, scaled_values)
+
+        if layout == 'long':
+            return header, readings
+
+        return flatten(header, readings)
+
+    # If the parsing of the .xml file fails, the function returns nothing
+    except Exception as e:
+        print(f'Failed to parse file {file_key}.\n Error: ', e)
+        if errors is not None:
+            errors.append(f'{type(e).__name__}: {e}')
+        return None
+
+
+# Original parser (kept as a reference for the benchmark in xml_parser_bench.py)
+def xml_parser_xmltodict(file_key):
+    # Imported here so that xmltodict is only needed by this function
+    import xmltodict
+
     try:
         # Read file content as a JSON dict
         with open(file_key) as file:
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of synthetic MeterData files, based on the sample files of
+input_data (same layout, and values following the same daily profile).
+
+The generated files include:
+    - PT1H and PT15M resolutions
+    - DST change days (23 or 25 hours, with the matching number of readings)
+    - 'Provisional' files, most of them with a later 'Final' version
+    - a share of malformed files, one kind of error each (see MALFORMED_KINDS)
+
+Usage:
+    python xml_parser_gen.py --files 5000 --output gen_data
+"""
+
+# Libraries
+import argparse
+import datetime as dt
+import os
+import random
+
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from xml_parser_func import xml_parser
+
+
+ACT_PATH = Path(__file__).parent.resolve()
+SAMPLE_FILE = ACT_PATH / 'input_data' / 'final-volumes.xml'
+
+# Errors of the malformed files, and what should happen to them:
+#   - 'decimals', 'sequence', 'timespan', 'naive': rejected by the validation
+#   - 'truncated': the xml can't be parsed
+#   - 'not_meter_data': parsed, but there is no 'MeterData' root
+MALFORMED_KINDS = ('decimals', 'sequence', 'timespan', 'naive', 'truncated', 'not_meter_data')
+
+# Days around the DST changes of 2025 (Europe): 30/03 has 23 hours, 26/10 has 25
+DEFAULT_DAYS = (dt.date(2025, 3, 29), dt.date(2025, 3, 30), dt.date(2025, 5, 7),
+                dt.date(2025, 10, 26), dt.date(2025, 10, 27))
+
+TEMPLATE = """<MeterData xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+	<MeterPointId>{meter_point_id}</MeterPointId>
+	<FromTimestamp>{from_ts}</FromTimestamp>
+	<ToTimestamp>{to_ts}</ToTimestamp>
+	<FlowDirection>{flow_direction}</FlowDirection>
+	<Resolution>{resolution}</Resolution>
+	<Unit>KWH</Unit>
+	<CreationTimestamp>{creation_ts}</CreationTimestamp>
+	<DataType>{data_type}</DataType>
+	<ReadingList>
+{readings}
+	</ReadingList>
+</MeterData>"""
+
+READING_TEMPLATE = """		<Reading>
+			<Sequence>{sequence}</Sequence>
+			<Value>{value}</Value>
+			<Quality>{quality}</Quality>
+		</Reading>"""
+
+
+def sample_profile(sample_file=SAMPLE_FILE):
+    # Hourly values of the sample file (24 values, one per hour)
+    header, readings = xml_parser(str(sample_file), layout='long')
+    return [float(value) for value in readings['Value']]
+
+
+def day_bounds(day, timezone):
+    # Local midnight of the day and of the next one (23/25 hours apart on
+    # DST change days)
+    tz = ZoneInfo(timezone)
+    start = dt.datetime.combine(day, dt.time(), tzinfo=tz)
+    end = dt.datetime.combine(day + dt.timedelta(days=1), dt.time(), tzinfo=tz)
+    return start, end
+
+
+def make_readings(start, end, resolution, profile, rng, scale):
+    # One value per interval, following the profile of the sample file for
+    # the local hour of the interval
+    step = dt.timedelta(minutes=15 if resolution == 'PT15M' else 60)
+    per_hour = 4 if resolution == 'PT15M' else 1
+
+    utc = dt.timezone.utc
+    n_readings = int((end.astimezone(utc) - start.astimezone(utc)) / step)
+
+    readings = []
+    for i in range(n_readings):
+        local = (start.astimezone(utc) + i * step).astimezone(start.tzinfo)
+        value = profile[local.hour] * scale / per_hour * rng.uniform(0.9, 1.1)
+        quality = 'Measured' if rng.random() < 0.97 else 'Estimated'
+        readings.append([str(i + 1), f'{value:.2f}', quality])
+
+    return readings
+
+
+def render(fields, readings):
+    return TEMPLATE.format(
+        readings='\n'.join(READING_TEMPLATE.format(sequence=s, value=v, quality=q)
+                           for s, v, q in readings),
+        **fields
+        )
+
+
+def malform(kind, fields, readings, rng):
+    # Apply one kind of error to a file. Returns its content
+    fields = dict(fields)
+    readings = [list(reading) for reading in readings]
+    i = rng.randrange(len(readings))
+
+    if kind == 'decimals':
+        readings[i][1] = readings[i][1][:-1] if rng.random() < 0.5 else readings[i][1] + '5'
+    elif kind == 'sequence':
+        readings[i][0] = str(int(readings[i][0]) + 1)
+    elif kind == 'timespan':
+        fields['to_ts'] = fields['from_ts']
+    elif kind == 'naive':
+        fields['from_ts'] = fields['from_ts'][:19]
+    elif kind == 'not_meter_data':
+        return render(fields, readings).replace('MeterData', 'MeterDatum')
+
+    content = render(fields, readings)
+    if kind == 'truncated':
+        content = content[:rng.randrange(len(content) // 4, len(content) // 2)]
+    return content
+
+
+def generate_files(n_files, output_dir, seed=0, days=DEFAULT_DAYS,
+                   timezone='Europe/Zurich', pt15m_ratio=0.3,
+                   final_ratio=0.8, malformed_ratio=0.02):
+    # Write n_files files to output_dir. Returns the list of their paths
+    rng = random.Random(seed)
+    profile = sample_profile()
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    xml_files = []
+    meter = 0
+    while len(xml_files) < n_files:
+        # Each meter has its own resolution, direction and size
+        meter += 1
+        meter_point_id = str(541456700000000000 + meter)
+        resolution = 'PT15M' if rng.random() < pt15m_ratio else 'PT1H'
+        flow_direction = 'Consumption' if rng.random() < 0.9 else 'Production'
+        scale = rng.uniform(0.01, 2)
+
+        for day in days:
+            start, end = day_bounds(day, timezone)
+            readings = make_readings(start, end, resolution, profile, rng, scale)
+
+            # 'Provisional' version the day after, and (most of the times) the
+            # 'Final' one a month later with slightly different values
+            versions = [('Provisional', end + dt.timedelta(hours=13), readings)]
+            if rng.random() < final_ratio:
+                final = [[s, f'{float(v) * rng.uniform(0.98, 1.02):.2f}', 'Measured']
+                         for s, v, q in readings]
+                versions.append(('Final', end + dt.timedelta(days=33), final))
+
+            for data_type, created, version_readings in versions:
+                if len(xml_files) == n_files:
+                    break
+
+                fields = {
+                    'meter_point_id': meter_point_id,
+                    'from_ts':        start.isoformat(),
+                    'to_ts':          end.isoformat(),
+                    'flow_direction': flow_direction,
+                    'resolution':     resolution,
+                    'creation_ts':    created.replace(microsecond=0).isoformat(),
+                    'data_type':      data_type,
+                    }
+
+                if rng.random() < malformed_ratio:
+                    content = malform(rng.choice(MALFORMED_KINDS), fields, version_readings, rng)
+                else:
+                    content = render(fields, version_readings)
+
+                file_key = os.path.join(output_dir, f'{meter_point_id}_{day}_{data_type}.xml')
+                with open(file_key, 'w', encoding='utf-8') as file:
+                    file.write(content)
+                xml_files.append(file_key)
+
+    return xml_files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generator of synthetic MeterData files')
+    parser.add_argument('--files', type=int, default=5000, help='number of files (default: 5000)')
+    parser.add_argument('--output', required=True, help='output folder')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--malformed', type=float, default=0.02,
+                        help='share of malformed files (default: 0.02)')
+    args = parser.parse_args(argv)
+
+    xml_files = generate_files(args.files, args.output, seed=args.seed,
+                               malformed_ratio=args.malformed)
+    print(f'{len(xml_files)} files written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,257 +3,520 @@
 Created on Mon Jun 23 16:30:14 2025
 
 @author: alex_
+
+Ingestion of the MeterData .xml files into meter_data.sqlite.
+
+The settings are read from params.cfg (or --config), and any of them can be
+overridden from the command line:
+    python xml_parser_main.py
+    python xml_parser_main.py --input D:/backfill --backend threads --workers 4
+    python xml_parser_main.py --source s3 --set S3.prefix=root_folder/2025-05-07/
+    python xml_parser_main.py --list        # only list the input files
+    python xml_parser_main.py --recursive --start-date 2023-01-01 --end-date 2023-12-31 --shard 2/4
+    python xml_parser_main.py --dry-run     # list them and count the new ones
+    python xml_parser_main.py --resume      # continue an interrupted run
+    python xml_parser_main.py --rollups     # also update MeterDaily and MeterMonthly
+    python xml_parser_main.py --reprocess --start-date 2025-05-07 --end-date 2025-05-07 --cache cache/parse_cache.sqlite
+
+Once installed (pip install .), the same is available as the xml-parser command.
+
+Only the standard library is imported at startup: pandas, tqdm, boto3... are
+imported by the stages that need them, so --help, --list and --dry-run start
+immediately.
 """
 
 # Libraries
+import argparse
 import datetime as dt
 import os
-import pandas as pd
-import sqlite3
-from tqdm import tqdm
+import sys
+import time
 import traceback
 
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
 from configparser import ConfigParser
 from pathlib import Path
-from sys import path
 
-#%%
-# Read input .xml files
 
-# Option 1: if the files are in a local folder
+ACT_PATH = Path(__file__).parent.resolve()
+DEFAULT_CONFIG = ACT_PATH / 'params.cfg'
+
+# Command line shortcuts for the settings of params.cfg:
+# (option, section, key, help)
+OPTIONS = (
+    ('--input',      'Paths',      'input_path',   'folder with the input .xml files'),
+    ('--output',     'Paths',      'output_path',  'folder of meter_data.sqlite'),
+    ('--parquet',    'Paths',      'parquet_path', 'optional Parquet output folder'),
+    ('--backend',    'Parsing',    'backend',      'processes, threads or serial'),
+    ('--workers',    'Parsing',    'max_workers',  'parse workers (0: one per CPU core)'),
+    ('--batch-size', 'Parsing',    'batch_size',   'files per micro-batch'),
+    ('--parser',     'Parsing',    'parser',       'generic or fast'),
+    ('--cache',      'Cache',      'path',         'parse cache file (empty: no disk cache)'),
+    ('--timezone',   'Validation', 'timezone',     'local time zone of the files'),
+    ('--source',     'Source',     'source',       'local or s3'),
+    ('--start-date', 'Discovery',  'start_date',   'first day to load, YYYY-MM-DD (from the folder or file names)'),
+    ('--end-date',   'Discovery',  'end_date',     'last day to load, YYYY-MM-DD'),
+    ('--pattern',    'Discovery',  'pattern',      'glob of the file names, e.g. "*_Final.xml"'),
+    ('--shard',      'Discovery',  'shard',        'i/n: load only the i-th of n parts of the files'),
+    )
+
+# Same, for the on/off settings
+FLAGS = (
+    ('--recursive',  'Discovery',  'recursive',    'also list the subfolders of input_path'),
+    ('--rollups',    'Rollup',     'enabled',      'maintain the daily and monthly rollup tables'),
+    )
+
+# Settings that are paths: the relative ones of the config file are relative
+# to its folder (the ones of the command line, to the current folder)
+PATH_SETTINGS = (
+    ('Paths',  'input_path'),
+    ('Paths',  'output_path'),
+    ('Paths',  'parquet_path'),
+    ('Cache',  'path'),
+    ('Report', 'json_path'),
+    ('Report', 'prometheus_path'),
+    )
 
-# Read .cfg con los paths local
-ACT_PATH = str(Path(__file__).parent.resolve()) # (*)
 
-# (*) Note that this line fails when executed line by line, whole cell or
-# script must be executed
+#%%
+# Settings
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='xml-parser',
+        description='Ingestion of the MeterData .xml files into meter_data.sqlite',
+        )
+    parser.add_argument('--config', default=str(DEFAULT_CONFIG),
+                        help=f'settings file (default: {DEFAULT_CONFIG.name} next to this script)')
+    for option, section, key, help_text in OPTIONS:
+        parser.add_argument(option, dest=key, default=None,
+                            help=f'{help_text} (overrides {section}.{key})')
+    for option, section, key, help_text in FLAGS:
+        parser.add_argument(option, dest=key, action='store_const', const='yes', default=None,
+                            help=f'{help_text} (overrides {section}.{key})')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override any setting of the config file (repeatable)')
+
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--list', action='store_true',
+                      help='list the input files and exit')
+    mode.add_argument('--dry-run', action='store_true',
+                      help='count the files that would be parsed, without parsing or writing')
+
+    parser.add_argument('--reprocess', action='store_true',
+                        help='load the files again even if they were already loaded '
+                             '(e.g. after a change of the validation rules). The files '
+                             'already loaded are read twice: once to find the stored '
+                             'versions now rejected, then to load them (from the parse '
+                             'cache if it still holds them, see --cache)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the last run if it was interrupted, from its last '
+                             'committed batch')
+    parser.add_argument('--no-progress', action='store_true',
+                        help='no progress bar (e.g. when run from a scheduler)')
+    return parser.parse_args(argv)
+
+
+def read_config(args):
+    # params.cfg, then the overrides of the command line
+    config = ConfigParser()
+    if not config.read(args.config, encoding='utf-8'):
+        print(f'Config file {args.config} not found, using the defaults and the command line',
+              file=sys.stderr)
+
+    config_dir = Path(args.config).resolve().parent
+    for section, key in PATH_SETTINGS:
+        value = config.get(section, key, fallback='')
+        if value and not os.path.isabs(value):
+            config.set(section, key, str(config_dir / value))
+
+    overrides = []
+    for option, section, key, _ in OPTIONS + FLAGS:
+        if getattr(args, key) is not None:
+            overrides.append((section, key, getattr(args, key)))
+
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        section, dot, key = name.partition('.')
+        if not (sep and dot and section and key):
+            raise SystemExit(f'Invalid --set "{item}", expected SECTION.KEY=VALUE')
+        overrides.append((section, key, value))
+
+    for section, key, value in overrides:
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, key, value)
+
+    return config
+
+
+def load_settings(config):
+    # All the settings of a run, with their defaults
+    settings = {
+        # Path to the folder containing the input .xml files
+        'input_path':  config.get('Paths', 'input_path', fallback='input_data'),
+        'output_path': config.get('Paths', 'output_path', fallback='sqlite_db'),
+
+        # Optional Parquet output for the analytics jobs (empty to disable)
+        'parquet_path': config.get('Paths', 'parquet_path', fallback='') or None,
+
+        # Parsing backend (see xml_parser_exec.py): 'processes', 'threads' or
+        # 'serial'. max_workers defaults to the number of CPU cores
+        'backend':     config.get('Parsing', 'backend', fallback='processes'),
+        'max_workers': config.getint('Parsing', 'max_workers', fallback=0) or None,
+        'batch_size':  config.getint('Parsing', 'batch_size', fallback=250),
+
+        # 'fast' reads the files with the usual layout with the parser of
+        # xml_parser_fast.py (same results, the others go to the generic one)
+        'parser':      config.get('Parsing', 'parser', fallback='generic'),
+
+        # Cache of the parsed contents (see xml_parser_cache.py): in memory,
+        # and on disk if a path is given. Disabled if enabled = no
+        'cache': {
+            'path':      config.get('Cache', 'path', fallback='') or None,
+            'memory_mb': config.getfloat('Cache', 'memory_mb', fallback=64),
+            'disk_mb':   config.getfloat('Cache', 'disk_mb', fallback=1024),
+            } if config.getboolean('Cache', 'enabled', fallback=True) else None,
+
+        # Daily and monthly rollup tables (see xml_parser_rollup.py), updated
+        # with each batch for the days it touches
+        'rollups':     config.getboolean('Rollup', 'enabled', fallback=False),
+
+        # Local time zone of the files (to know which days have 23 or 25 hours)
+        'timezone':    config.get('Validation', 'timezone', fallback='Europe/Zurich'),
+
+        # Where the input files are: 'local' (input_path) or 's3' ([S3] section)
+        'source':      config.get('Source', 'source', fallback='local'),
+
+        # Run report (JSON, by default next to the DB) and optional Prometheus
+        # textfile
+        'report_path':     config.get('Report', 'json_path', fallback='') or None,
+        'prometheus_path': config.get('Report', 'prometheus_path', fallback='') or None,
+        }
+
+    # Which files to load (see xml_parser_discover.py): only the dates and
+    # names given, and with --shard i/n only the i-th of n parts of them, so
+    # that several hosts can split a backfill
+    try:
+        settings['discovery'] = {
+            'recursive':   config.getboolean('Discovery', 'recursive', fallback=False),
+            'start_date':  _date(config.get('Discovery', 'start_date', fallback='')),
+            'end_date':    _date(config.get('Discovery', 'end_date', fallback='')),
+            'pattern':     config.get('Discovery', 'pattern', fallback='') or None,
+            'shard':       _shard(config.get('Discovery', 'shard', fallback='')),
+            'max_workers': config.getint('Discovery', 'max_workers', fallback=8),
+            }
+    except ValueError as e:
+        raise SystemExit(f'Invalid [Discovery] setting: {e}')
+
+    settings['file_db'] = os.path.join(settings['output_path'], 'meter_data.sqlite')
+    # Note: we could use other extensions such as .db or .dat
+
+    if settings['source'] == 's3':
+        # Assuming we are already parsing the files on a daily basis and that
+        # each day folder name has format YYYY-MM-DD, the prefix can include {date}
+        current_date = dt.datetime.now().date()
+        settings['s3'] = {
+            'bucket_name':   config.get('S3', 'bucket_name', fallback=''),
+            'prefix':        config.get('S3', 'prefix', fallback='').format(date=current_date),
+            'endpoint_url':  config.get('S3', 'endpoint_url', fallback='') or None,
+            'max_in_flight': config.getint('S3', 'max_in_flight', fallback=32),
+            }
+    elif settings['source'] != 'local':
+        raise SystemExit(f'Unknown source "{settings["source"]}", expected local or s3')
+
+    return settings
+
+
+def _date(text):
+    return dt.date.fromisoformat(text) if text else None
+
+
+def _shard(text):
+    if not text:
+        return None
+    from xml_parser_discover import parse_shard
+    return parse_shard(text)
 
-config = ConfigParser()
-config.read(ACT_PATH + '/params.cfg', encoding='utf-8')
 
-# Path to the folder containing the input .xml files
-input_path  = config['Paths']['input_path']
-func_path   = config['Paths']['func_path']
-output_path = config['Paths']['output_path']
+#%%
+# Read input .xml files
 
-# Import auxiliar script containing the parsing function
-path.append(func_path)
-from xml_parser_func import xml_parser
+def open_source(settings):
+    # Returns the files to process (a generator: they are listed while the
+    # pipeline pulls them), the fetch function for remote files, and the
+    # S3Source (or None)
+
+    from xml_parser_discover import discover_files, filter_keys
+
+    discovery = settings['discovery']
+
+    # Option 1: if the files are in a local folder (with its subfolders if
+    # recursive, listed concurrently)
+    if settings['source'] == 'local':
+        # Checked here: discover_files only lists the folder once the
+        # pipeline starts pulling files
+        if not os.path.isdir(settings['input_path']):
+            raise SystemExit(f'Input folder {settings["input_path"]} not found '
+                             f'(Paths.input_path or --input)')
+        return discover_files(settings['input_path'], **discovery), None, None
+
+    # Option 2: if the files are in a remote storage (like an S3 bucket)
+    # --> Check code in "xml_parser_s3.py"
+    # The files are downloaded while the previous ones are parsed
+    from xml_parser_s3 import S3Source
+
+    s3 = settings['s3']
+    s3_source = S3Source(s3['bucket_name'], endpoint_url=s3['endpoint_url'],
+                         max_in_flight=s3['max_in_flight'])
+    xml_files = filter_keys(s3_source.list_objects(s3['prefix']), prefix=s3['prefix'],
+                            **{key: discovery[key] for key in ('start_date', 'end_date',
+                                                               'pattern', 'shard')})
+    return xml_files, s3_source.fetch, s3_source
+
+
+def list_files(settings):
+    count = 0
+    xml_files, _, _ = open_source(settings)
+    for item in xml_files:
+        print(item[0] if isinstance(item, tuple) else item)
+        count += 1
+    print(f'{count} files', file=sys.stderr)
+
+
+def dry_run(settings):
+    # Files that a run would parse: the new ones, and the ones that changed
+    # since they were loaded. The DB is opened read-only (and not created)
+    import sqlite3
+    from xml_parser_db import MANIFEST_TABLE, iter_new_files, table_exists
+
+    xml_files, _, _ = open_source(settings)
+    listed = Counter()
+
+    def count(items):
+        for item in items:
+            listed['listed'] += 1
+            yield item
+
+    n_new = None
+    if os.path.isfile(settings['file_db']):
+        conn = sqlite3.connect(f'file:{settings["file_db"]}?mode=ro', uri=True)
+        try:
+            if table_exists(conn, MANIFEST_TABLE):
+                n_new = sum(1 for _ in iter_new_files(conn, count(xml_files)))
+        finally:
+            conn.close()
+
+    if n_new is None:
+        # Nothing loaded yet: every file is new
+        n_new = sum(1 for _ in count(xml_files))
+
+    print(f'Listed {listed["listed"]} files, {n_new} new or changed would be parsed '
+          f'into {settings["file_db"]}')
+    return n_new
 
-# Option 2: if the files are in a remote storage (like an S3 bucket)
-# --> Check code in "xml_parser_extra.py"
 
 #%%
 # Apply parsing function
 
-# List all .xml files
-xml_files = [
-    os.path.join(input_path, filename)
-    for filename in os.listdir(input_path)
-    if filename.endswith(".xml")
-]
-# Could also use os.walk() ...
-
-# Initialize empty list to gather the data from all files
-# dict_list = []
-#
-# # Option 1. Parse each file (classic method)
-# for file_key in xml_files:
-#     file_dict = xml_parser(file_key)
-#     # Attach it to the list
-#     dict_list.append(file_dict)
-
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-# However, as we expect to process ~5000 files at once, we can speed up the
-# process by using parallel computation. There are 2 options:
-#   - locally: using the computer threads (multithreading)
-#   - on cloud: using tools like Spark (more details at the end of this cell)
-# Note: both can actually be used combined!
-
-# Option 2. Parallel parsing using Multithreading
-try:
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        # max_workers is the maximum number of parallel tasks
-        # (should not exceed the number of CPU cores)
-        
-        # Initialize list to gather the data
-        dict_list = []
-        
-        # Initialize list to store the parallel tasks to be performed
-        futures = []
-        
-        # Use tqdm to monitor progress
-        with tqdm(desc="Parsing", total=len(xml_files)) as pbar:
-            
-            # Submit a task for each file
-            for file_key in xml_files:
-                future = executor.submit(xml_parser, file_key)
-                futures.append(future)
-            
-            # Perform the tasks
-            for future in futures:
-                try:
-                    result = future.result()
-                    
-                    # Add results only if they are not None
-                    if result:
-                        dict_list.append(result)
-                    pbar.update(1)
-                
-                except Exception as e:
-                    print(f"Error while parsing {file_key}: {e}")  
-
-except Exception:
-    print(traceback.format_exc())
-    raise
-
-# Final step: turn the gathered data into a df (the keys are the columns, and
-# each dict (each file) corresponds to one row)
-df = pd.DataFrame(dict_list)
-
-# Notes:
-# If any of the dictionaries in dict_list is missing some keys (some columns),
-# it doesn't matter, pandas handles that on its own, including all different
-# keys found as new columns, and matching existing keys even if they don't 
-# in the same order in all the dicts. Basically, pandas makes our life easier!
-
-# Once the 5.000 files have been turned into a 5.000 rows df, the rest of 
-# the processing does not need enhanced computing, as it is a very small df and
-# therefore pandas is fast enough
-
-# Remark regarding Spark:
-# The script 'xml_parser_pyspark.py' showcases how we could use pyspark to
-# compute the parsing using parallel computation in a cluster of computers.
-# However, I believe that multithreading is more than enough to process the
-# 5000 daily files within a reasonably brief period of time (less than an hour).
-# This matters cause using cloud clusters represents additional costs
+def run(settings, progress=True, resume=False, reprocess=False):
+    # Imported here: these bring pandas (and tqdm), which are only needed to
+    # actually parse and load the files
+    from tqdm import tqdm
+
+    from xml_parser_db import connect
+    from xml_parser_metrics import RunMetrics
+    from xml_parser_pipeline import run_pipeline
+
+    xml_files, fetch, s3_source = open_source(settings)
+
+    # Make the output dir if needed
+    os.makedirs(settings['output_path'], exist_ok=True)
+
+    # Connect to the DB (in WAL mode, tuned for bulk loads, see xml_parser_db.py)
+    # Note: this line creates the DB if it doesn't already exists
+    conn = connect(settings['file_db'])
+
+    # # Option 1. Parse each file (classic method)
+    # for file_key in xml_files:
+    #     file_dict = xml_parser(file_key)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # However, as we expect to process ~5000 files at once (and much more in a
+    # backfill), the files go through a streaming pipeline (see
+    # xml_parser_pipeline.py), one micro-batch of batch_size files at a time:
+    #   1. Only the files that are new, or that changed since they were loaded,
+    #      are parsed (the DB keeps a manifest of the processed files with their
+    #      size and modification time). A rerun over a loaded folder is almost free
+    #   2. Parallel parsing using a pool of workers. The parsing is CPU-bound, so
+    #      with threads the GIL ends up running one file at a time: by default
+    #      each worker is a separate process, and returns its whole batch as a
+    #      (df_header, df_readings) chunk (see xml_parser_exec.py)
+    #   3. Datetime types fixing: timestamps are converted to UTC (values without
+    #      time zone become NaT). Each distinct string is parsed only once per run
+    #      (see xml_parser_timestamps.py)
+    #   4. Data Validation, all rules at once (see xml_parser_validation.py):
+    #       - 'timespan': each file must be exacty one day (24 hours, or 23/25
+    #                     hours on DST change days)
+    #       - 'decimals': numeric values must contain exactly 2 decimals (checked
+    #                     by the parser, which reads each value as an exact
+    #                     integer in hundredths: '9995.77' --> 999577)
+    #       - 'sequence': sequence must start from 1 and go incrementally with no
+    #                     gaps
+    #      The rules broken by each rejected file are recorded in the
+    #      RejectedFiles table (RunId, FileKey, Rule)
+    #   5. SQLite DB: each meter/day is stored only once, a 'Final' file replaces
+    #      the 'Provisional' one already loaded (and a 'Provisional' file arriving
+    #      after the 'Final' one is discarded). Then the batch is committed,
+    #      along with its checkpoint (IngestBatches): an interrupted run can be
+    #      continued with --resume
+    #   6. Files that can't be parsed or loaded don't stop the run: they go to
+    #      the FailedFiles table with their error
+    #   7. Optionally (--rollups), the days touched by the batch are summed
+    #      again into the MeterDaily and MeterMonthly tables (total, peaks,
+    #      readings not 'Measured'), in the same transaction
+    #
+    # Only a few batches are in memory at any time, so the memory used does not
+    # grow with the number of files
+
+    # Notes:
+    # The tables are in long layout: one row per file in df_header, one row per
+    # reading in df_readings. The former layout (one row per file with
+    # 'Readings_{i}_*' columns) created 3 sparse object columns per reading (288
+    # for a PT15M file), and the schema of the DB table changed whenever the
+    # number of readings did
+
+    # Remark regarding Spark:
+    # The script 'xml_parser_pyspark.py' showcases how we could use pyspark to
+    # compute the parsing using parallel computation in a cluster of computers.
+    # However, I believe that a local pool of workers is more than enough to process the
+    # 5000 daily files within a reasonably brief period of time (less than an hour).
+    # This matters cause using cloud clusters represents additional costs
+
+    totals = Counter()
+
+    # Time of each stage, parse time of each file, rows rejected per rule...
+    # (see xml_parser_metrics.py)
+    metrics = RunMetrics()
+
+    try:
+        start = time.perf_counter()
 
-#%%
-# Datetime types fixing
-
-# Convert datetime cols to datetime type
-for col in df.columns:
-    if 'timestamp' in col.lower():
-        
-        # Cast to datetimem, coercing errors into NaTs
-        df[col] = pd.to_datetime(df[col], errors='coerce')
-        
-        # Note: UTC+02:00 means these values are Local Time datetimes
-        
-        # If a value has datetime format, but the UTC zone is missing, replace
-        # it with NaT
-        df[col] = df[col].apply(
-            lambda x:
-                x if pd.isnull(x) or x.tzinfo is not None
-                else pd.NaT
-            )
-
-        # Transform datetime values from UTC+2 to UTC
-        df[col] = df[col].dt.tz_convert("UTC")
-        
-        # Note that this mixes up dates in each file (could be relevant when
-        # designing the validation)
-        
-#%%
-# Data Validation
-
-# STEP 1: each file must be exacty one day
-
-# Create a mask to select only the rows (files) whose timespans are exactly 24 hours
-mask_time = df['ToTimestamp'] - df['FromTimestamp'] == dt.timedelta(hours=24)
-
-# Drop invalid rows
-df = df[mask_time]
-
-# STEP 2: Numeric values must contain exactly 2 decimals
-# Note: if a value ends in zero, turning it into numeric would lose that info
-# Instead, let's make the validation first with values as str, and later we will
-# turn them to type numeric (optional)
-
-def check_decimals(value):
-    # (Optional) Make sure it is type str
-    value = str(value)
-    
-    # If no decimals, invalid value
-    if '.' not in value:
-        return False
-    
-    decimals = value.split('.')[-1]
-    
-    # If it has 2 decimals, valid value
-    if len(decimals) == 2:
-        return True
+        # Use tqdm to monitor progress
+        with tqdm(desc="Ingesting", unit="files", disable=not progress) as pbar:
+
+            for report in run_pipeline(conn, xml_files,
+                                       backend=settings['backend'],
+                                       max_workers=settings['max_workers'],
+                                       batch_size=settings['batch_size'],
+                                       timezone=settings['timezone'],
+                                       totals=totals,
+                                       fetch=fetch,
+                                       parquet_path=settings['parquet_path'],
+                                       metrics=metrics,
+                                       parser=settings['parser'],
+                                       resume=resume,
+                                       cache=settings['cache'],
+                                       reprocess=reprocess,
+                                       rollups=settings['rollups']):
+                pbar.update(report['files'])
+
+        elapsed = time.perf_counter() - start
+        metrics.finish()
+
+    except Exception:
+        print(traceback.format_exc())
+        raise
+
+    finally:
+        conn.close()
+
+    # Summary of the run
+    print(f'Listed {totals["listed"]} files, {totals["new"]} new or changed')
+    print(f'Valid files: {totals["valid"]}. Rejected files: {totals["rejected"]} (see the '
+          f'RejectedFiles table). Failed files: {totals["failed"]} (see the FailedFiles table)')
+    for key, count in sorted(totals.items()):
+        if key.startswith('rejected_'):
+            print(f'    {key[len("rejected_"):]}: {count}')
+    if totals['files_deleted']:
+        print(f'Reprocess: {totals["files_deleted"]} stored versions now rejected were '
+              f'replaced or deleted')
+
+    print(f'Data succesfully added to the DB ({totals["files_written"]} files, '
+          f'{totals["readings_written"]} readings) in {elapsed:.2f} s with the '
+          f'"{settings["backend"]}" backend ({totals["new"] / max(elapsed, 1e-9):.1f} files/s)')
+
+    if metrics.files['cached']:
+        print(f'Parse cache: {metrics.files["cached"]} files were not parsed again')
+
+    if settings['rollups']:
+        print(f'Rollups: {totals["rollup_days"]} meter/days updated in MeterDaily and MeterMonthly')
+
+    if settings['parquet_path']:
+        print(f'Parquet: {totals["parquet_rows"]} readings written to {settings["parquet_path"]}')
+
+    if s3_source is not None:
+        print(s3_source.throughput(elapsed))
+
+    # Run report
+    report_path = settings['report_path'] or os.path.join(settings['output_path'],
+                                                           'run_report.json')
+    run_report = metrics.write_json(report_path, totals,
+                                    **{key: settings[key] for key in ('backend', 'max_workers',
+                                                                      'batch_size', 'parser',
+                                                                      'source', 'timezone',
+                                                                      'rollups')})
+    if settings['prometheus_path']:
+        metrics.write_prometheus(settings['prometheus_path'], totals)
+
+    print(f'Run report written to {report_path}')
+    for name, stage in run_report['stages'].items():
+        print(f'    {name}: {stage["wall_s"]:.2f} s (CPU {stage["cpu_s"]:.2f} s)')
+    if run_report['slowest_files']:
+        slowest = run_report['slowest_files'][0]
+        print(f'Slowest file: {slowest["file_key"]} ({slowest["seconds"] * 1000:.1f} ms)')
+
+    return totals
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = load_settings(read_config(args))
+
+    if args.list:
+        list_files(settings)
+    elif args.dry_run:
+        dry_run(settings)
     else:
-        return False
-
-# Check each numeric column
-for col in df.columns:
-    if 'value' in col.lower():
-        
-        # Create a mask based on the check function
-        mask_decimals = df[col].apply(check_decimals)
-        
-        # Filter valid values
-        df = df[mask_decimals]
-        
-        # (Optional) Cast to numeric
-        # - float as we need decimals
-        # - if float64 is not needed, we could use 'float32' for memory optimization
-        # - coerce errors to NAs (we could use drop instead, but I for now let's keep track of errors)
-        df[col] = pd.to_numeric(df[col], errors='coerce')  # .astype('float32')
-
-# STEP 3: Sequence must start from 1 and go incrementally with no gaps
-
-def check_sequence(row):
-    return
-
-for col in df.columns:
-    if 'sequence' in col.lower():
-        # Select the col number
-        col_num = col.split('_')[1]
-        
-        # Compare that number to the original 'Sequence' value
-        # If they differ, drop that row, for the sequence is compromised
-        mask_seq = df[col] == col_num
-        
-        # Filter valid values
-        df = df[mask_seq]
+        run(settings, progress=not args.no_progress, resume=args.resume,
+            reprocess=args.reprocess)
+    return 0
 
-#%%
-# SQLite DB
-
-# Make the output dir if needed
-if not os.path.isdir(output_path):
-    os.mkdir(output_path)
-
-# Specify DB path
-file_db = os.path.join(output_path, 'meter_data.sqlite')
-# Note: we could use other extensions such as .db or .dat
-
-# Connect to the DB
-conn = sqlite3.connect(file_db)
-
-# Note: this line creates the DB if it doesn't already exists
 
-# Insert the processed data in the sqlite DB
-df.to_sql(name='MeterData',  # table name inside de DB
-          con=conn,
-          if_exists='append',
-          index=False        # ignore the df index
-          )
-
-print('Data succesfully added to the DB')
+# The guard is needed by the "processes" backend: with the 'spawn' start
+# method (Windows, macOS) every worker imports this module
+if __name__ == '__main__':
+    sys.exit(main())
 
 #%%
 # # dev_test: check that it worked!
 
+# import sqlite3
+# import pandas as pd
+
 # conn = sqlite3.connect(file_db)
 
-# df_check = pd.read_sql_query("SELECT * FROM MeterData LIMIT 5;", conn)
+# # Values are stored in hundredths (ValueCenti)
+# df_check = pd.read_sql_query("SELECT *, ValueCenti / 100.0 AS Value FROM MeterReadings LIMIT 5;", conn)
 # print(df_check)
 
 # conn.close()
 
-
-
+# # Or through the query module (typed results, cached until the next load),
+# # see xml_parser_query.py
+# from xml_parser_query import MeterQueries
+# queries = MeterQueries(file_db, timezone=timezone)
+# print(queries.daily_totals(dt.date(2025, 5, 1), dt.date(2025, 6, 1)))
+# # With --rollups, from the precomputed tables (one row per meter and month)
+# print(queries.monthly_rollup(dt.date(2025, 1, 1), dt.date(2026, 1, 1)))
+# queries.close()
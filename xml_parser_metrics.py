@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the ingestion runs (see xml_parser_pipeline.py):
+    - wall and CPU time of each stage of the pipeline (listing, parse, ...).
+      The times of a stage exclude the stages nested in it, e.g. the listing
+      runs inside the parse stage, when the executor asks for more files
+    - CPU time spent by the parse workers (threads or processes)
+    - parse latency of every file, as a histogram, plus the slowest files
+    - files per outcome, bytes read, readings accepted and rejected per rule
+
+At the end of the run the metrics are written as a JSON report and,
+optionally, as a Prometheus textfile (for the node_exporter textfile
+collector), e.g.:
+    xml_parser_parse_seconds_bucket{le="0.01"} 4871
+    xml_parser_rows{result="rejected",rule="decimals"} 96
+"""
+
+# Libraries
+import bisect
+import datetime as dt
+import heapq
+import json
+import os
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+# Upper bounds (seconds) of the parse latency histogram
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Number of slowest files kept in the report
+SLOWEST_FILES = 10
+
+PROMETHEUS_PREFIX = 'xml_parser'
+
+
+class RunMetrics:
+
+    def __init__(self, buckets=PARSE_BUCKETS, slowest_files=SLOWEST_FILES):
+        self.buckets       = tuple(buckets)
+        self.slowest_files = slowest_files
+
+        self.started_at = dt.datetime.now(dt.timezone.utc)
+        self._start     = time.perf_counter()
+        self.wall_s     = None
+
+        # {stage: {'wall_s', 'cpu_s', 'calls'}}
+        self.stages = defaultdict(lambda: {'wall_s': 0.0, 'cpu_s': 0.0, 'calls': 0})
+        # Wall and CPU time of the stages nested in the running ones
+        self._stack = []
+
+        self.worker_cpu_s = 0.0
+
+        # Parse latency: one count per bucket (the last one is +Inf)
+        self.parse_counts = [0] * (len(self.buckets) + 1)
+        self.parse_sum    = 0.0
+        self._slowest     = []  # heap of (seconds, file_key)
+
+        self.files      = Counter()  # per outcome: parsed, failed, empty...
+        self.rows       = Counter()  # accepted, and rejected_<rule>
+        self.bytes_read = 0
+
+    # --- Collection ---
+
+    @contextmanager
+    def stage(self, name):
+        # Time the block as stage name (wall and CPU time of the main process)
+        self._stack.append([0.0, 0.0])
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+
+            nested_wall, nested_cpu = self._stack.pop()
+            stage = self.stages[name]
+            stage['wall_s'] += wall - nested_wall
+            stage['cpu_s']  += cpu - nested_cpu
+            stage['calls']  += 1
+
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+
+    def timed(self, iterable, name):
+        # Generator timing each step of iterable as stage name
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_parse_stats(self, parse_stats):
+        # Stats of a parsed batch (see parse_batch in xml_parser_exec.py)
+        self.worker_cpu_s += parse_stats['cpu_s']
+
+        for file_key, seconds, status in parse_stats['files']:
+            self.files[status] += 1
+            self.parse_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.parse_sum += seconds
+
+            if len(self._slowest) < self.slowest_files:
+                heapq.heappush(self._slowest, (seconds, file_key))
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, (seconds, file_key))
+
+    def add_rows(self, n_accepted, rejected_per_rule):
+        # Readings of the valid files, and of the rejected ones per rule
+        self.rows['accepted'] += n_accepted
+        for rule, n_rows in rejected_per_rule.items():
+            self.rows[f'rejected_{rule}'] += n_rows
+
+    def add_bytes(self, n_bytes):
+        self.bytes_read += n_bytes
+
+    def finish(self):
+        self.wall_s = time.perf_counter() - self._start
+
+    # --- Output ---
+
+    def report(self, totals=None, **params):
+        # Run report as a dict (JSON serializable). totals: the Counter of
+        # run_pipeline, params: anything describing the run (backend...)
+        wall_s = self.wall_s if self.wall_s is not None else time.perf_counter() - self._start
+        n_parsed = sum(self.files.values())
+
+        cumulative = 0
+        histogram = []
+        for bound, count in zip(self.buckets + (None,), self.parse_counts):
+            cumulative += count
+            histogram.append({'le': bound if bound is not None else '+Inf',
+                              'count': cumulative})
+
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'wall_s':     round(wall_s, 6),
+            'params':     params,
+            'totals':     dict(totals or {}),
+            'files':      dict(self.files),
+            'bytes_read': self.bytes_read,
+            'rows':       dict(self.rows),
+            'throughput': {
+                'files_per_s': round(n_parsed / max(wall_s, 1e-9), 1),
+                'mb_per_s':    round(self.bytes_read / 1e6 / max(wall_s, 1e-9), 3),
+                },
+            'stages': {name: {key: round(value, 6) for key, value in stage.items()}
+                       for name, stage in self.stages.items()},
+            'worker_cpu_s': round(self.worker_cpu_s, 6),
+            'parse_seconds': {
+                'count':     n_parsed,
+                'sum':       round(self.parse_sum, 6),
+                'mean':      round(self.parse_sum / max(n_parsed, 1), 6),
+                'histogram': histogram,
+                },
+            'slowest_files': [{'file_key': file_key, 'seconds': round(seconds, 6)}
+                              for seconds, file_key in sorted(self._slowest, reverse=True)],
+            }
+
+    def write_json(self, path, totals=None, **params):
+        report = self.report(totals, **params)
+        _write_atomic(path, json.dumps(report, indent=2, default=str))
+        return report
+
+    def write_prometheus(self, path, totals=None):
+        # Prometheus text exposition format. The file is replaced atomically,
+        # so that the collector never reads a half-written file
+        p = PROMETHEUS_PREFIX
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {p}_{name} {help_text}')
+            lines.append(f'# TYPE {p}_{name} {kind}')
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'{p}_{name}{suffix}{{{label_text}}} {value}'
+                             if label_text else f'{p}_{name}{suffix} {value}')
+
+        wall_s = self.wall_s if self.wall_s is not None else time.perf_counter() - self._start
+
+        metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last run.',
+               [('', {}, self.started_at.timestamp())])
+        metric('run_duration_seconds', 'gauge', 'Wall time of the last run.',
+               [('', {}, round(wall_s, 6))])
+
+        totals = totals or {}
+        metric('files', 'gauge', 'Files of the last run per outcome.',
+               [('', {'status': status}, totals.get(status, 0))
+                for status in ('listed', 'new', 'valid', 'rejected')]
+               + [('', {'status': status}, count) for status, count in sorted(self.files.items())])
+
+        metric('bytes_read', 'gauge', 'Bytes of the files parsed in the last run.',
+               [('', {}, self.bytes_read)])
+
+        rows = [('', {'result': 'accepted'}, self.rows['accepted'])]
+        rows += [('', {'result': 'rejected', 'rule': key[len('rejected_'):]}, count)
+                 for key, count in sorted(self.rows.items()) if key.startswith('rejected_')]
+        metric('rows', 'gauge', 'Readings accepted, and rejected per validation rule.', rows)
+
+        metric('stage_seconds', 'gauge', 'Time spent in each stage of the last run.',
+               [('', {'stage': name, 'clock': clock}, round(stage[f'{clock}_s'], 6))
+                for name, stage in sorted(self.stages.items()) for clock in ('wall', 'cpu')]
+               + [('', {'stage': 'parse_workers', 'clock': 'cpu'}, round(self.worker_cpu_s, 6))])
+
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets + (None,), self.parse_counts):
+            cumulative += count
+            buckets.append(('_bucket', {'le': bound if bound is not None else '+Inf'}, cumulative))
+        metric('parse_seconds', 'histogram', 'Parse time per file in the last run.',
+               buckets + [('_sum', {}, round(self.parse_sum, 6)),
+                          ('_count', {}, cumulative)])
+
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+
+def _write_atomic(path, text):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Optional Parquet output (next to the SQLite DB), for the analytics jobs.
+
+The readings of the valid files are written with their header fields as a
+Parquet dataset partitioned by delivery date (local day of FromTimestamp) and
+DataType, one file per micro-batch and partition:
+    parquet_path/DeliveryDate=2025-05-07/DataType=Final/part-<run>-<batch>.parquet
+
+Repeated text columns (MeterPointId, Quality, Unit...) are dictionary-encoded
+and the timestamps are stored as real timestamps (UTC), so the files are small
+and the scans can skip whole partitions and row groups when filtering by date,
+DataType or meter. The values are decimal(18, 2), built straight from the
+hundredths of df_readings (exact, no float in between).
+
+The dataset mirrors the versions kept in SQLite: only the files that
+upsert_tables inserted are written, and the rows of the versions it replaced
+(or that delete_files removed) are removed with delete_parquet, which rewrites
+the partition files holding them. Both run once the batch is committed, so a
+batch rolled back never reaches the dataset. Loading the same file again (e.g.
+with reprocess) replaces its stored version, so its rows are removed before
+the new ones are written instead of being duplicated. Every file is written
+next to its final name and renamed, so readers never see half a file.
+
+If writing the dataset fails after a commit, the run stops with the error: the
+batch is in SQLite but not in the dataset. A run with reprocess writes it
+again.
+"""
+
+# Libraries
+import datetime as dt
+import os
+
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+_dictionary = pa.dictionary(pa.int32(), pa.string())
+_timestamp  = pa.timestamp('us', tz='UTC')
+
+SCHEMA = pa.schema([
+    ('FileKey',           _dictionary),
+    ('MeterPointId',      _dictionary),
+    ('FromTimestamp',     _timestamp),
+    ('ToTimestamp',       _timestamp),
+    ('FlowDirection',     _dictionary),
+    ('Resolution',        _dictionary),
+    ('Unit',              _dictionary),
+    ('CreationTimestamp', _timestamp),
+    ('Sequence',          pa.int32()),
+    ('Value',             pa.decimal128(18, 2)),
+    ('Quality',           _dictionary),
+    ('DeliveryDate',      pa.date32()),
+    ('DataType',          pa.string()),
+    ])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('DeliveryDate', pa.date32()), ('DataType', pa.string())]),
+    flavor='hive'
+    )
+
+# Folder name of a null partition value (as written by pyarrow)
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def to_decimal(value_centi, scale=2):
+    # Int64 hundredths --> decimal128 array with the same digits. A decimal128
+    # is its unscaled value as a 128-bit integer, so the int64 values only
+    # need to be sign-extended into the high 64 bits (little endian)
+    values = value_centi.to_numpy(dtype='int64', na_value=0)
+    na = value_centi.isna().to_numpy()
+
+    words = np.empty((len(values), 2), dtype='<i8')
+    words[:, 0] = values
+    words[:, 1] = values >> 63
+
+    validity = pa.array(~na).buffers()[1] if na.any() else None
+    return pa.Array.from_buffers(pa.decimal128(18, scale), len(values),
+                                 [validity, pa.py_buffer(words)],
+                                 null_count=int(na.sum()))
+
+
+def to_arrow(df_header, df_readings, timezone):
+    # One row per reading with the header fields of its file
+    df_header = df_header.assign(
+        DeliveryDate=df_header['FromTimestamp'].dt.tz_convert(timezone).dt.date
+        )
+    df = df_readings.merge(df_header, on='FileId', how='inner', sort=False)
+
+    # Every column but Value from pandas, then Value from the hundredths
+    i_value = SCHEMA.get_field_index('Value')
+    table = pa.Table.from_pandas(df[[name for name in SCHEMA.names if name != 'Value']],
+                                 schema=SCHEMA.remove(i_value), preserve_index=False)
+
+    return table.add_column(i_value, SCHEMA.field('Value'), to_decimal(df['ValueCenti']))
+
+
+def partition_path(parquet_path, delivery_date, data_type):
+    # Folder of a (DeliveryDate, DataType) partition
+    return Path(parquet_path, *(
+        f'{name}={NULL_PARTITION if value is None else quote(str(value), safe="")}'
+        for name, value in (('DeliveryDate', delivery_date), ('DataType', data_type))
+        ))
+
+
+def write_parquet(df_header, df_readings, parquet_path, timezone, name):
+    # Write the files of a committed micro-batch to the dataset, as one file
+    # part-{name}.parquet per partition. Returns the number of rows written
+    if df_header.empty:
+        return 0
+
+    table = to_arrow(df_header, df_readings, timezone)
+
+    partitions = table.select(['DeliveryDate', 'DataType']).to_pandas()
+    for (delivery_date, data_type), rows in partitions.groupby(
+            ['DeliveryDate', 'DataType'], dropna=False, sort=False).indices.items():
+        folder = partition_path(parquet_path, None if pd.isna(delivery_date) else delivery_date,
+                                None if pd.isna(data_type) else data_type)
+        folder.mkdir(parents=True, exist_ok=True)
+        _write_atomic(table.take(rows).drop_columns(['DeliveryDate', 'DataType']),
+                      folder / f'part-{name}.parquet')
+
+    return table.num_rows
+
+
+def delete_parquet(parquet_path, versions, timezone):
+    # Remove the rows of the versions deleted from SQLite, as
+    # (FileKey, FromTimestamp, DataType) with the FromTimestamp as stored
+    # ('YYYY-MM-DD HH:MM:SS+00:00'). Returns the number of rows removed
+    file_keys = defaultdict(set)
+    for file_key, from_timestamp, data_type in versions:
+        delivery_date = pd.Timestamp(from_timestamp).tz_convert(timezone).date()
+        file_keys[delivery_date, data_type].add(file_key)
+
+    # The rows may have been written with another time zone, so their
+    # DeliveryDate can be a day off
+    one_day = dt.timedelta(days=1)
+
+    n_removed = 0
+    for (delivery_date, data_type), keys in file_keys.items():
+        for date in (delivery_date, delivery_date - one_day, delivery_date + one_day):
+            removed, found = _remove_rows(partition_path(parquet_path, date, data_type), keys)
+            n_removed += removed
+            keys = keys - found
+            if not keys:
+                break
+
+    return n_removed
+
+
+def _remove_rows(folder, file_keys):
+    # Rewrite the files of a partition without the rows of these FileKeys.
+    # Returns the number of rows removed and the FileKeys found
+    n_removed, found = 0, set()
+    if not folder.is_dir():
+        return n_removed, found
+
+    value_set = pa.array(sorted(file_keys), type=pa.string())
+    for path in sorted(folder.glob('part-*.parquet')):
+        # Only the FileKey column is read to know if the file has to change
+        keys = pq.ParquetFile(path).read(columns=['FileKey']).column('FileKey')
+        mask = pc.is_in(keys.cast(pa.string()), value_set=value_set)
+        n_rows = pc.sum(mask).as_py() or 0
+        if not n_rows:
+            continue
+
+        found.update(pc.unique(keys.filter(mask).cast(pa.string())).to_pylist())
+        n_removed += n_rows
+        if n_rows == len(keys):
+            path.unlink()
+        else:
+            table = pq.ParquetFile(path).read()
+            _write_atomic(table.filter(pc.invert(mask)), path)
+
+    return n_removed, found
+
+
+def _write_atomic(table, path):
+    # Written next to it, then renamed: a reader never sees half a file
+    # (names starting with '.' are ignored by the dataset)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_parquet(parquet_path, filters=None, columns=None):
+    # Read (part of) the dataset back as a DataFrame, e.g.:
+    #   read_parquet(path, filters=[('DeliveryDate', '=', dt.date(2025, 5, 7)),
+    #                               ('DataType', '=', 'Final')])
+    dataset = ds.dataset(parquet_path, format='parquet', partitioning=PARTITIONING)
+    table = dataset.to_table(columns=columns, filter=_to_expression(filters))
+    return table.to_pandas()
+
+
+def _to_expression(filters):
+    # [(column, op, value), ...] (combined with AND) --> dataset expression
+    if not filters:
+        return None
+
+    ops = {
+        '=':  lambda f, v: f == v,
+        '==': lambda f, v: f == v,
+        '!=': lambda f, v: f != v,
+        '<':  lambda f, v: f < v,
+        '<=': lambda f, v: f <= v,
+        '>':  lambda f, v: f > v,
+        '>=': lambda f, v: f >= v,
+        'in': lambda f, v: f.isin(v),
+        }
+
+    expression = None
+    for column, op, value in filters:
+        condition = ops[op](ds.field(column), value)
+        expression = condition if expression is None else expression & condition
+
+    return expression
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end streaming pipeline: discover -> parse -> validate -> write.
+
+Every stage is a generator that pulls from the previous one, so files flow
+through the pipeline in micro-batches of batch_size files:
+    - discover_files lists the input folder lazily (see xml_parser_discover.py)
+    - iter_new_files skips the files already loaded (manifest lookups per chunk)
+    - parse_files keeps at most 2 batches per worker in flight
+    - each parsed batch is validated, written and committed before the next
+      one is requested
+
+Nothing grows with the number of files (no list of files, futures, dicts or a
+giant DataFrame), so the peak memory is the same for a 5.000 files day as for a
+500.000 files backfill. An interrupted run loses at most the batches in flight:
+the committed ones are in the manifest and are not parsed again.
+
+Each committed batch is a checkpoint of the run (IngestRuns/IngestBatches,
+committed with its data), and a run that was interrupted can be continued
+with resume=True. A file that can't be parsed or loaded does not stop the
+run: it goes to the FailedFiles quarantine with its error. If writing a batch
+fails, its files are loaded again one by one, so that only the faulty ones are
+left out. Errors that are not caused by a file (a worker process killed, the
+DB locked, the disk full...) stop the run instead: the files in flight are
+neither checkpointed nor quarantined, and resume=True parses them again.
+
+With reprocess=True, a first pass parses the listed files that have a stored
+version and checks them against the current rules, without writing anything.
+The second pass loads every listed file, the ones whose stored version is now
+rejected last: a stored version that is rejected never wins against an
+incoming one, so a day gets the best valid version among the reprocessed files
+(which replaces the rejected one in the same transaction), whatever the batch
+it comes in, and the rejected versions with no replacement are deleted by the
+last batches. A day is never left empty by a committed batch while the rest of
+the listing may still have a valid version for it, so an interrupted run only
+needs to be run again. The listed files are kept in a temp table for both
+passes (about 100 bytes per file), and the stored ones are parsed twice (the
+second time from the parse cache, if enabled).
+
+With rollups=True, the daily and monthly rollup tables (see
+xml_parser_rollup.py) are updated in the same transaction as each batch, for
+the meter/days of its files only.
+
+Each stage is timed, and the parse stats of every batch are collected, in a
+RunMetrics object (see xml_parser_metrics.py).
+"""
+
+# Libraries
+import itertools
+import sqlite3
+
+from collections import Counter
+
+import pandas as pd
+
+from xml_parser_db import (clear_failures, create_schema, delete_files, finish_run,
+                           iter_new_files, migrate_wide_table, record_batch, record_failures,
+                           record_files, record_rejections, start_run, upsert_tables)
+from xml_parser_exec import batch_keys, parse_files
+from xml_parser_metrics import RunMetrics
+from xml_parser_tables import convert_timestamps
+from xml_parser_validation import DEFAULT_TIMEZONE, validate
+
+
+# Errors that are not caused by the files being loaded: they stop the run
+# instead of sending the files to the quarantine
+SYSTEM_ERRORS = (sqlite3.OperationalError, OSError, MemoryError)
+
+
+def run_pipeline(conn, xml_files, backend='processes', max_workers=None,
+                 batch_size=250, timezone=DEFAULT_TIMEZONE, totals=None,
+                 fetch=None, parquet_path=None, metrics=None, parser='generic',
+                 resume=False, cache=None, reprocess=False, rollups=False):
+    # Generator of one report (dict) per committed micro-batch. If a Counter
+    # is passed as totals, it is updated in place with the running totals
+    # (including the files listed and skipped, which have no batch)
+
+    # xml_files: local paths, or (file_key, (size, mtime_ns)) pairs
+    # fetch: optional function turning an iterable of file keys into
+    # (file_key, data) pairs, to download remote files (see xml_parser_s3.py)
+    # while the previous ones are parsed. Files it fails to fetch are not
+    # recorded in the manifest, so the next run tries them again
+    # parquet_path: if set, the valid files are also written to a Parquet
+    # dataset (see xml_parser_parquet.py), once their batch is committed
+    # metrics: optional RunMetrics, updated in place
+    # parser: 'generic' or 'fast' (see xml_parser_exec.py)
+    # resume: continue the last run if it did not complete (see start_run)
+    # cache: optional arguments of open_cache (see xml_parser_cache.py), to
+    # not parse again the contents already parsed
+    # reprocess: load the files again even if they are in the manifest (e.g.
+    # a day, after a change of the validation rules)
+    # rollups: maintain the MeterDaily and MeterMonthly tables
+    if totals is None:
+        totals = Counter()
+    if metrics is None:
+        metrics = RunMetrics()
+
+    # Checkpoints (see xml_parser_db.py): with resume, the batches go on
+    # from the last one committed by the interrupted run
+    run_id, batch_no = start_run(conn, resume)
+    totals['run_id'] = run_id
+
+    # Stats of the files in flight, recorded in the manifest once their batch
+    # is committed
+    pending_stats = {}
+
+    # With reprocess, FileKeys of the stored versions that the current rules
+    # reject (filled by the first pass)
+    replaceable = set()
+
+    def files_to_parse():
+        if reprocess:
+            # The files whose stored version is rejected come last
+            new_files = itertools.chain(
+                ((file_key, stat) for file_key, stat in _spooled(conn)
+                 if file_key not in replaceable),
+                ((file_key, stat) for file_key, stat in _spooled(conn)
+                 if file_key in replaceable),
+                )
+        else:
+            new_files = iter_new_files(conn, _count(xml_files, totals, 'listed'))
+        for file_key, stat in new_files:
+            pending_stats[file_key] = stat
+            totals['new'] += 1
+            yield file_key
+
+    items = metrics.timed(files_to_parse(), 'listing')
+    if fetch is not None:
+        items = metrics.timed(fetch(items), 'fetch')
+
+    batches = parse_files(items, backend=backend, max_workers=max_workers,
+                          batch_size=batch_size, parser=parser, cache=cache)
+
+    # Versions written and deleted by the batch, copied to the Parquet
+    # dataset once it is committed
+    changes = [] if parquet_path else None
+
+    def load(df_header, df_readings):
+        return _load(conn, df_header, df_readings, file_readings, timezone,
+                     changes, metrics, reprocess, rollups, run_id, replaceable)
+
+    try:
+        # Tables and indexes, once per run (committed with the first batch)
+        create_schema(conn)
+
+        # DBs loaded by the first version of the script (wide MeterData table)
+        skipped = []
+        n_migrated = migrate_wide_table(conn, skipped)
+        if n_migrated or skipped:
+            conn.commit()
+            print(f'{n_migrated} files moved from the MeterData table to '
+                  f'MeterHeader/MeterReadings')
+        if skipped:
+            print(f'{len(skipped)} files of the MeterData table have values that are not '
+                  f'numbers: they were not moved (see the MeterData_legacy table)')
+
+        if rollups:
+            # Imported here so that the rollups are only loaded when enabled.
+            # On a DB loaded without them, they are built from the stored days
+            # first
+            from xml_parser_rollup import init_rollups
+            with metrics.stage('rollup'):
+                n_days = init_rollups(conn, timezone)
+                conn.commit()
+            if n_days:
+                print(f'Rollup tables built from {n_days} stored days')
+
+        if reprocess:
+            with metrics.stage('listing'):
+                _spool(conn, iter_new_files(conn, _count(xml_files, totals, 'listed'),
+                                            include_processed=True))
+            replaceable.update(_find_rejected(
+                conn, fetch, timezone, metrics, backend=backend, max_workers=max_workers,
+                batch_size=batch_size, parser=parser, cache=cache))
+
+        for batch, (df_header, df_readings), parse_stats in metrics.timed(batches, 'parse'):
+            metrics.add_parse_stats(parse_stats)
+            file_keys = batch_keys(batch)
+
+            # Readings per file before the validation, to count the rejected ones
+            file_readings = df_readings['FileId'].value_counts()
+
+            load_errors = {}
+            try:
+                counts, rejected_rows = load(df_header, df_readings)
+            except SYSTEM_ERRORS:
+                # Not caused by the files (e.g. DB locked, disk full): the run
+                # stops, and can be resumed once it is fixed
+                raise
+            except Exception as e:
+                # Only the files that can't be loaded must be left out: the
+                # batch is loaded again file by file
+                conn.rollback()
+                if changes is not None:
+                    changes.clear()
+                print(f'Error while loading the batch starting at {file_keys[0]}: {e}. '
+                      f'Loading its files one by one')
+                counts, rejected_rows, load_errors = _load_each(conn, df_header, df_readings,
+                                                                load)
+
+            with metrics.stage('commit'):
+                stats = {file_key: pending_stats.pop(file_key) for file_key in file_keys}
+                record_files(conn, stats)
+
+                # Quarantine of the failed files, the others leave it
+                parse_errors = parse_stats.get('errors', {})
+                record_failures(conn, run_id, 'parse', parse_errors)
+                record_failures(conn, run_id, 'load', load_errors)
+                clear_failures(conn, [file_key for file_key in file_keys
+                                      if file_key not in parse_errors
+                                      and file_key not in load_errors])
+
+                report = Counter({
+                    'files':  len(batch),
+                    'parsed': len(df_header),
+                    'failed': len(parse_errors) + len(load_errors),
+                    })
+                report.update(counts)
+
+                batch_no += 1
+                record_batch(conn, run_id, batch_no, file_keys, report)
+                conn.commit()
+
+            if changes is not None:
+                with metrics.stage('parquet'):
+                    _write_parquet(parquet_path, changes, timezone, f'{run_id}-{batch_no}')
+                changes.clear()
+
+            metrics.add_bytes(sum(size for size, _ in stats.values()))
+            metrics.add_rows(report.pop('readings_accepted', 0), rejected_rows)
+
+            totals.update(report)
+            yield report
+
+    except (GeneratorExit, KeyboardInterrupt):
+        # Stopped by the caller: the committed batches are kept
+        _finish(conn, run_id, 'interrupted')
+        raise
+
+    except BaseException:
+        _finish(conn, run_id, 'failed')
+        raise
+
+    finish_run(conn, run_id, 'completed')
+
+
+def _finish(conn, run_id, status):
+    # Status of a run that stopped. If the DB can't be written (e.g. it is
+    # locked), the run stays 'running', which the next run reads as interrupted
+    try:
+        conn.rollback()
+        finish_run(conn, run_id, status)
+    except sqlite3.Error as e:
+        print(f'Could not record the end of run {run_id}: {e}')
+
+
+def _spool(conn, new_files):
+    # (file_key, (size, mtime_ns)) pairs to load again, in a temp table (they
+    # are read twice with reprocess). Committed, so that the rollback of a
+    # batch does not empty it
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS ReprocessFiles (
+            Position INTEGER PRIMARY KEY,
+            FileKey  TEXT NOT NULL,
+            Size     INTEGER,
+            MTimeNs  INTEGER
+        )""")
+    conn.execute("DELETE FROM ReprocessFiles")
+    conn.executemany("INSERT INTO ReprocessFiles (FileKey, Size, MTimeNs) VALUES (?, ?, ?)",
+                     ((file_key, size, mtime_ns) for file_key, (size, mtime_ns) in new_files))
+    conn.commit()
+
+
+def _spooled(conn, stored_only=False, chunk_size=500):
+    # Generator of the pairs of ReprocessFiles, in the listing order, read
+    # chunk_size at a time. stored_only: only the files with a version in
+    # MeterHeader
+    where = ("AND EXISTS (SELECT 1 FROM MeterHeader h WHERE h.FileKey = s.FileKey)"
+             if stored_only else "")
+    position = 0
+    while True:
+        chunk = conn.execute(f"""
+            SELECT Position, FileKey, Size, MTimeNs FROM ReprocessFiles s
+            WHERE Position > ? {where}
+            ORDER BY Position LIMIT ?""", (position, chunk_size)).fetchall()
+        if not chunk:
+            return
+        for position, file_key, size, mtime_ns in chunk:
+            yield file_key, (size, mtime_ns)
+
+
+def _find_rejected(conn, fetch, timezone, metrics, **parse_options):
+    # First pass of reprocess: FileKeys of the listed files whose stored
+    # version the current rules reject. Nothing is written here: the second
+    # pass replaces or deletes these versions, each in the transaction of the
+    # batch that also records its files in the manifest
+    items = (file_key for file_key, _ in _spooled(conn, stored_only=True))
+    if fetch is not None:
+        items = fetch(items)
+
+    rejected = set()
+    batches = parse_files(items, **parse_options)
+    for _, (df_header, df_readings), _ in metrics.timed(batches, 'reprocess'):
+        with metrics.stage('timestamps'):
+            df_header = convert_timestamps(df_header)
+        with metrics.stage('validation'):
+            _, _, df_rejected = validate(df_header, df_readings, timezone)
+        rejected.update(df_rejected['FileKey'])
+
+    return rejected
+
+
+def _load(conn, df_header, df_readings, file_readings, timezone, changes, metrics,
+          reprocess=False, rollups=False, run_id=None, replaceable=None):
+    # Timestamps, validation and write of parsed files (nothing is committed).
+    # Returns their counts, and the readings rejected per rule (a file can
+    # break several). The rules broken by each file are recorded in
+    # RejectedFiles (with run_id)
+    # changes: None, or a list to which the files inserted (df_header,
+    # df_readings) and the versions deleted are appended, for the Parquet copy
+    # replaceable: FileKeys of the stored versions now rejected (see
+    # upsert_tables), with reprocess
+    with metrics.stage('timestamps'):
+        df_header = convert_timestamps(df_header)
+
+    with metrics.stage('validation'):
+        file_keys = df_header.set_index('FileId')['FileKey']
+        df_days = df_header
+        df_header, df_readings, df_rejected = validate(df_header, df_readings, timezone)
+
+    # FileKeys inserted and versions deleted, for the Parquet copy
+    written, deleted = [], []
+
+    with metrics.stage('sqlite'):
+        if reprocess:
+            # Files loaded before that the current rules reject
+            delete_files(conn, file_keys[file_keys.index.isin(df_rejected['FileId'])].unique(),
+                         deleted)
+        n_files, n_readings = upsert_tables(conn, df_header, df_readings, written, deleted,
+                                            replaceable=replaceable)
+
+    rollup_days = 0
+    if rollups:
+        from xml_parser_rollup import update_rollups
+        with metrics.stage('rollup'):
+            # Every day of the batch, rejected files included (with
+            # reprocess, their day may have been deleted)
+            rollup_days = update_rollups(conn, df_days, timezone)
+
+    counts = Counter({
+        'valid':             len(df_header),
+        'rejected':          df_rejected['FileId'].nunique(),
+        'files_written':     n_files,
+        'readings_written':  n_readings,
+        'parquet_rows':      n_readings if changes is not None else 0,
+        'rollup_days':       rollup_days,
+        'files_deleted':     sum(version[0] in replaceable for version in deleted)
+                             if replaceable else 0,
+        'readings_accepted': len(df_readings),
+        })
+    counts.update(f'rejected_{rule}' for rule in df_rejected['Rule'])
+
+    rejected_rows = df_rejected['FileId'].map(file_readings).fillna(0).astype(int)
+    record_rejections(conn, run_id, zip(df_rejected['FileKey'], df_rejected['Rule'].astype(str),
+                                        rejected_rows.tolist()))
+
+    if changes is not None:
+        # Same versions as in SQLite: only the files inserted
+        df_written = df_header[df_header['FileKey'].isin(written)]
+        changes.append((df_written,
+                        df_readings[df_readings['FileId'].isin(df_written['FileId'])],
+                        deleted))
+
+    return counts, Counter(rejected_rows.groupby(df_rejected['Rule'], observed=True)
+                                        .sum().to_dict())
+
+
+def _write_parquet(parquet_path, changes, timezone, name):
+    # Parquet copy of a committed batch: the rows of the versions it deleted
+    # are removed, then the files it inserted are written (see
+    # xml_parser_parquet.py)
+    # Imported here so that pyarrow is only needed for the Parquet output
+    from xml_parser_parquet import delete_parquet, write_parquet
+
+    # When the files are loaded one by one (see _load_each), a file inserted
+    # by the batch can be replaced by a later one: it is not written at all
+    written, deleted = set(), []
+    for df_header, _, versions in changes:
+        for version in versions:
+            if version[0] in written:
+                written.remove(version[0])
+            else:
+                deleted.append(version)
+        written.update(df_header['FileKey'])
+
+    delete_parquet(parquet_path, deleted, timezone)
+    if written:
+        df_header = pd.concat([df_header for df_header, _, _ in changes])
+        df_header = df_header[df_header['FileKey'].isin(written)]
+        df_readings = pd.concat([df_readings for _, df_readings, _ in changes])
+        write_parquet(df_header, df_readings[df_readings['FileId'].isin(df_header['FileId'])],
+                      parquet_path, timezone, name)
+
+
+def _load_each(conn, df_header, df_readings, load):
+    # Loads the files of a batch one at a time, each in a savepoint of the
+    # batch's transaction. Returns the counts of the files loaded and the
+    # {file_key: error} of the others
+    counts, rejected_rows, errors = Counter(), Counter(), {}
+
+    conn.execute('BEGIN')
+    for file_id, file_key in zip(df_header['FileId'].tolist(), df_header['FileKey']):
+        conn.execute('SAVEPOINT load_file')
+        try:
+            file_counts, file_rejected = load(df_header[df_header['FileId'] == file_id],
+                                              df_readings[df_readings['FileId'] == file_id])
+            counts.update(file_counts)
+            rejected_rows.update(file_rejected)
+        except SYSTEM_ERRORS:
+            raise
+        except Exception as e:
+            conn.execute('ROLLBACK TO load_file')
+            errors[file_key] = f'{type(e).__name__}: {e}'
+        conn.execute('RELEASE load_file')
+
+    return counts, rejected_rows, errors
+
+
+def _count(iterable, counter, key):
+    for item in iterable:
+        counter[key] += 1
+        yield item
@@ -4,143 +4,258 @@ Created on Tue Jun 24 23:54:29 2025
 
 @author: alex_
 
-Disclaimer: this code is intended to be run in a spark enviroment, it cannot be
-executed locally
-"""
-
-# Implementar paralelización con PySpark (lcon los archivos en un bucket de S3)
-
-# Recuerda instalar las librerías necesarias (también en cada worker, más fácil
-# hacerlo directamente en el cluster)
+Job de PySpark para parsear, validar y escribir los archivos en paralelo.
 
-# pip install xmltodict
-# pip install s3fs
+Funciona en modo local (spark-submit o python directamente) y en un cluster:
+    python xml_parser_pyspark.py --input input_data --output parquet_out
+    python xml_parser_pyspark.py --s3-bucket sample-bucket-name --s3-prefix root_folder/2025-05-07/ \\
+                                 --output s3a://sample-bucket-name/meter_data/
+    python xml_parser_pyspark.py --input input_data --jdbc-url jdbc:postgresql://host/db
 
-# --- Aplicación de la función de parseo en paralelo ---
-
-# IMPORTANTE: aunque ya hemos creado la sesión de S3 en el Master de Spark para acceder al
-# listado de archivos, y así poder particionarlos (repartirlos entre los Workers), como lo
-# que se envía a los workers no son los datos en sí sino la file key (la ruta en S3) de cada
-# archivo, cada worker debe establecer de nuevo esa conexión a S3 para poder leer los archivos 
+El driver solo lista las rutas de los archivos: el parseo, la validación y la
+escritura (Parquet particionado o JDBC) se hacen en los executors, así que la
+memoria del driver ya no limita el tamaño de los backfills (no hay collect()).
+"""
 
 # --- map() VS. mapPartitions() ---
 
 # - El RDD tiene elementos, en ese caso, las rutas de los archivos .xml
 # - Cuando se hace una partición, se dividen esos elementos en grupos o "particiones"
 
-# map() aplica la función a cada partición individualmente, de forma independiente.
-# Cada grupo de archivos que constituyen una partición se procesa en una única tarea,
-# y dentro de esa tarea se aplica la función que se le pasa a map (xml_parser_eurocontrol)
-# a cada elemento de la partición (por ejemplo, usando un bucle interno). Por eso, si se usa
-# map(), se establece una conexión a S3 POR CADA archivo .xml (subóptimo) (Piénsalo bien, es así)
+# map() aplica la función a cada elemento de la partición, de forma independiente.
+# Por eso, si se usa map(), habría que establecer una conexión a S3 POR CADA archivo .xml
+# (subóptimo)
 
 # mapPartitions() aplica la función a toda la partición a la vez: la función que pasemos
 # a mapPartitions debe ser capaz de recibir un iterador con todos los elementos de la partición,
-# y devolver otro iterador. Por eso, ahora sí es posible establecer la conexión a S3 una sola vez,
-# y después aplicar un "bucle for file_key in xml_files_in_partition"
+# y devolver otro iterador. Por eso, ahora sí es posible establecer la conexión a S3 una sola vez
+# por partición, y después descargar (en paralelo, con varios threads) y parsear sus archivos
 
-## Opción a. map:
-# Aplicar la función de parseo a cada archivo usando map, y descartando los resultados None
-# parsed_rdd = rdd.map(xml_parser_eurocontrol).filter(lambda x: x is not None)
+# IMPORTANTE: lo que se envía a los workers no son los datos en sí sino la file key (la ruta
+# en S3) de cada archivo, así que cada worker debe establecer de nuevo esa conexión a S3 para
+# poder leer los archivos
 
-# NOTA: Habría que escribir código dentro de xml_parser_eurocontrol que estableciese la conexión a S3
-# PERO no está porque vamos a optar por mapPartitions, y entonces la conexión se establece en otro lado
+# Libraries
+import argparse
+import os
 
-## Opción b. mapPartitions:
-# La función xml_parser_eurocontrol se encapsula dentro de otra función, que primero establece
-# la conexión a S3 para cada partición, y luego va parseando los archivos.
+from pathlib import Path
 
-# OBSERVACIÓN:
-# Una vez que ya hemos repartido los archivos entre distintos ordenadores, en cada
-# ordenador podemos también hacer MultiThreading. MultiThreading y Spark van
-# por separado, y se pueden combinar :)
+from pyspark.sql import Row, SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql import types as T
 
-# Libraries
-import os
-import datetime as dt
-import boto3
-import xmltodict
-import pandas as pd
-from pyspark.sql import SparkSession
+from xml_parser_func import HEADER_FIELDS, xml_parser
+
+
+ACT_PATH = Path(__file__).parent.resolve()
+
+# Scripts que necesitan los workers (se envían con addPyFile)
+WORKER_MODULES = ('xml_parser_func.py', 'xml_parser_s3.py')
+
+# Esquema explícito de las filas que devuelve process_partition (una por archivo)
+READING_SCHEMA = T.StructType([
+    T.StructField('Sequence', T.IntegerType()),
+    T.StructField('Value',    T.StringType()),   # str para poder validar los decimales
+    T.StructField('Quality',  T.StringType()),
+    ])
+
+FILE_SCHEMA = T.StructType(
+    [T.StructField('FileKey', T.StringType(), nullable=False)]
+    + [T.StructField(field, T.StringType()) for field in HEADER_FIELDS]
+    + [T.StructField('Readings', T.ArrayType(READING_SCHEMA))]
+    )
+
+FileRow = Row(*FILE_SCHEMA.fieldNames())
+ReadingRow = Row(*READING_SCHEMA.fieldNames())
+
+
+#%%
+# Parseo en los workers
+
+def _to_int(sequence):
+    # La validación descarta los Sequence que no sean enteros (quedan como null)
+    return int(sequence) if sequence is not None and sequence.isdigit() else None
+
+
+def process_partition(file_keys, s3_conf=None):
+    # Recibe un iterador con las file keys de la partición y devuelve otro con
+    # una Row por archivo (los archivos que no se pueden parsear se descartan)
+    if s3_conf:
+        # Crear el cliente S3 en el worker (una sola vez para cada partición),
+        # que descarga varios archivos a la vez mientras se parsean los anteriores
+        from xml_parser_s3 import S3Source
+        items = S3Source(**s3_conf).fetch(file_keys)
+    else:
+        items = ((file_key, None) for file_key in file_keys)
+
+    for file_key, data in items:
+        result = xml_parser(file_key, layout='long', data=data)
+
+        # Solo los resultados que no son None (ni vacíos)
+        if not result or not result[0]:
+            continue
+
+        header, readings = result
+        yield FileRow(
+            file_key,
+            *(header.get(field) for field in HEADER_FIELDS),
+            [ReadingRow(_to_int(sequence), value, quality)
+             for sequence, value, quality in zip(readings['Sequence'],
+                                                 readings['Value'],
+                                                 readings['Quality'])]
+            )
 
-# Faltaría definir o importar la función xml_parser
 
 #%%
-# Definir la función para mapPartitions
-def process_partition(xml_files_partition):
-    # Importante: importar librerías dentro de cada worker
-    import os
-    import boto3
-    import xmltodict
-    from concurrent.futures import ThreadPoolExecutor
-    import traceback
-     
-    # Crear el cliente S3 en el worker (una sola vez para cada partición)
-    session_worker = boto3.Session(aws_access_key_id = access_key,
-                                   aws_secret_access_key = secret_key)
-    
-    s3_client_worker = session_worker.client('s3')
-    
-    # # Sin multithreading
-    # data_list = []
-    # for file_key in xml_files_partition:
-    #     result = xml_parser_eurocontrol(file_key, s3_client_worker)
-    #     if result is not None:
-    #         data_list.append(result)
-
-    # METER MULTITHREADING EN CADA WORKER
-    # Reemplazar el bucle 'for file_key in partition' por el multithreading
-    try:
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            
-            futures = []
-            data_list = []  # Lista para almacenar los diccionarios
-            
-            for file_key in xml_files_partition:
-                future = executor.submit(xml_parser, file_key, s3_client_worker)
-                futures.append(future)
-            
-            for future in futures:
-                try:
-                    result = future.result()
-                    if result:  # Solo agregar si el resultado no es None
-                        data_list.append(result)
-                    # (Se quita el pbar porque se printearían para cada worker a la vez, sería absurdo)
-                except Exception as e:
-                    print(f"Error en el parseado del archivo {file_key}: {e}")          
-
-    except Exception:
-        print(traceback.format_exc())
-        return iter([])
-
-    # return iter(data_list) # recuerda, debe retornar un objeto iterable (requisito de mapPartitions)
-    return data_list # data_list ya lo es (da igual poner o no el iter())
+# Validación como expresiones de DataFrame (se ejecuta en los executors)
+
+def validate(df_files, timezone):
+    # Mismas reglas que xml_parser_validation.py. Devuelve el df con dos
+    # columnas nuevas: IsValid y RejectedRules (las reglas que no cumple)
+
+    # Timestamps con zona horaria (los que no la tienen se consideran inválidos).
+    # Estas expresiones leen los textos originales: las reglas se calculan
+    # antes de sustituir las columnas por los timestamps (ver el return)
+    offset = r'(Z|[+-]\d{2}:?\d{2})$'
+    from_ts = F.when(F.col('FromTimestamp').rlike(offset), _to_timestamp('FromTimestamp'))
+    to_ts   = F.when(F.col('ToTimestamp').rlike(offset), _to_timestamp('ToTimestamp'))
+
+    # 'timespan': exactamente un día local (24 horas, o 23/25 en los cambios de hora)
+    expected_to = F.to_utc_timestamp(
+        F.from_utc_timestamp(from_ts, timezone) + F.expr('INTERVAL 1 DAY'), timezone
+        )
+    ok_timespan = F.coalesce(to_ts == expected_to, F.lit(False))
+
+    # 'decimals': todos los valores con exactamente 2 decimales
+    ok_decimals = F.coalesce(
+        F.forall('Readings', lambda r: r['Value'].rlike(r'^[+-]?\d+\.\d{2}$')),
+        F.lit(False)
+        )
+
+    # 'sequence': empieza en 1 y va de uno en uno, sin huecos
+    ok_sequence = F.coalesce(
+        F.forall(F.transform('Readings', lambda r, i: r['Sequence'] == i + 1), lambda ok: ok),
+        F.lit(False)
+        )
+
+    rejected_rules = F.filter(
+        F.array(F.when(~ok_timespan, F.lit('timespan')),
+                F.when(~ok_decimals, F.lit('decimals')),
+                F.when(~ok_sequence, F.lit('sequence'))),
+        lambda rule: rule.isNotNull()
+        )
+
+    # Primero las reglas (sobre los textos), después los timestamps
+    return (df_files
+            .withColumn('RejectedRules', rejected_rules)
+            .withColumn('IsValid', F.size('RejectedRules') == 0)
+            .withColumn('FromTimestamp', from_ts)
+            .withColumn('ToTimestamp', to_ts)
+            .withColumn('CreationTimestamp', _to_timestamp('CreationTimestamp')))
+
+
+def _to_timestamp(col):
+    # null si el texto no es un timestamp (to_timestamp falla en modo ANSI)
+    return F.expr(f'try_cast({col} AS TIMESTAMP)')
+
+
+def to_readings(df_valid, timezone):
+    # Una fila por lectura, con los campos de cabecera, el valor ya numérico
+    # (decimal exacto, 2 decimales) y la fecha local del archivo para particionar
+    return (df_valid
+            .select(*HEADER_FIELDS,
+                    'FileKey',
+                    F.to_date(F.from_utc_timestamp('FromTimestamp', timezone)).alias('DeliveryDate'),
+                    F.explode('Readings').alias('Reading'))
+            .select('*', 'Reading.*')
+            .drop('Reading')
+            .withColumn('Value', F.col('Value').cast(T.DecimalType(18, 2))))
+
 
 #%%
-# Iniciar la SparkSession
-spark = SparkSession.builder.getOrCreate()
+# Job
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parseo de los archivos .xml con PySpark')
+    parser.add_argument('--input', help='carpeta local con los archivos .xml')
+    parser.add_argument('--s3-bucket', help='bucket de S3 con los archivos .xml')
+    parser.add_argument('--s3-prefix', default='', help='prefijo de los archivos en S3')
+    parser.add_argument('--endpoint-url', default=None, help='endpoint de S3 (p.ej. un servidor moto local)')
+    parser.add_argument('--output', default=str(ACT_PATH / 'parquet_out'),
+                        help='ruta de salida Parquet (local, hdfs:// o s3a://)')
+    parser.add_argument('--jdbc-url', default=None, help='escribir por JDBC en vez de Parquet')
+    parser.add_argument('--jdbc-table', default='MeterReadings')
+    parser.add_argument('--partitions', type=int, default=None,
+                        help='número de particiones del RDD (por defecto el paralelismo de Spark)')
+    parser.add_argument('--timezone', default='Europe/Zurich', help='zona horaria local de los archivos')
+    parser.add_argument('--master', default=None, help='p.ej. local[*] (por defecto el de spark-submit)')
+    args = parser.parse_args(argv)
+
+    if not args.input and not args.s3_bucket:
+        parser.error('hay que indicar --input o --s3-bucket')
+
+    # Iniciar la SparkSession
+    builder = SparkSession.builder.appName('xml_parser')
+    if args.master:
+        builder = builder.master(args.master)
+    spark = builder.config('spark.sql.session.timeZone', 'UTC').getOrCreate()
+
+    # Los workers necesitan el código del parser
+    for module in WORKER_MODULES:
+        spark.sparkContext.addPyFile(str(ACT_PATH / module))
+
+    # --- Listado de archivos (en el driver, solo las rutas) ---
+    if args.s3_bucket:
+        from xml_parser_s3 import S3Source
+        s3_conf = {'bucket_name': args.s3_bucket, 'endpoint_url': args.endpoint_url}
+        xml_files = [key for key, _ in S3Source(**s3_conf).list_objects(args.s3_prefix)]
+    else:
+        s3_conf = None
+        xml_files = [
+            os.path.join(os.path.abspath(args.input), filename)
+            for filename in os.listdir(args.input)
+            if filename.endswith('.xml')
+        ]
+
+    if not xml_files:
+        raise ValueError('No se han encontrado archivos .xml')
+
+    # --- Paralelizar y ejecutar parseado ---
+
+    # Crear un RDD con la lista, ie repartir los archivos entre los workers de Spark
+    num_slices = args.partitions or spark.sparkContext.defaultParallelism
+    rdd = spark.sparkContext.parallelize(xml_files, num_slices)
 
-""" Aquí habría que generar la lista de xml_files, ver script 'xml_parser_s3.py' """
-xml_files = ...
+    # Aplicar mapPartitions al RDD, y convertirlo en un DataFrame con esquema explícito
+    parsed_rdd = rdd.mapPartitions(lambda partition: process_partition(partition, s3_conf))
+    df_files = spark.createDataFrame(parsed_rdd, schema=FILE_SCHEMA)
 
-# --- Paralelizar y ejecutar parseado ---
+    # Se cachea porque se usa dos veces (archivos válidos y rechazados)
+    df_files = validate(df_files, args.timezone).persist()
 
-# Crear un RDD con la lista, ie repartir los archivos entre los workers de Spark
-rdd = spark.sparkContext.parallelize(xml_files)
+    df_readings = to_readings(df_files.filter('IsValid'), args.timezone)
 
-# Aplicar mapPartitions al RDD:
-parsed_rdd = rdd.mapPartitions(process_partition)
+    # --- Escritura directa desde los executors ---
+    if args.jdbc_url:
+        df_readings.write.jdbc(args.jdbc_url, args.jdbc_table, mode='append')
+    else:
+        # Particionado por fecha y DataType: las consultas que filtran por día
+        # solo leen las carpetas de ese día
+        (df_readings.write
+                    .mode('append')
+                    .partitionBy('DeliveryDate', 'DataType')
+                    .parquet(args.output.rstrip('/') + '/readings'))
 
-# Recoger los resultados en la variable data_list (*)
-data_list = parsed_rdd.collect()
+        # Archivos rechazados y por qué
+        (df_files.filter(~F.col('IsValid'))
+                 .select('FileKey', 'MeterPointId', 'DataType', 'RejectedRules')
+                 .write.mode('append')
+                 .parquet(args.output.rstrip('/') + '/rejected'))
 
-# (*) Nota: si los datos pasados a collect() son muy grandes, puede saturar la memoria.
-# En ese caso, es mejor seguir trabajando de forma distribuida o escribir directamente
-# los resultados en un sistema de archivos distribuido (como S3). Pero como ya hemos
-# comentado en el script xml_parser_main.py, un df de ~5000 filas es muy pequeño
+    df_files.unpersist()
+    spark.stop()
 
-# Así pues, ya se ha terminado la lectura y parseado en paralelo de los archivos
-# Ahora, el resto del código es igual a partir de esta línea:
-df = pd.DataFrame(dict_list)
 
-# Y ya se ejecuta todo en el master del cluster, no en los workers
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Read-side queries over meter_data.sqlite, for the dashboards and analyses:
+    - time_series:     readings of a meter for a range of days
+    - daily_totals:    total per local day and FlowDirection
+    - latest_versions: the version kept for each meter/day ('Final' if there
+                       is one, else 'Provisional', the newest of each type)
+    - daily_rollup / monthly_rollup: the precomputed rows of MeterDaily and
+                       MeterMonthly (runs with --rollups, see xml_parser_rollup.py),
+                       without reading the readings
+
+The queries filter on the indexed columns of MeterHeader (MeterPointId,
+FromTimestamp) and join MeterReadings through its primary key, and the
+results are returned as typed columns (datetimes in UTC, int64 hundredths
+and float64 values, categories).
+
+The results are kept in an LRU cache. SQLite increases PRAGMA data_version
+whenever another connection commits, so the cache is emptied as soon as an
+ingestion run commits a batch:
+    queries = MeterQueries('sqlite_db/meter_data.sqlite')
+    df = queries.time_series('541456700000000001', dt.date(2025, 5, 1), dt.date(2025, 6, 1))
+"""
+
+# Libraries
+import sqlite3
+
+from collections import OrderedDict
+
+import pandas as pd
+
+from xml_parser_db import DATA_TYPE_RANK, DAY_KEY
+from xml_parser_validation import DEFAULT_TIMEZONE
+
+
+# Kept version of each meter/day, as a CTE (the upsert already keeps only one,
+# this also covers DBs loaded before it). {where} filters MeterHeader
+_rank = " ".join(f"WHEN '{data_type}' THEN {value}"
+                 for data_type, value in DATA_TYPE_RANK.items())
+
+LATEST_CTE = f"""
+    WITH Ranked AS (
+        SELECT h.*,
+               ROW_NUMBER() OVER (
+                   PARTITION BY {', '.join(f'h.{col}' for col in DAY_KEY)}
+                   ORDER BY CASE h.DataType {_rank} ELSE -1 END DESC,
+                            h.CreationTimestamp DESC,
+                            h.FileId DESC
+               ) AS VersionRank
+        FROM MeterHeader h
+        WHERE {{where}}
+    ),
+    Latest AS (
+        SELECT * FROM Ranked WHERE VersionRank = 1
+    )"""
+
+
+class MeterQueries:
+
+    def __init__(self, file_db, timezone=DEFAULT_TIMEZONE, cache_size=128):
+        self.timezone   = timezone
+        self.cache_size = cache_size
+
+        # Read-only: the queries never lock the DB for the ingestion (which
+        # writes in WAL mode)
+        self.conn = sqlite3.connect(f'file:{file_db}?mode=ro', uri=True,
+                                    check_same_thread=False)
+
+        self._cache = OrderedDict()
+        self._data_version = None
+        self.hits = self.misses = 0
+
+    def close(self):
+        self.conn.close()
+
+    # --- Queries ---
+
+    def time_series(self, meter_point_id, start, end, flow_direction=None):
+        # Readings of the days of a meter starting in [start, end), with the
+        # start time of each interval
+        return self._cached(('time_series', meter_point_id, start, end, flow_direction),
+                            self._time_series, meter_point_id, start, end, flow_direction)
+
+    def daily_totals(self, start, end, meter_point_id=None):
+        # Total per local day and FlowDirection of the days starting in
+        # [start, end), for every meter or only one
+        return self._cached(('daily_totals', start, end, meter_point_id),
+                            self._daily_totals, start, end, meter_point_id)
+
+    def latest_versions(self, start, end, meter_point_id=None):
+        # Header of the version kept for each meter/day starting in [start, end)
+        return self._cached(('latest_versions', start, end, meter_point_id),
+                            self._latest_versions, start, end, meter_point_id)
+
+    def daily_rollup(self, start, end, meter_point_id=None):
+        # Rows of MeterDaily for the local days in [start, end)
+        return self._cached(('daily_rollup', start, end, meter_point_id),
+                            self._rollup, 'MeterDaily', 'Date', start, end, meter_point_id)
+
+    def monthly_rollup(self, start, end, meter_point_id=None):
+        # Rows of MeterMonthly for the months of the days in [start, end)
+        # (e.g. dt.date(2025, 1, 1), dt.date(2026, 1, 1) for 2025)
+        return self._cached(('monthly_rollup', start, end, meter_point_id),
+                            self._rollup, 'MeterMonthly', 'Month', start, end, meter_point_id)
+
+    def _time_series(self, meter_point_id, start, end, flow_direction):
+        where, params = self._where(start, end, meter_point_id)
+        if flow_direction is not None:
+            where += " AND h.FlowDirection = ?"
+            params.append(flow_direction)
+
+        df = pd.read_sql_query(
+            LATEST_CTE.format(where=where) + """
+            SELECT l.MeterPointId, l.FlowDirection, l.DataType, l.Resolution,
+                   l.FromTimestamp, r.Sequence, r.ValueCenti, r.Quality
+            FROM Latest l
+            JOIN MeterReadings r ON r.FileId = l.FileId
+            ORDER BY l.FlowDirection, l.FromTimestamp, r.Sequence
+            """, self.conn, params=params)
+
+        # Start of each interval: FromTimestamp + (Sequence - 1) * Resolution
+        from_ts = _to_datetime(df['FromTimestamp'])
+        step = df['Resolution'].map(
+            {resolution: pd.Timedelta(resolution) for resolution in df['Resolution'].unique()}
+            )
+        timestamp = from_ts + step * (df['Sequence'] - 1)
+
+        return pd.DataFrame({
+            'Timestamp':     timestamp,
+            'MeterPointId':  df['MeterPointId'].astype('category'),
+            'FlowDirection': df['FlowDirection'].astype('category'),
+            'DataType':      df['DataType'].astype('category'),
+            'Sequence':      df['Sequence'].astype('int32'),
+            'ValueCenti':    df['ValueCenti'].astype('int64'),
+            'Value':         df['ValueCenti'].to_numpy(dtype='float64') / 100,
+            'Quality':       df['Quality'].astype('category'),
+            })
+
+    def _daily_totals(self, start, end, meter_point_id):
+        where, params = self._where(start, end, meter_point_id)
+
+        df = pd.read_sql_query(
+            LATEST_CTE.format(where=where) + """
+            SELECT l.FromTimestamp, l.FlowDirection,
+                   SUM(r.ValueCenti) AS ValueCenti,
+                   COUNT(*) AS Readings,
+                   COUNT(DISTINCT l.MeterPointId) AS Meters
+            FROM Latest l
+            JOIN MeterReadings r ON r.FileId = l.FileId
+            GROUP BY l.FromTimestamp, l.FlowDirection
+            """, self.conn, params=params)
+
+        # FromTimestamp is the local midnight of the day (in UTC)
+        df['Date'] = self._local_date(df['FromTimestamp'])
+        df = (df.groupby(['Date', 'FlowDirection'], as_index=False)
+                [['ValueCenti', 'Readings', 'Meters']].sum())
+
+        return pd.DataFrame({
+            'Date':          df['Date'],
+            'FlowDirection': df['FlowDirection'].astype('category'),
+            'ValueCenti':    df['ValueCenti'].astype('int64'),
+            'Value':         df['ValueCenti'].to_numpy(dtype='float64') / 100,
+            'Readings':      df['Readings'].astype('int64'),
+            'Meters':        df['Meters'].astype('int64'),
+            })
+
+    def _latest_versions(self, start, end, meter_point_id):
+        where, params = self._where(start, end, meter_point_id)
+
+        df = pd.read_sql_query(
+            LATEST_CTE.format(where=where) + """
+            SELECT FileId, FileKey, MeterPointId, FromTimestamp, ToTimestamp,
+                   FlowDirection, Resolution, Unit, CreationTimestamp, DataType
+            FROM Latest
+            ORDER BY MeterPointId, FromTimestamp, FlowDirection
+            """, self.conn, params=params)
+
+        for col in ('FromTimestamp', 'ToTimestamp', 'CreationTimestamp'):
+            df[col] = _to_datetime(df[col])
+        for col in ('FlowDirection', 'Resolution', 'Unit', 'DataType'):
+            df[col] = df[col].astype('category')
+        df['FileId'] = df['FileId'].astype('int64')
+        df.insert(2, 'Date', self._local_date(df['FromTimestamp']))
+
+        return df
+
+    def _rollup(self, table, period, start, end, meter_point_id):
+        # The periods are stored as local 'YYYY-MM-DD' days or 'YYYY-MM' months
+        # (text, which compares as the dates do)
+        length = 10 if period == 'Date' else 7
+        where = f"{period} >= ? AND {period} < ?"
+        params = [pd.Timestamp(start).strftime('%Y-%m-%d')[:length],
+                  pd.Timestamp(end).strftime('%Y-%m-%d')[:length]]
+        if length == 7 and pd.Timestamp(end).day != 1:
+            # The month of end is partly in the range
+            params[1] = (pd.Timestamp(end) + pd.offsets.MonthBegin()).strftime('%Y-%m')
+        if meter_point_id is not None:
+            where = "MeterPointId = ? AND " + where
+            params.insert(0, str(meter_point_id))
+
+        df = pd.read_sql_query(
+            f"SELECT * FROM {table} WHERE {where} "
+            f"ORDER BY MeterPointId, {period}, FlowDirection",
+            self.conn, params=params)
+
+        if period == 'Date':
+            df['Date'] = pd.to_datetime(df['Date'], format='%Y-%m-%d')
+            df['FromTimestamp'] = _to_datetime(df['FromTimestamp'])
+        for col in ('MeterPointId', 'FlowDirection', 'Resolution', 'Unit', 'DataType'):
+            if col in df:
+                df[col] = df[col].astype('category')
+        for col in ('TotalCenti', 'PeakCenti', 'PeakHourCenti'):
+            df[col] = df[col].astype('Int64')
+            df[col.replace('Centi', '')] = df[col].to_numpy(dtype='float64', na_value=float('nan')) / 100
+
+        return df
+
+    # --- Helpers ---
+
+    def _where(self, start, end, meter_point_id):
+        # Filter on the indexed columns of MeterHeader. The timestamps are
+        # stored as text in UTC, which compares as the datetimes do
+        where = "h.FromTimestamp >= ? AND h.FromTimestamp < ?"
+        params = [self._sql_bound(start), self._sql_bound(end)]
+        if meter_point_id is not None:
+            where = "h.MeterPointId = ? AND " + where
+            params.insert(0, str(meter_point_id))
+        return where, params
+
+    def _sql_bound(self, value):
+        # Dates are local days (their midnight in self.timezone), naive
+        # datetimes are local times too
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is None:
+            ts = ts.tz_localize(self.timezone)
+        return ts.tz_convert('UTC').isoformat(sep=' ')
+
+    def _local_date(self, utc_values):
+        return _to_datetime(utc_values).dt.tz_convert(self.timezone).dt.tz_localize(None).dt.normalize()
+
+    def _cached(self, key, function, *args):
+        # LRU cache, emptied when another connection has committed since the
+        # last query
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._cache.clear()
+            self._data_version = data_version
+
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        else:
+            self.misses += 1
+            self._cache[key] = function(*args)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        # A copy, so that the caller can't modify the cached result
+        return self._cache[key].copy()
+
+    def clear_cache(self):
+        self._cache.clear()
+
+
+def _to_datetime(values):
+    return pd.to_datetime(values, utc=True, format='ISO8601')
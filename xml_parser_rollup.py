@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Rollup tables of meter_data.sqlite, precomputed from the stored versions so
+that the reports read one row per meter and day (or month) instead of every
+reading:
+    - MeterDaily:   one row per meter/day (same key as MeterHeader: DAY_KEY),
+                    with its local Date: total, peak interval, peak hour,
+                    readings, and readings whose Quality is not 'Measured'
+    - MeterMonthly: one row per meter, local month and FlowDirection, summed
+                    from MeterDaily (peaks are the highest of the month)
+
+They are updated by the pipeline after each batch is written, in the same
+transaction, and only for the meter/days of the files of the batch: every
+touched day (both FlowDirections) is computed again from what is stored (the
+new version, the older version if the new file was discarded, or nothing if
+the day was deleted), then every touched month from its days. The touched
+days are looked up through the indexes on (MeterPointId, FromTimestamp), so
+the cost of a batch does not grow with the size of the DB.
+
+The first time (tables missing on a DB already loaded), they are built from
+all the stored days (init_rollups), which can also be forced with
+rebuild_rollups.
+
+Usage (see run_pipeline in xml_parser_pipeline.py, --rollups):
+    init_rollups(conn, timezone)
+    update_rollups(conn, df_header, timezone)   # parsed files of a batch
+    conn.commit()
+"""
+
+# Libraries
+import pandas as pd
+
+from xml_parser_db import create_schema, sql_timestamp, table_exists
+from xml_parser_query import LATEST_CTE
+
+
+# Readings per hour of each Resolution, to sum them into hours for the peak
+# hour (others: one reading per hour or longer, the peak hour is the peak)
+READINGS_PER_HOUR = {'PT15M': 4, 'PT30M': 2, 'PT1H': 1, 'PT60M': 1}
+
+ROLLUP_SCHEMA = ("""
+    CREATE TABLE IF NOT EXISTS MeterDaily (
+        MeterPointId  TEXT NOT NULL,
+        FromTimestamp TEXT NOT NULL,
+        FlowDirection TEXT,
+        Date          TEXT NOT NULL,
+        FileId        INTEGER NOT NULL,
+        DataType      TEXT,
+        Resolution    TEXT,
+        Unit          TEXT,
+        TotalCenti    INTEGER NOT NULL,
+        PeakCenti     INTEGER,
+        PeakHourCenti INTEGER,
+        Readings      INTEGER NOT NULL,
+        NotMeasured   INTEGER NOT NULL,
+        PRIMARY KEY (MeterPointId, FromTimestamp, FlowDirection)
+    )""", """
+    CREATE TABLE IF NOT EXISTS MeterMonthly (
+        MeterPointId    TEXT NOT NULL,
+        Month           TEXT NOT NULL,
+        FlowDirection   TEXT,
+        Unit            TEXT,
+        TotalCenti      INTEGER NOT NULL,
+        PeakCenti       INTEGER,
+        PeakHourCenti   INTEGER,
+        Days            INTEGER NOT NULL,
+        ProvisionalDays INTEGER NOT NULL,
+        Readings        INTEGER NOT NULL,
+        NotMeasured     INTEGER NOT NULL,
+        PRIMARY KEY (MeterPointId, Month, FlowDirection)
+    )""",
+    # Reports over every meter for a range of days or months, and the months
+    # of a meter
+    """CREATE INDEX IF NOT EXISTS idx_MeterDaily_date
+       ON MeterDaily (Date, FlowDirection)""",
+    """CREATE INDEX IF NOT EXISTS idx_MeterDaily_meter
+       ON MeterDaily (MeterPointId, Date)""",
+    """CREATE INDEX IF NOT EXISTS idx_MeterMonthly_month
+       ON MeterMonthly (Month, FlowDirection)""",
+    )
+
+# READINGS_PER_HOUR as a SQL CASE (on Resolution)
+_per_hour = " ".join(f"WHEN '{resolution}' THEN {n}"
+                     for resolution, n in READINGS_PER_HOUR.items())
+
+
+def init_rollups(conn, timezone):
+    # Create the rollup tables. If they did not exist and days are already
+    # stored, they are built from all of them. Returns the days built.
+    # Not committed
+    create_schema(conn)
+    exists = table_exists(conn, 'MeterDaily')
+
+    for statement in ROLLUP_SCHEMA:
+        conn.execute(statement)
+
+    if exists:
+        return 0
+    return rebuild_rollups(conn, timezone)
+
+
+def rebuild_rollups(conn, timezone, chunk_size=50_000):
+    # Compute both tables again from all the stored days, chunk_size days at
+    # a time (in meter order, so that a month is rarely split between two
+    # chunks). Returns the days built. Not committed
+    for statement in ROLLUP_SCHEMA:
+        conn.execute(statement)
+    conn.execute("DELETE FROM MeterDaily")
+    conn.execute("DELETE FROM MeterMonthly")
+
+    cursor = conn.execute("""
+        SELECT DISTINCT MeterPointId, FromTimestamp FROM MeterHeader
+        ORDER BY MeterPointId, FromTimestamp""")
+
+    n_days = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        days = pd.DataFrame(rows, columns=['MeterPointId', 'FromTimestamp'])
+        days['Date'] = _local_date(days['FromTimestamp'], timezone)
+        _refresh(conn, days)
+        n_days += len(days)
+
+    return n_days
+
+
+def update_rollups(conn, df_header, timezone):
+    # Compute again the meter/days of these files (df_header of a batch, with
+    # the timestamps converted, valid and rejected files: a reprocessed file
+    # that is now rejected deletes its day), and their months. Returns the
+    # days updated. Not committed
+    days = df_header.loc[df_header['FromTimestamp'].notna()
+                         & df_header['MeterPointId'].notna(), ['MeterPointId', 'FromTimestamp']]
+    days = days.drop_duplicates()
+    if days.empty:
+        return 0
+
+    days = pd.DataFrame({
+        'MeterPointId':  days['MeterPointId'].tolist(),
+        'FromTimestamp': sql_timestamp(days['FromTimestamp']),
+        'Date':          _local_date(days['FromTimestamp'], timezone),
+        })
+    _refresh(conn, days)
+    return len(days)
+
+
+def _local_date(from_timestamps, timezone):
+    # FromTimestamp is the local midnight of the day (in UTC) --> 'YYYY-MM-DD'
+    utc = pd.to_datetime(pd.Series(from_timestamps), utc=True, format='ISO8601')
+    return utc.dt.tz_convert(timezone).dt.strftime('%Y-%m-%d').tolist()
+
+
+def _refresh(conn, days):
+    # days: DataFrame of MeterPointId, FromTimestamp (as stored) and Date
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS TouchedDays (
+            MeterPointId TEXT, FromTimestamp TEXT, Date TEXT
+        )""")
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS TouchedMonths (
+            MeterPointId TEXT, Month TEXT
+        )""")
+    conn.execute("DELETE FROM TouchedDays")
+    conn.execute("DELETE FROM TouchedMonths")
+    conn.executemany("INSERT INTO TouchedDays VALUES (?, ?, ?)",
+                     days[['MeterPointId', 'FromTimestamp', 'Date']]
+                     .itertuples(index=False, name=None))
+
+    # Filter on the touched days (through the indexes on MeterPointId, FromTimestamp)
+    touched = ("({p}MeterPointId, {p}FromTimestamp) IN "
+               "(SELECT MeterPointId, FromTimestamp FROM TouchedDays)")
+
+    # Months of the days, as they are now and as they were stored
+    conn.execute(f"""
+        INSERT INTO TouchedMonths
+        SELECT MeterPointId, substr(Date, 1, 7) FROM TouchedDays
+        UNION
+        SELECT MeterPointId, substr(Date, 1, 7) FROM MeterDaily WHERE {touched.format(p='')}""")
+
+    # Days: computed again from the version kept of each one
+    conn.execute(f"DELETE FROM MeterDaily WHERE {touched.format(p='')}")
+
+    conn.execute(LATEST_CTE.format(where=touched.format(p='h.')) + f""",
+        Days AS (
+            SELECT l.FileId, SUM(r.ValueCenti) AS TotalCenti, MAX(r.ValueCenti) AS PeakCenti,
+                   COUNT(*) AS Readings,
+                   SUM(CASE WHEN r.Quality = 'Measured' THEN 0 ELSE 1 END) AS NotMeasured
+            FROM Latest l
+            JOIN MeterReadings r ON r.FileId = l.FileId
+            GROUP BY l.FileId
+        ),
+        Hours AS (
+            SELECT l.FileId, SUM(r.ValueCenti) AS HourCenti
+            FROM Latest l
+            JOIN MeterReadings r ON r.FileId = l.FileId
+            GROUP BY l.FileId,
+                     (r.Sequence - 1) / (CASE l.Resolution {_per_hour} ELSE 1 END)
+        ),
+        PeakHours AS (
+            SELECT FileId, MAX(HourCenti) AS PeakHourCenti FROM Hours GROUP BY FileId
+        )
+        INSERT INTO MeterDaily
+            (MeterPointId, FromTimestamp, FlowDirection, Date, FileId, DataType,
+             Resolution, Unit, TotalCenti, PeakCenti, PeakHourCenti, Readings, NotMeasured)
+        SELECT l.MeterPointId, l.FromTimestamp, l.FlowDirection, t.Date, l.FileId,
+               l.DataType, l.Resolution, l.Unit, d.TotalCenti, d.PeakCenti,
+               p.PeakHourCenti, d.Readings, d.NotMeasured
+        FROM Latest l
+        JOIN TouchedDays t
+          ON t.MeterPointId = l.MeterPointId AND t.FromTimestamp = l.FromTimestamp
+        JOIN Days d ON d.FileId = l.FileId
+        JOIN PeakHours p ON p.FileId = l.FileId""")
+
+    # Months: summed again from their days
+    conn.execute("""
+        DELETE FROM MeterMonthly
+        WHERE (MeterPointId, Month) IN (SELECT MeterPointId, Month FROM TouchedMonths)""")
+    conn.execute("""
+        INSERT INTO MeterMonthly
+            (MeterPointId, Month, FlowDirection, Unit, TotalCenti, PeakCenti,
+             PeakHourCenti, Days, ProvisionalDays, Readings, NotMeasured)
+        SELECT d.MeterPointId, m.Month, d.FlowDirection, MAX(d.Unit),
+               SUM(d.TotalCenti), MAX(d.PeakCenti), MAX(d.PeakHourCenti), COUNT(*),
+               SUM(d.DataType = 'Provisional'), SUM(d.Readings), SUM(d.NotMeasured)
+        FROM TouchedMonths m
+        JOIN MeterDaily d
+          ON  d.MeterPointId = m.MeterPointId
+          AND d.Date >= m.Month || '-01' AND d.Date < m.Month || '-32'
+        GROUP BY d.MeterPointId, m.Month, d.FlowDirection""")
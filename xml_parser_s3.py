@@ -4,79 +4,144 @@ Created on Tue Jun 24 23:37:13 2025
 
 @author: alex_
 
-This file contains extra code fragments (not ready to run) showcasing the 
-of tools such as S3 buckets and PySpark in the taks
-
-
-Note: I have not created a S3 Bucket for this task, as it would incur in cost and 
-I do not think is neccesary for the purpose of this test. The code works 100% :)
-
-Therefore, the execution of this cell will fail. This code is displayed just
-as and example of how to get the files from S3
+S3 source for the ingestion pipeline (see xml_parser_pipeline.py):
+    - list_objects lists the .xml files of a prefix lazily, page by page, with
+      their size and modification time (so that the manifest can skip the
+      files already loaded without downloading them)
+    - fetch downloads the files with a pool of threads sharing one client
+      (and its connection pool), keeping up to max_in_flight GETs running
+      while the previous files are being parsed. Failed GETs are retried with
+      exponential backoff
+    - the bodies are handed to the parser as bytes (no decode/encode step)
+
+The same code works against any S3-compatible endpoint (endpoint_url), e.g. a
+local moto server or MinIO for testing:
+    moto_server -p 5000  -->  S3Source('sample-bucket-name', endpoint_url='http://localhost:5000')
+or with a client passed as is (tests/test_s3.py runs it on moto's mock_aws):
+    S3Source('sample-bucket-name', client=boto3.client('s3'))
 """
 
 # Option 2: if the files are in a remote storage (like an S3 bucket)
 
 # Libraries
-import datetime as dt
 import os
-from boto3.session import Session
-
-# S3 access info
-access_key = os.getenv('access_key_S3')
-secret_key = os.getenv('secret_key_S3')
-
-# Note: as a good practice, access info should not be written
-# directly on the script. Instead, there are different ways of
-# passing that info into the code execution. For example:
-#   - configure the credentials on the enviroment (running "aws configure")
-#   - use the params.cfg file as we did before with the paths
-#   - create windows enviroment and/or system variables and load
-#     them using os library and os.getenv() (as shown above)
-
-# Fictional s3 bucket name
-bucket_name = 'sample-bucket-name'
-
-# Fictional s3 prefix, assuming we are already parsing the files on a
-# daily basis and that each day folder name has format YYYY-MM-DD
-current_date = dt.datetime.now().date()
-s3_prefix = f'root_folder/{current_date}/'
-
-# Create S3 session
-session = Session(aws_access_key_id = access_key,
-                  aws_secret_access_key = secret_key)
-
-s3_client = session.client('s3')
-
-# The usual s3_client.list_objects_v2() method can only list up to 1000 items
-# As we are expecting up to 5000 files per day, we need you use paginator
-
-# List all xml files from S3 with a paginator
-paginator = s3_client.get_paginator('list_objects_v2')
-
-xml_files = [
-    obj['Key']  # key is the full s3 path of each element
-    for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_prefix)
-    # each element has an associated page including its content and metadata
-    if 'Contents' in page  # files do have Contents, not just metadata
-    for obj in page['Contents']
-    if obj['Key'].endswith('.xml') # select .xml files only
-]
-
-if not xml_files:
-    raise ValueError(f"No files found in the specified S3 prefix {s3_prefix}")
-
-# This code generates the xml files list in S3
-# Then, we would have to modify the function script "RE_xml_parser_func.py"
-# so that it would read the files from S3
-
-# An S3 file key can be read easily like this:
-
-# - pass the s3_client and the bucket_name onto the funcion as input args
-# - replace the "with open read" code with:
-#     response_obj = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-#     xml_data = response_obj['Body'].read().decode('utf-8')
-    
-# - then the function stays the same:
-#     data = xmltodict.parse(xml_data)
-#     etc...
+import random
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class S3Source:
+
+    def __init__(self, bucket_name, endpoint_url=None, max_in_flight=32,
+                 max_attempts=5, backoff_base=0.2, backoff_cap=10.0, client=None):
+        self.bucket_name   = bucket_name
+        self.max_in_flight = max_in_flight
+        self.max_attempts  = max_attempts
+        self.backoff_base  = backoff_base
+        self.backoff_cap   = backoff_cap
+
+        if client is None:
+            # Imported here so that boto3 is only needed when reading from S3
+            from boto3.session import Session
+            from botocore.config import Config
+
+            # Note: as a good practice, access info should not be written
+            # directly on the script. If these variables are not set, boto3
+            # uses its usual credentials chain ("aws configure", IAM role...)
+            session = Session(aws_access_key_id     = os.getenv('access_key_S3'),
+                              aws_secret_access_key = os.getenv('secret_key_S3'))
+
+            # One client shared by all threads (boto3 clients are thread
+            # safe), with enough pooled connections for every GET in flight
+            client = session.client(
+                's3',
+                endpoint_url=endpoint_url,
+                config=Config(max_pool_connections=max_in_flight,
+                              retries={'max_attempts': max_attempts, 'mode': 'standard'})
+                )
+
+        self.client = client
+
+        # Throughput counters (updated from the download threads)
+        self.files_read = 0
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+
+    def list_objects(self, prefix, suffix='.xml'):
+        # Generator of (key, (size, mtime_ns)) for the files of the prefix
+        # The usual list_objects_v2() can only list up to 1000 items, so we
+        # use a paginator (and the pages are only requested as they are needed)
+        paginator = self.client.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith(suffix):
+                    mtime_ns = int(obj['LastModified'].timestamp() * 1_000_000) * 1000
+                    yield obj['Key'], (obj['Size'], mtime_ns)
+
+    def get(self, key):
+        # Content of one object as bytes, retrying with exponential backoff
+        # (and full jitter). botocore already retries the request itself, this
+        # also covers the errors while reading the body
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = self.client.get_object(Bucket=self.bucket_name, Key=key)
+                data = response['Body'].read()
+                break
+
+            except ClientError as e:
+                # Missing objects or permissions won't be fixed by retrying
+                status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+                if 400 <= status < 500 and status not in (408, 429):
+                    raise
+                if attempt == self.max_attempts:
+                    raise
+
+            except (BotoCoreError, ConnectionError):
+                if attempt == self.max_attempts:
+                    raise
+
+            time.sleep(random.uniform(0, min(self.backoff_cap,
+                                             self.backoff_base * 2 ** (attempt - 1))))
+
+        with self._lock:
+            self.files_read += 1
+            self.bytes_read += len(data)
+
+        return data
+
+    def fetch(self, keys):
+        # Generator of (key, data) pairs, in the same order as keys. Up to
+        # max_in_flight downloads run at the same time, while the consumer
+        # (the parsing) works on the files already downloaded
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            pending = deque()
+
+            for key in keys:
+                pending.append((key, pool.submit(self.get, key)))
+
+                if len(pending) >= self.max_in_flight:
+                    yield from self._done(*pending.popleft())
+
+            while pending:
+                yield from self._done(*pending.popleft())
+
+    def _done(self, key, future):
+        try:
+            yield key, future.result()
+        except Exception as e:
+            # Skipped: it is not recorded as processed, so the next run
+            # tries it again
+            print(f'Failed to download s3://{self.bucket_name}/{key}.\n Error: ', e)
+
+    def throughput(self, seconds):
+        # Summary of the downloads, e.g. for the end of the run
+        seconds = max(seconds, 1e-9)
+        mb = self.bytes_read / 1e6
+        return (f'Downloaded {self.files_read} files ({mb:.1f} MB) in {seconds:.2f} s '
+                f'({self.files_read / seconds:.1f} files/s, {mb / seconds:.2f} MB/s)')
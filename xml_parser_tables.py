@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Long (tidy) layout: instead of one very wide row per file, the parsed files are
+stored as two tables:
+    - df_header:   one row per file (FileId, FileKey and the header fields)
+    - df_readings: one row per reading (FileId, Sequence, ValueCenti, Quality)
+
+Both tables are linked through FileId, which is just the position of the file
+in the current batch.
+
+The values are kept as exact integers in hundredths of the unit (centi-kWh,
+'9995.77' --> 999577): no float rounding, and 8 bytes per value instead of a
+str object. A value that does not have exactly 2 decimals is <NA>.
+"""
+
+# Libraries
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from xml_parser_func import HEADER_FIELDS, READING_FIELDS
+from xml_parser_timestamps import parse_timestamps
+
+
+# Columns of each table, in order
+HEADER_COLUMNS   = ('FileId', 'FileKey') + HEADER_FIELDS
+READINGS_COLUMNS = ('FileId', 'Sequence', 'ValueCenti', 'Quality')
+
+
+def build_tables(parsed_files):
+    # parsed_files: iterable of (file_key, (header, readings)) pairs, as
+    # returned by xml_parser(file_key, layout='long', scaled_values=True)
+
+    # Gather everything in plain lists first (one per column), so that each
+    # column is turned into an array only once
+    header_cols = {col: [] for col in HEADER_COLUMNS}
+    file_ids = []
+    reading_cols = {field: [] for field in READING_FIELDS}
+
+    for file_id, (file_key, (header, readings)) in enumerate(parsed_files):
+        header_cols['FileId'].append(file_id)
+        header_cols['FileKey'].append(file_key)
+        for field in HEADER_FIELDS:
+            header_cols[field].append(header.get(field))
+
+        file_ids.extend(repeat(file_id, len(readings['Sequence'])))
+        for field in READING_FIELDS:
+            reading_cols[field].extend(readings[field])
+
+    df_header = pd.DataFrame(header_cols, columns=list(HEADER_COLUMNS), dtype=object)
+    df_header['FileId'] = df_header['FileId'].astype('int32')
+
+    # Sequence: must be a plain integer, anything else becomes <NA>
+    sequence = pd.Series(reading_cols['Sequence'], dtype='string')
+    sequence = sequence.where(sequence.str.fullmatch(r'\d{1,9}', na=False))
+    sequence = pd.to_numeric(sequence, errors='coerce').astype('Int32')
+
+    # Value: already in hundredths (int), or None if it does not have
+    # exactly 2 decimals (see to_centi in xml_parser_func.py)
+    values = reading_cols['Value']
+    value_na = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    value_centi = np.fromiter((0 if value is None else value for value in values),
+                              dtype=np.int64, count=len(values))
+
+    df_readings = pd.DataFrame({
+        'FileId':        np.asarray(file_ids, dtype='int32'),
+        'Sequence':      sequence.array,
+        'ValueCenti':    pd.arrays.IntegerArray(value_centi, value_na),
+        'Quality':       pd.Categorical(reading_cols['Quality']),
+        })
+
+    return df_header, df_readings
+
+
+def concat_tables(chunks):
+    # Join several (df_header, df_readings) chunks into a single pair. The
+    # FileId of each chunk starts on 0, so it is shifted to stay unique
+    headers, readings = [], []
+    offset = 0
+
+    for df_header, df_readings in chunks:
+        headers.append(df_header.assign(FileId=df_header['FileId'] + offset))
+        readings.append(df_readings.assign(FileId=df_readings['FileId'] + offset))
+        offset += len(df_header)
+
+    if not headers:
+        return build_tables([])
+
+    df_header   = pd.concat(headers, ignore_index=True)
+    df_readings = pd.concat(readings, ignore_index=True)
+
+    # Categories may differ between chunks, which turns Quality into object
+    df_readings['Quality'] = df_readings['Quality'].astype('category')
+
+    return df_header, df_readings
+
+
+def convert_timestamps(df_header):
+    # Convert the timestamp columns to tz-aware datetimes in UTC
+    df_header = df_header.copy()
+
+    for col in df_header.columns:
+        if 'timestamp' in col.lower():
+
+            # Note: UTC+02:00 means these values are Local Time datetimes
+
+            # If a value has datetime format, but the UTC zone is missing, it
+            # must become NaT (see xml_parser_timestamps.py: each distinct
+            # string is parsed only once, and the usual layout with a fixed
+            # format)
+            df_header[col] = parse_timestamps(df_header[col].to_numpy(dtype=object))
+
+    return df_header
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Timestamp normalizer for the header fields (FromTimestamp, ToTimestamp,
+CreationTimestamp), written for the layout of our files:
+    2025-05-07T00:00:00+02:00
+
+How it works:
+    - the values are factorized first: FromTimestamp/ToTimestamp repeat in
+      almost every file of a day, so each distinct string is parsed only once
+    - the strings already seen (in this or the previous batches) are taken
+      from a cache
+    - the new ones with the usual layout are parsed with a fixed format, and
+      their offset is read from the last 6 characters. The values with the most
+      common offset of the batch are shifted to UTC at once (fast path), the
+      rest (mixed offsets, e.g. on DST change days) with their own offset,
+      everything through masks (no Python function per value)
+    - any other ISO 8601 value with an offset ('Z', '+0200', fractions of
+      second...) goes through pd.to_datetime
+    - values without offset (naive) or that are not timestamps become NaT
+"""
+
+# Libraries
+import numpy as np
+import pandas as pd
+
+
+# Usual layout: 'YYYY-MM-DDTHH:MM:SS+HH:MM' (25 characters)
+FIXED_LAYOUT = r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}[+-]\d{2}:\d{2}$'
+LOCAL_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Any value ending with a time zone designator
+HAS_OFFSET = r'(?:Z|[+-]\d{2}:?\d{2})$'
+
+# {string: UTC nanoseconds (NaT for naive or invalid values)}, shared by all
+# the batches of a run. It is emptied when it reaches CACHE_SIZE strings
+CACHE_SIZE = 200_000
+_cache = {}
+
+NAT = np.datetime64('NaT', 'ns').astype(np.int64)
+
+
+def parse_timestamps(values):
+    # Array-like of strings (or None) --> tz-aware DatetimeIndex in UTC
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+
+    new = [value for value in uniques if value not in _cache]
+    if new:
+        if len(_cache) + len(new) > CACHE_SIZE:
+            _cache.clear()
+        _cache.update(zip(new, _parse_unique(pd.Series(new, dtype=object))))
+
+    unique_ns = np.fromiter((_cache[value] for value in uniques),
+                            dtype=np.int64, count=len(uniques))
+
+    # NaN/None values have code -1
+    utc_ns = np.where(codes >= 0, unique_ns[codes] if len(unique_ns) else NAT, NAT)
+    return pd.DatetimeIndex(utc_ns.view('datetime64[ns]')).tz_localize('UTC')
+
+
+def _parse_unique(values):
+    # Series of distinct strings --> array of UTC nanoseconds (NaT if naive
+    # or invalid)
+    utc_ns = np.full(len(values), NAT, dtype=np.int64)
+    values = values.astype('string')
+
+    fixed = values.str.match(FIXED_LAYOUT, na=False).to_numpy(dtype=bool)
+    if fixed.any():
+        strings = values[fixed]
+
+        # Local time, with a fixed format (invalid dates, e.g. 2025-02-30,
+        # become NaT)
+        local_ns = pd.to_datetime(strings.str.slice(0, 19), format=LOCAL_FORMAT,
+                                  errors='coerce').to_numpy(dtype='datetime64[ns]')
+
+        # Offset in minutes: [+-]HH:MM
+        sign = np.where(strings.str.slice(19, 20).to_numpy() == '-', -1, 1)
+        offset_min = sign * (strings.str.slice(20, 22).astype(int).to_numpy() * 60
+                             + strings.str.slice(23, 25).astype(int).to_numpy())
+
+        # Fast path for the most common offset, one shift for all its values
+        offsets, counts = np.unique(offset_min, return_counts=True)
+        common = offsets[counts.argmax()]
+        is_common = offset_min == common
+
+        shifted = np.empty(len(strings), dtype='datetime64[ns]')
+        shifted[is_common] = local_ns[is_common] - np.timedelta64(int(common), 'm')
+        # Mixed offsets
+        shifted[~is_common] = (local_ns[~is_common]
+                               - offset_min[~is_common].astype('timedelta64[m]'))
+
+        utc_ns[fixed] = shifted.view(np.int64)
+
+    # Other layouts, only if they have an offset (naive values stay NaT)
+    other = ~fixed & values.str.contains(HAS_OFFSET, na=False).to_numpy(dtype=bool)
+    if other.any():
+        parsed = pd.to_datetime(values[other].astype(object), format='ISO8601',
+                                errors='coerce', utc=True)
+        utc_ns[other] = (parsed.dt.tz_convert(None)
+                               .to_numpy(dtype='datetime64[ns]').view(np.int64))
+
+    return utc_ns
+
+
+def clear_cache():
+    _cache.clear()
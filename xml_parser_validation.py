@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of the parsed files (long layout, see xml_parser_tables.py).
+
+Each rule is computed once for all files as a vectorized boolean mask, the
+masks are combined and both tables are filtered a single time. Files that fail
+any rule are dropped as a whole, and every failure is recorded (one row per
+file and rule) so that we know why each file was rejected.
+
+Rules:
+    - 'timespan': the file must cover exactly one local day, which is 24 hours
+                  except on DST change days (23 or 25 hours)
+    - 'decimals': every value must have exactly 2 decimals
+    - 'sequence': the sequence must start from 1 and go incrementally with
+                  no gaps
+"""
+
+# Libraries
+import numpy as np
+import pandas as pd
+
+
+RULES = ('timespan', 'decimals', 'sequence')
+
+# Local time zone of the files (used to know the length of each day)
+DEFAULT_TIMEZONE = 'Europe/Zurich'
+
+
+def check_timespan(df_header, timezone=DEFAULT_TIMEZONE):
+    # Timestamps are expected as tz-aware values (NaT if missing, naive or
+    # invalid, which makes the rule fail)
+    from_ts = pd.to_datetime(df_header['FromTimestamp'], utc=True)
+    to_ts   = pd.to_datetime(df_header['ToTimestamp'], utc=True)
+
+    # The same wall-clock time one day later, back in UTC: this is 24 hours
+    # after FromTimestamp, or 23/25 hours if the day has a DST change
+    local_from = from_ts.dt.tz_convert(timezone).dt.tz_localize(None)
+    expected_to = (local_from + pd.Timedelta(days=1)).dt.tz_localize(
+        timezone, ambiguous='NaT', nonexistent='NaT'
+        )
+
+    return (to_ts == expected_to).to_numpy()
+
+
+def check_decimals(df_header, df_readings):
+    # The decimals were checked by the parser, while the values were still
+    # text: the values without exactly 2 decimals are <NA>
+    invalid = df_readings['ValueCenti'].isna().to_numpy()
+    invalid_ids = df_readings['FileId'].to_numpy()[invalid]
+
+    return ~np.isin(df_header['FileId'].to_numpy(), invalid_ids)
+
+
+def check_sequence(df_header, df_readings):
+    # Position of each reading within its file (starting on 1), compared to
+    # the original 'Sequence' value (a missing Sequence is invalid too)
+    position = df_readings.groupby('FileId', sort=False).cumcount() + 1
+    invalid = df_readings['Sequence'].ne(position).fillna(True).to_numpy(dtype=bool)
+    invalid_ids = df_readings['FileId'].to_numpy()[invalid]
+
+    return ~np.isin(df_header['FileId'].to_numpy(), invalid_ids)
+
+
+def validate(df_header, df_readings, timezone=DEFAULT_TIMEZONE):
+    # Returns the valid (df_header, df_readings) and df_rejected, with one row
+    # per (FileId, FileKey, Rule) failure
+    checks = {
+        'timespan': check_timespan(df_header, timezone),
+        'decimals': check_decimals(df_header, df_readings),
+        'sequence': check_sequence(df_header, df_readings),
+        }
+
+    # Single combined mask, and a single filter of each table
+    mask_valid = np.logical_and.reduce(list(checks.values()))
+
+    valid_ids = df_header['FileId'].to_numpy()[mask_valid]
+    mask_readings = np.isin(df_readings['FileId'].to_numpy(), valid_ids)
+
+    df_rejected = pd.concat(
+        [df_header.loc[~mask, ['FileId', 'FileKey']].assign(Rule=rule)
+         for rule, mask in checks.items()],
+        ignore_index=True
+        )
+    df_rejected['Rule'] = pd.Categorical(df_rejected['Rule'], categories=RULES)
+
+    return df_header[mask_valid], df_readings[mask_readings], df_rejected